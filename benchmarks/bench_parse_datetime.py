@@ -0,0 +1,53 @@
+"""
+Микробенчмарк разбора дат лога: datetime.strptime против parser.parse_log_datetime
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parse_datetime [количество_дат]
+"""
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from parser import LOG_DATETIME_FORMAT, parse_log_datetime
+
+
+def make_timestamps(count):
+    """Последовательные метки времени, как в реальном логе: несколько записей в секунду"""
+    start = datetime(2024, 12, 2, 18, 0, 0, tzinfo=timezone(timedelta(hours=3)))
+    return [
+        (start + timedelta(milliseconds=137 * i)).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + ' +03:00'
+        for i in range(count)
+    ]
+
+
+def measure(func, values, repeat=3):
+    """Лучшее время из нескольких прогонов, в секундах"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in values:
+            func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    values = make_timestamps(count)
+
+    # Проверяем, что результаты совпадают
+    for value in values[:1000]:
+        assert parse_log_datetime(value) == datetime.strptime(value, LOG_DATETIME_FORMAT)
+
+    strptime_time = measure(lambda value: datetime.strptime(value.strip(), LOG_DATETIME_FORMAT), values)
+    fast_time = measure(parse_log_datetime, values)
+
+    print(f"Дат: {count}")
+    print(f"strptime:           {strptime_time:.3f} с ({count / strptime_time:,.0f} в секунду)")
+    print(f"parse_log_datetime: {fast_time:.3f} с ({count / fast_time:,.0f} в секунду)")
+    print(f"Ускорение: {strptime_time / fast_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Локальная замена Google Sheets для бенчмарков
+
+Реализует методы pygsheets, которые вызывает SheetsUploader, хранит данные в памяти,
+добавляет задержку на каждый запрос и отвечает ошибкой 429 при превышении квоты.
+Повторяет поведение pygsheets 2.0.6, от которого зависит корректность загрузки: append_table
+считает одной строкой все, что не список, и делает два запроса (values.append и refresh)
+"""
+import re
+import time
+import random
+import threading
+from collections import deque
+
+from pygsheets import WorksheetNotFound
+
+_CELL_RE = re.compile(r'([A-Z]+)(\d+)')
+
+
+class FakeResponse(dict):
+    """Аналог httplib2.Response: словарь заголовков с атрибутом status"""
+
+    def __init__(self, status: int):
+        super().__init__(status=str(status))
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Аналог googleapiclient.errors.HttpError"""
+
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(f'<HttpError {status}: {message}>')
+        self.resp = FakeResponse(status)
+
+
+def _parse_cell(label: str):
+    """'AB12' -> (строка, столбец), нумерация с 1"""
+    letters, digits = _CELL_RE.fullmatch(label).groups()
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+    return int(digits), col
+
+
+class FakeBackend:
+    """Общие для всех листов задержка, квота и случайные ошибки сервера"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, quota_per_minute: int = None,
+                 error_rate: float = 0.0, seed: int = 0, clock=time.monotonic):
+        """
+        :param latency: задержка ответа на каждый запрос в секундах
+        :param jitter: случайная добавка к задержке в секундах
+        :param quota_per_minute: сколько запросов в скользящую минуту разрешено, дальше - 429
+        :param error_rate: доля запросов, завершающихся ошибкой 503
+        :param seed: начальное значение генератора случайных чисел
+        :param clock: источник времени для квоты (в тестах - общий с RequestScheduler)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.request_times = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def request(self, name: str):
+        """Учитывает запрос: задержка, проверка квоты, случайный сбой"""
+        with self.lock:
+            self.requests += 1
+            now = self.clock()
+            if self.quota_per_minute is not None:
+                while self.request_times and now - self.request_times[0] > 60:
+                    self.request_times.popleft()
+                if len(self.request_times) >= self.quota_per_minute:
+                    self.throttled += 1
+                    raise FakeHttpError(429, f'Quota exceeded for {name}')
+                self.request_times.append(now)
+            fail = self.error_rate and self.random.random() < self.error_rate
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.failed += 1
+            raise FakeHttpError(503, f'Backend error in {name}')
+
+
+class FakeWorksheet:
+    """Лист таблицы в памяти с методами pygsheets.Worksheet"""
+
+    def __init__(self, backend: FakeBackend, title: str = 'Sheet1', rows: int = 1000, cols: int = 26,
+                 keep_values: bool = True):
+        """
+        :param keep_values: хранить значения строк; False - только считать строки (для больших прогонов)
+        """
+        self.backend = backend
+        self.spreadsheet = None
+        self.title = title
+        self.rows = rows
+        self.cols = cols
+        self.keep_values = keep_values
+        self.data = []
+        self.row_count = 0
+        self.cells_written = 0
+
+    def _set_row(self, index: int, values):
+        """Записывает строку с номером index (с 1)"""
+        self.row_count = max(self.row_count, index)
+        self.cells_written += len(values)
+        if not self.keep_values:
+            return
+        while len(self.data) < index:
+            self.data.append([])
+        self.data[index - 1] = list(values)
+
+    def get_row(self, row, **kwargs):
+        self.backend.request('get_row')
+        if not self.keep_values:
+            return []
+        return list(self.data[row - 1]) if row <= len(self.data) else []
+
+    def get_col(self, col, **kwargs):
+        self.backend.request('get_col')
+        values = [row[col - 1] if len(row) >= col else '' for row in self.data]
+        if not kwargs.get('include_empty', True) or not kwargs.get('include_tailing_empty', True):
+            while values and not values[-1]:
+                values.pop()
+        return values
+
+    def update_row(self, index, values, col_offset=0):
+        self.backend.request('update_row')
+        self._set_row(index, values)
+
+    def update_values(self, crange=None, values=None, **kwargs):
+        self.backend.request('update_values')
+        start, _ = crange.split(':')
+        start_row, _ = _parse_cell(start)
+        if start_row + len(values) - 1 > self.rows:
+            raise FakeHttpError(400, f'Range {crange} exceeds grid limits')
+        for offset, row in enumerate(values):
+            self._set_row(start_row + offset, row)
+
+    def update_values_batch(self, ranges, values, majordim='ROWS', parse=None):
+        self.backend.request('update_values_batch')
+        for crange, range_values in zip(ranges, values):
+            start, _ = crange.split(':')
+            start_row, _ = _parse_cell(start)
+            if start_row + len(range_values) - 1 > self.rows:
+                raise FakeHttpError(400, f'Range {crange} exceeds grid limits')
+            for offset, row in enumerate(range_values):
+                self._set_row(start_row + offset, row)
+
+    def _append(self, values):
+        """Добавляет строки после последней заполненной (values.append со вставкой строк)"""
+        first_row = self.row_count + 1
+        for offset, row in enumerate(values):
+            self._set_row(first_row + offset, row)
+        # values.append со вставкой строк расширяет лист сам
+        self.rows = max(self.rows, self.row_count)
+        return {'updates': {'updatedRows': len(values),
+                            'updatedCells': sum(len(row) for row in values)}}
+
+    def append_table(self, values, start='A1', end=None, dimension='ROWS', overwrite=False, **kwargs):
+        # Как в pygsheets: все, что не список, - одна строка, а после values.append - refresh
+        if type(values[0]) != list:
+            values = [values]
+        self.backend.request('values_append')
+        result = self._append(values)
+        self.refresh(False)
+        return result
+
+    def refresh(self, update_grid=False):
+        self.backend.request('refresh')
+
+    def resize(self, rows=None, cols=None):
+        self.backend.request('resize')
+        if rows is not None:
+            self.rows = rows
+        if cols is not None:
+            self.cols = cols
+
+
+class FakeSpreadsheet:
+    """Таблица в памяти с методами pygsheets.Spreadsheet"""
+
+    def __init__(self, backend: FakeBackend, spreadsheet_id: str = 'fake', keep_values: bool = True,
+                 title: str = 'Logs'):
+        self.backend = backend
+        self.id = spreadsheet_id
+        self.title = title
+        self.shared_with = []
+        self.keep_values = keep_values
+        self._worksheets = []
+        self._add(FakeWorksheet(backend, keep_values=keep_values))
+
+    def _add(self, worksheet: FakeWorksheet) -> FakeWorksheet:
+        worksheet.spreadsheet = self
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def worksheets(self, *args, **kwargs):
+        self.backend.request('worksheets')
+        return list(self._worksheets)
+
+    def worksheet_by_title(self, title):
+        self.backend.request('worksheet_by_title')
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=100, cols=26, **kwargs):
+        self.backend.request('add_worksheet')
+        return self._add(FakeWorksheet(self.backend, title, rows, cols, keep_values=self.keep_values))
+
+    def share(self, email_or_domain, role='reader', **kwargs):
+        self.backend.request('share')
+        self.shared_with.append((email_or_domain, role))
+
+
+class FakeSheetAPI:
+    """Низкоуровневые запросы pygsheets (client.sheet)"""
+
+    def __init__(self, client: 'FakeClient'):
+        self.client = client
+
+    def values_append(self, spreadsheet_id, values, major_dimension, range, **kwargs):
+        self.client.backend.request('values_append')
+        title = range.rsplit('!', 1)[0].strip("'").replace("''", "'") if '!' in range else None
+        spreadsheet = self.client.spreadsheets[spreadsheet_id]
+        worksheet = spreadsheet.sheet1
+        for item in spreadsheet._worksheets:
+            if item.title == title:
+                worksheet = item
+        # Как и настоящий API, значения принимаются только списком строк-списков
+        if not all(isinstance(row, (list, tuple)) for row in values):
+            raise FakeHttpError(400, 'Invalid values')
+        return worksheet._append(values)
+
+
+class FakeClient:
+    """Клиент с методом open_by_key, возвращающий таблицы в памяти"""
+
+    def __init__(self, backend: FakeBackend = None, keep_values: bool = True):
+        self.backend = backend or FakeBackend()
+        self.keep_values = keep_values
+        self.spreadsheets = {}
+        self.sheet = FakeSheetAPI(self)
+
+    def open_by_key(self, key):
+        self.backend.request('open_by_key')
+        if key not in self.spreadsheets:
+            self.spreadsheets[key] = FakeSpreadsheet(self.backend, key, keep_values=self.keep_values)
+        return self.spreadsheets[key]
+
+    def create(self, title, **kwargs):
+        self.backend.request('create')
+        key = f'fake-{len(self.spreadsheets) + 1}'
+        self.spreadsheets[key] = FakeSpreadsheet(self.backend, key, keep_values=self.keep_values, title=title)
+        return self.spreadsheets[key]
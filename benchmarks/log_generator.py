@@ -0,0 +1,137 @@
+"""
+Генератор синтетических логов cbs-managment-service для бенчмарков
+
+Запуск из корня проекта:
+    python -m benchmarks.log_generator путь/к/файлу.txt --lines 1000000
+"""
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+CAMERA_SYSTEMS = ['cam-north', 'cam-south', 'cam-east', 'cam-west', 'cam-gate-1', 'cam-gate-2']
+STATUS_CODES = ['200'] * 12 + ['400', '404', '409', '500', '502', '503', '504']
+ERRORS = [
+    'Timeout while waiting for response from identification service',
+    'Connection refused: upstream identification service is unavailable',
+    'Face not found on bestshot, quality below threshold',
+    'Internal Server Error: ' + 'System.NullReferenceException at Cbs.Management.Handlers. ' * 40,
+    'Bad Request: ' + '{"errors":{"descriptor":["The descriptor field is required."]}} ' * 200,
+]
+NOISE_LINES = [
+    'INFO  Cbs.Management.Service - Request received from {camera}',
+    'DEBUG Cbs.Management.Http - Sending request {request_id}',
+    'INFO  Cbs.Management.Service - Bestshot {bestshot} queued',
+    'WARN  Cbs.Management.Http - Slow response {duration} ms for {request_id}',
+]
+TZ = timezone(timedelta(hours=3))
+
+
+def _format_datetime(value: datetime) -> str:
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + ' +03:00'
+
+
+class LogGenerator:
+    """Генерирует строки лога: строки "Summary data" вперемешку с обычными строками"""
+
+    def __init__(self, seed: int = 42, start: datetime = None, noise_ratio: float = 3.0,
+                 error_ratio: float = 0.15, malformed_ratio: float = 0.01):
+        """
+        :param seed: начальное значение генератора случайных чисел
+        :param start: время первой записи
+        :param noise_ratio: среднее количество обычных строк на одну строку "Summary data"
+        :param error_ratio: доля запросов с текстом ошибки
+        :param malformed_ratio: доля строк "Summary data" с обрезанным или искаженным хвостом
+        """
+        self.random = random.Random(seed)
+        self.current = start or datetime(2024, 12, 2, 18, 0, tzinfo=TZ)
+        self.noise_ratio = noise_ratio
+        self.error_ratio = error_ratio
+        self.malformed_ratio = malformed_ratio
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def summary_line(self) -> str:
+        """Одна строка "Summary data" с 1-5 запросами"""
+        rnd = self.random
+        self.current += timedelta(milliseconds=rnd.randint(1, 400))
+        start = self.current
+        end = start + timedelta(milliseconds=rnd.randint(5, 3000))
+        values = [
+            'Summary data',
+            rnd.choice(CAMERA_SYSTEMS),
+            str(rnd.randint(1, 10 ** 9)),
+            _format_datetime(start),
+            f'{rnd.random():.3f}',
+            '' if rnd.random() < 0.9 else 'Blur,Pose',
+            _format_datetime(end),
+        ]
+        request_time = start
+        for _ in range(rnd.randint(1, 5)):
+            status = rnd.choice(STATUS_CODES)
+            error = rnd.choice(ERRORS) if status != '200' or rnd.random() < self.error_ratio else ''
+            duration = rnd.choice([rnd.randint(5, 300), rnd.randint(300, 2000), rnd.randint(2000, 30000)])
+            request_time += timedelta(milliseconds=duration)
+            values += [status, error, f'{duration} ms', self._uuid(), _format_datetime(request_time)]
+        values += [f'{rnd.getrandbits(64):016x}', self._uuid()]
+
+        line = ';'.join(values)
+        if rnd.random() < self.malformed_ratio:
+            kind = rnd.randint(0, 2)
+            if kind == 0:
+                # Строка оборвана посередине
+                line = line[:rnd.randint(20, len(line))]
+            elif kind == 1:
+                # Длительность без единиц измерения
+                line = line.replace(' ms', '', 1)
+            else:
+                # Лишние поля в конце
+                line += ';;extra;' + 'x' * rnd.randint(1, 100)
+        return line
+
+    def noise_line(self) -> str:
+        template = self.random.choice(NOISE_LINES)
+        return f'{_format_datetime(self.current)} ' + template.format(
+            camera=self.random.choice(CAMERA_SYSTEMS), request_id=self._uuid(),
+            bestshot=self.random.randint(1, 10 ** 9), duration=self.random.randint(1, 30000))
+
+    def lines(self, count: int):
+        """
+        Отдает count строк лога
+        :param count: общее количество строк, включая обычные
+        """
+        summary_probability = 1.0 / (1.0 + self.noise_ratio)
+        for _ in range(count):
+            if self.random.random() < summary_probability:
+                yield self.summary_line()
+            else:
+                yield self.noise_line()
+
+    def write(self, path: str, count: int) -> int:
+        """
+        Записывает count строк в файл
+        :return: размер файла в байтах
+        """
+        size = 0
+        with open(path, 'w', encoding='utf-8') as file:
+            for line in self.lines(count):
+                line += '\n'
+                file.write(line)
+                size += len(line.encode('utf-8'))
+        return size
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Генерация синтетического лога')
+    arg_parser.add_argument('path', help='путь к создаваемому файлу')
+    arg_parser.add_argument('--lines', type=int, default=10000, help='количество строк')
+    arg_parser.add_argument('--seed', type=int, default=42, help='начальное значение генератора')
+    args = arg_parser.parse_args()
+
+    size = LogGenerator(seed=args.seed).write(args.path, args.lines)
+    print(f"Записано {args.lines} строк ({size / 1024 / 1024:.1f} МБ) в {args.path}")
+
+
+if __name__ == '__main__':
+    main()
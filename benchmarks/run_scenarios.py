@@ -0,0 +1,143 @@
+"""
+Сценарии нагрузочного тестирования разбора и загрузки
+
+Для каждого сценария генерируется синтетический лог, затем в отдельном процессе замеряются
+скорость разбора и пиковая память, и время полной загрузки в локальную замену Google Sheets.
+
+Запуск из корня проекта:
+    python -m benchmarks.run_scenarios --scenarios 10k,1m
+    python -m benchmarks.run_scenarios --scenarios 10m --skip-upload
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from benchmarks.fake_sheets import FakeBackend, FakeClient
+from benchmarks.log_generator import LogGenerator
+
+SCENARIOS = {
+    '10k': 10000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+
+
+def _peak_rss_mb() -> float:
+    """Пиковое потребление памяти текущим процессом в МБ (ru_maxrss в Linux - в КБ)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_in_child(target, *args):
+    """Выполняет замер в отдельном процессе, чтобы пиковая память не смешивалась между сценариями"""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(target, args)
+
+
+def bench_parse(log_path: str, batch_size: int) -> dict:
+    """Разбор файла потоково, как в sheets_uploader.main"""
+    from parser import iter_file_batches
+
+    started = time.perf_counter()
+    rows = 0
+    for batch, _ in iter_file_batches(log_path, batch_size=batch_size):
+        rows += len(batch) - 1
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(log_path)
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 1),
+        'mb_per_second': round(size / 1024 / 1024 / elapsed, 2),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def bench_upload(log_path: str, state_dir: str, batch_size: int, latency: float,
+                 quota_per_minute: int, rate_per_minute: float) -> dict:
+    """Полный путь разбор -> дедупликация -> загрузка в локальную замену Google Sheets"""
+    import sheets_uploader
+    from metrics import Metrics, get_metrics, set_metrics
+    from parser import iter_file_batches
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sheets_uploader.STATE_DIRECTORY = state_dir
+    sheets_uploader.SHEETS_REQUESTS_PER_MINUTE = rate_per_minute
+    set_metrics(Metrics())
+
+    backend = FakeBackend(latency=latency, quota_per_minute=quota_per_minute)
+    client = FakeClient(backend, keep_values=False)
+
+    class FakeSheetsUploader(sheets_uploader.SheetsUploader):
+        def _get_client(self):
+            return client
+
+    started = time.perf_counter()
+    uploader = FakeSheetsUploader()
+    for batch, _ in iter_file_batches(log_path, batch_size=batch_size):
+        uploader.upload_data(batch)
+    elapsed = time.perf_counter() - started
+
+    counters = get_metrics().summary()['counters']
+    return {
+        'rows_uploaded': counters.get('rows_uploaded', 0),
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(counters.get('rows_uploaded', 0) / elapsed, 1),
+        'api_requests': backend.requests,
+        'api_throttled': backend.throttled,
+        'api_retries': counters.get('api_retries', 0),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Сценарии бенчмарков разбора и загрузки')
+    arg_parser.add_argument('--scenarios', default='10k,1m',
+                            help=f'сценарии через запятую из {", ".join(SCENARIOS)}')
+    arg_parser.add_argument('--data-dir', default=None,
+                            help='директория для сгенерированных логов (повторно используется)')
+    arg_parser.add_argument('--batch-size', type=int, default=5000, help='строк в порции загрузки')
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа API, с')
+    arg_parser.add_argument('--quota', type=int, default=6000, help='квота запросов в минуту у замены API')
+    arg_parser.add_argument('--rate', type=float, default=6000, help='ограничение запросов в минуту у загрузчика')
+    arg_parser.add_argument('--skip-upload', action='store_true', help='замерять только разбор')
+    arg_parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = arg_parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='gsheet_bench_')
+    os.makedirs(data_dir, exist_ok=True)
+    results = {}
+
+    for name in args.scenarios.split(','):
+        lines = SCENARIOS[name]
+        log_path = os.path.join(data_dir, f'bench_{name}.txt')
+        if not os.path.exists(log_path):
+            print(f"[{name}] генерация {lines} строк...")
+            LogGenerator(seed=lines).write(log_path, lines)
+
+        print(f"[{name}] разбор...")
+        result = {'lines': lines, 'file_mb': round(os.path.getsize(log_path) / 1024 / 1024, 1)}
+        result['parse'] = _run_in_child(bench_parse, log_path, args.batch_size)
+        print(f"[{name}] разбор: {result['parse']}")
+
+        if not args.skip_upload:
+            print(f"[{name}] загрузка...")
+            state_dir = tempfile.mkdtemp(prefix=f'gsheet_bench_state_{name}_')
+            result['upload'] = _run_in_child(bench_upload, log_path, state_dir, args.batch_size,
+                                             args.latency, args.quota, args.rate)
+            print(f"[{name}] загрузка: {result['upload']}")
+
+        results[name] = result
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import json
+import logging
+from typing import Dict, Optional
+
+from log_io import is_compressed
+
+
+class CheckpointStore:
+    """
+    Хранилище контрольных точек обработки лог-файлов
+    Для каждого файла запоминается inode, размер, время изменения и байтовое смещение
+    после последней полностью обработанной строки
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: путь к JSON-файлу с контрольными точками
+        """
+        self.path = path
+        self.checkpoints = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        """Загружает контрольные точки с диска"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ошибка при чтении контрольных точек {self.path}: {e}")
+            return {}
+
+    def save(self):
+        """Атомарно сохраняет контрольные точки на диск"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.checkpoints, file, ensure_ascii=False, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def reload(self):
+        """Отменяет несохраненные изменения, перечитывая контрольные точки с диска"""
+        self.checkpoints = self._load()
+
+    @staticmethod
+    def _key(log_path: str) -> str:
+        return os.path.abspath(log_path)
+
+    def _find_by_inode(self, stat: os.stat_result) -> Optional[Dict]:
+        """Ищет контрольную точку файла, переименованного при ротации"""
+        for checkpoint in self.checkpoints.values():
+            if checkpoint['inode'] == stat.st_ino and checkpoint['device'] == stat.st_dev:
+                return checkpoint
+        return None
+
+    def get_start_offset(self, log_path: str, stat: os.stat_result) -> Optional[int]:
+        """
+        Определяет, с какого смещения нужно читать файл
+        :param log_path: путь к лог-файлу
+        :param stat: результат os.stat для файла
+        :return: байтовое смещение или None, если новых данных в файле нет
+        """
+        checkpoint = self.checkpoints.get(self._key(log_path))
+
+        if checkpoint is None or checkpoint['inode'] != stat.st_ino or checkpoint['device'] != stat.st_dev:
+            # Новый файл по этому пути - возможно, это переименованный при ротации файл
+            checkpoint = self._find_by_inode(stat)
+            if checkpoint is None:
+                return 0
+
+        # В сжатых файлах смещение считается по распакованным данным и может превышать размер файла
+        compressed = is_compressed(log_path)
+        if not compressed and stat.st_size < checkpoint['offset']:
+            logging.info(f"Файл {log_path} был усечен, обработка начнется с начала")
+            return 0
+
+        unchanged = checkpoint['size'] == stat.st_size and checkpoint['mtime'] == stat.st_mtime
+        if compressed:
+            complete = checkpoint.get('complete', False)
+        else:
+            complete = checkpoint['offset'] >= stat.st_size
+        if unchanged and complete:
+            return None
+
+        return checkpoint['offset']
+
+    def update(self, log_path: str, stat: os.stat_result, offset: int, complete: bool = False):
+        """
+        Запоминает смещение после последней обработанной строки
+        :param log_path: путь к лог-файлу
+        :param stat: результат os.stat, по которому определялось начальное смещение
+        :param offset: байтовое смещение после последней обработанной строки
+        :param complete: файл дочитан до конца (нужно для сжатых файлов, где смещение
+                         нельзя сравнить с размером)
+        """
+        self.checkpoints[self._key(log_path)] = {
+            'inode': stat.st_ino,
+            'device': stat.st_dev,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'offset': offset,
+            'complete': complete,
+        }
+
+    def prune(self, log_paths):
+        """Удаляет контрольные точки файлов, которых больше нет в директории"""
+        keep = {self._key(path) for path in log_paths}
+        for key in list(self.checkpoints):
+            if key not in keep:
+                del self.checkpoints[key]
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy - необязательная зависимость
+    np = None
+
+from schema import DEFAULT_SCHEMA, LogSchema
+
+# Значение для отсутствующих дат
+MISSING_TIMESTAMP = -2 ** 63
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def is_available() -> bool:
+    """Проверяет, установлен ли numpy"""
+    return np is not None
+
+
+def to_epoch_us(value: Optional[datetime]) -> int:
+    """
+    Переводит datetime в микросекунды от начала эпохи
+    Даты без часового пояса считаются датами в UTC
+    """
+    if value is None:
+        return MISSING_TIMESTAMP
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class ColumnarLogs:
+    """
+    Колоночное представление записей лога на массивах numpy
+    Строится один раз после загрузки, статистика и фильтры считаются векторно
+    """
+
+    def __init__(self, records: List[Dict], parse_datetime: Callable, parse_duration: Callable,
+                 schema: LogSchema = None):
+        """
+        :param records: загруженные записи лога (LogParser.logs)
+        :param parse_datetime: функция разбора даты
+        :param parse_duration: функция разбора длительности
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        if np is None:
+            raise ImportError("Для колоночного представления нужен numpy")
+
+        count = len(records)
+        request_slots = (schema or DEFAULT_SCHEMA).request_slots
+        self.size = count
+        self.request_slots = request_slots
+        self.start_us = np.empty(count, dtype=np.int64)
+        self.end_us = np.empty(count, dtype=np.int64)
+        # Длительность из искаженной строки может не поместиться и в int64; миллисекунды
+        # реальных запросов в float64 представляются точно
+        self.duration = np.empty((count, request_slots), dtype=np.float64)
+        self.error = np.empty((count, request_slots), dtype=np.int32)
+        # Коды статуса хранятся интернированными строками: в искаженных строках в столбец статуса
+        # попадают хэши и прочие нечисловые значения, а фильтр сравнивает строки, как и без numpy
+        self.status_text = np.empty((count, request_slots), dtype=np.int32)
+
+        # Словари интернированных строк: код -> текст
+        self.error_categories: List[str] = []
+        self.status_categories: List[str] = []
+        error_codes: Dict[str, int] = {}
+        status_codes: Dict[str, int] = {}
+
+        for row, log in enumerate(records):
+            self.start_us[row] = to_epoch_us(parse_datetime(log.get('Start DateTime', '')))
+            self.end_us[row] = to_epoch_us(parse_datetime(log.get('End DateTime', '')))
+            for slot in range(request_slots):
+                i = slot + 1
+                status = log.get(f'Status Code {i}', ' ')
+                code = status_codes.get(status)
+                if code is None:
+                    code = status_codes[status] = len(self.status_categories)
+                    self.status_categories.append(status)
+                self.status_text[row, slot] = code
+                self.duration[row, slot] = parse_duration(log.get(f'Duration {i}', '0 ms'))
+                error = log.get(f'Error {i}', ' ')
+                code = error_codes.get(error)
+                if code is None:
+                    code = error_codes[error] = len(self.error_categories)
+                    self.error_categories.append(error)
+                self.error[row, slot] = code
+
+    def date_mask(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        """Маска записей, у которых Start DateTime попадает в диапазон [start, end]"""
+        mask = self.start_us != MISSING_TIMESTAMP
+        if start is not None:
+            mask &= self.start_us >= to_epoch_us(start)
+        if end is not None:
+            mask &= self.start_us <= to_epoch_us(end)
+        return mask
+
+    def status_mask(self, status_codes: Iterable[int]):
+        """Маска записей, у которых хотя бы один запрос завершился с одним из кодов"""
+        wanted = {str(code) for code in status_codes}
+        codes = np.asarray([code for code, status in enumerate(self.status_categories) if status in wanted],
+                           dtype=np.int32)
+        return np.isin(self.status_text, codes).any(axis=1)
+
+    def duration_mask(self, min_duration: int = None, max_duration: int = None):
+        """Маска записей, у которых длительность хотя бы одного запроса попадает в диапазон"""
+        slot_mask = np.ones(self.duration.shape, dtype=bool)
+        if min_duration is not None:
+            slot_mask &= self.duration >= min_duration
+        if max_duration is not None:
+            slot_mask &= self.duration <= max_duration
+        return slot_mask.any(axis=1)
+
+    def status_counts(self) -> Dict[str, Dict[str, int]]:
+        """Количество записей по кодам статуса для каждого слота запроса"""
+        counts = {}
+        for slot in range(self.request_slots):
+            codes, totals = np.unique(self.status_text[:, slot], return_counts=True)
+            counts[f'Status Code {slot + 1}'] = {
+                self.status_categories[code]: int(total) for code, total in zip(codes, totals)
+            }
+        return counts
+
+    def avg_duration(self) -> Dict[str, float]:
+        """Средняя длительность по каждому слоту запроса"""
+        if not self.size:
+            return {}
+        means = self.duration.mean(axis=0)
+        return {f'Duration {slot + 1}': float(means[slot]) for slot in range(self.request_slots)}
+
+    def date_range_rows(self):
+        """
+        Номера записей с минимальной и максимальной Start DateTime
+        :return: пара номеров или None, если дат нет
+        """
+        valid = np.flatnonzero(self.start_us != MISSING_TIMESTAMP)
+        if not valid.size:
+            return None
+        values = self.start_us[valid]
+        return int(valid[values.argmin()]), int(valid[values.argmax()])
@@ -0,0 +1,342 @@
+import os
+import math
+import sqlite3
+import hashlib
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import get_metrics
+
+# Ограничение SQLite на количество параметров в одном запросе
+_QUERY_CHUNK_SIZE = 500
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+def row_fingerprint(start_datetime: str, end_datetime: str) -> int:
+    """
+    Вычисляет компактный отпечаток записи по Start DateTime и End DateTime
+    :return: 64-битное знаковое целое (тип INTEGER в SQLite)
+    """
+    digest = hashlib.blake2b(f"{start_datetime}_{end_datetime}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума по отпечаткам строк
+    Отпечаток уже равномерно распределен, поэтому позиции битов получаются из него самого
+    (двойное хэширование), без повторного хэширования
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        """
+        :param capacity: на сколько отпечатков рассчитан фильтр
+        :param false_positive_rate: доля ложных срабатываний при заполнении до capacity
+        """
+        if capacity <= 0 or not 0 < false_positive_rate < 1:
+            raise ValueError("Емкость фильтра должна быть положительной, а доля ложных срабатываний - от 0 до 1")
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _probe(self, fingerprint: int):
+        value = fingerprint & _UINT64_MASK
+        size = self.size
+        return (value & 0xFFFFFFFF) % size, ((value >> 32) | 1) % size
+
+    def add(self, fingerprint: int):
+        bits, size = self.bits, self.size
+        position, step = self._probe(fingerprint)
+        for _ in range(self.hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+            position += step
+            if position >= size:
+                position -= size
+        self.count += 1
+
+    def __contains__(self, fingerprint: int) -> bool:
+        bits, size = self.bits, self.size
+        position, step = self._probe(fingerprint)
+        for _ in range(self.hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+            if position >= size:
+                position -= size
+        return True
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+    def load(self, bits: bytes, count: int):
+        """Восстанавливает сохраненное состояние фильтра с теми же размером и числом хэшей"""
+        self.bits = bytearray(bits)
+        self.count = count
+
+
+class DedupWindow:
+    """
+    Проверка дубликатов в памяти перед обращением к DedupIndex с ограниченным расходом памяти
+    Отпечатки строк за последнее окно времени (по Start DateTime) хранятся точно. Граница окна
+    (watermark) - самое позднее увиденное время минус допустимое опоздание; отпечатки старше
+    границы минус окно переносятся в фильтр Блума и освобождают память. В фильтр же при открытии
+    попадают все отпечатки из индекса, поэтому отрицательный ответ фильтра точен, и SQLite
+    проверяет только совпадения с фильтром. Память не растет с объемом истории: окно ограничено
+    временем, фильтр - заданной емкостью (при переполнении растет только доля обращений к SQLite)
+    """
+
+    def __init__(self, window_seconds: float, lateness_seconds: float, capacity: int,
+                 false_positive_rate: float):
+        """
+        :param window_seconds: сколько времени отпечатки хранятся точно
+        :param lateness_seconds: на сколько строка может опоздать относительно самой поздней
+        :param capacity: на сколько отпечатков рассчитан фильтр Блума
+        :param false_positive_rate: доля ложных срабатываний фильтра
+        """
+        self.window_seconds = window_seconds
+        self.lateness_seconds = lateness_seconds
+        self.bloom = BloomFilter(capacity, false_positive_rate)
+        # Отпечаток -> время строки и очередь (время, отпечаток) в порядке добавления для вытеснения
+        self.recent: Dict[int, float] = {}
+        self.order = deque()
+        # Время строк, прошедших проверку, но еще не записанных
+        self.pending: Dict[int, float] = {}
+        self.latest = None
+        self.overflow_logged = False
+
+    @property
+    def watermark(self) -> Optional[float]:
+        return None if self.latest is None else self.latest - self.lateness_seconds
+
+    def check(self, fingerprint: int) -> Optional[bool]:
+        """
+        :return: True - строка уже записана, False - точно новая, None - нужно спросить индекс
+        """
+        if fingerprint in self.recent:
+            return True
+        if fingerprint not in self.bloom:
+            return False
+        return None
+
+    def note(self, fingerprint: int, timestamp: Optional[float]):
+        """Запоминает время строки до ее записи (см. add)"""
+        self.pending[fingerprint] = timestamp
+
+    def add(self, fingerprints: Iterable[int]):
+        """Учитывает записанные строки и сдвигает границу окна"""
+        pending = self.pending
+        for fp in fingerprints:
+            timestamp = pending.pop(fp, None)
+            if timestamp is not None and (self.latest is None or timestamp > self.latest):
+                self.latest = timestamp
+            cutoff = self._cutoff()
+            if timestamp is None or cutoff is None or timestamp < cutoff:
+                # Время неизвестно или строка опоздала больше допустимого - сразу в фильтр
+                if fp not in self.recent:
+                    self.bloom.add(fp)
+                continue
+            if fp not in self.recent:
+                self.recent[fp] = timestamp
+                self.order.append((timestamp, fp))
+        self._evict()
+
+    def _cutoff(self) -> Optional[float]:
+        watermark = self.watermark
+        return None if watermark is None else watermark - self.window_seconds
+
+    def _evict(self):
+        cutoff = self._cutoff()
+        order, recent, bloom = self.order, self.recent, self.bloom
+        while order and order[0][0] < cutoff:
+            _, fp = order.popleft()
+            if recent.pop(fp, None) is not None:
+                bloom.add(fp)
+        self._check_capacity()
+
+    def _check_capacity(self):
+        bloom = self.bloom
+        if bloom.count > bloom.capacity and not self.overflow_logged:
+            self.overflow_logged = True
+            logging.warning(f"В фильтре Блума больше {bloom.capacity} отпечатков - чаще будет проверяться "
+                            f"индекс дубликатов; увеличьте DEDUP_BLOOM_CAPACITY")
+
+    def freeze(self):
+        """Переносит все точные отпечатки в фильтр, чтобы сохранить его целиком"""
+        for fp in self.recent:
+            self.bloom.add(fp)
+        self.recent = {}
+        self.order = deque()
+
+    def reset(self, fingerprints: Iterable[int]):
+        """Заполняет фильтр заново по всем отпечаткам индекса"""
+        self.bloom.clear()
+        self.recent = {}
+        self.order = deque()
+        self.pending = {}
+        self.latest = None
+        for fp in fingerprints:
+            self.bloom.add(fp)
+        self._check_capacity()
+
+
+class DedupIndex:
+    """
+    Локальный индекс уже загруженных в таблицу записей на SQLite
+    Хранит отпечатки строк, чтобы не скачивать столбцы таблицы при каждом запуске
+    """
+
+    def __init__(self, path: str, window: DedupWindow = None):
+        """
+        :param path: путь к файлу базы данных индекса
+        :param window: проверка в памяти перед обращением к индексу (None - только индекс)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints (fp INTEGER PRIMARY KEY) WITHOUT ROWID'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)'
+            )
+            # Фильтр Блума окна, сохраненный при закрытии; удаляется при любом изменении индекса
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS bloom (id INTEGER PRIMARY KEY, size INTEGER, hashes INTEGER, '
+                'count INTEGER, bits BLOB)'
+            )
+        saved = self.connection.execute('SELECT size, hashes, count, bits FROM bloom WHERE id = 0').fetchone()
+        self.has_saved_bloom = saved is not None
+        self.window = window
+        if window is not None:
+            if saved is not None and (saved[0], saved[1]) == (window.bloom.size, window.bloom.hashes):
+                window.bloom.load(saved[3], saved[2])
+            else:
+                logging.info(f"Заполнение фильтра Блума по индексу дубликатов {path}...")
+                window.reset(fp for (fp,) in self.connection.execute('SELECT fp FROM fingerprints'))
+
+    def _drop_saved_bloom(self):
+        """Удаляет сохраненный фильтр в текущей транзакции - он больше не покрывает индекс"""
+        if self.has_saved_bloom:
+            self.connection.execute('DELETE FROM bloom')
+            self.has_saved_bloom = False
+
+    def is_valid(self) -> bool:
+        """Проверяет, что индекс был построен и не сброшен"""
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'valid'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def invalidate(self):
+        """Помечает индекс как устаревший - при следующем запуске он будет перестроен по таблице"""
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('valid', '0')")
+
+    def rebuild(self, records: Iterable[Tuple[str, str]]) -> int:
+        """
+        Перестраивает индекс заново в одной транзакции
+        :param records: пары (Start DateTime, End DateTime) всех строк таблицы
+        :return: количество записей в индексе
+        """
+        with self.connection:
+            self._drop_saved_bloom()
+            self.connection.execute('DELETE FROM fingerprints')
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO fingerprints (fp) VALUES (?)',
+                ((row_fingerprint(start, end),) for start, end in records)
+            )
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('valid', '1')")
+        if self.window is not None:
+            self.window.reset(fp for (fp,) in self.connection.execute('SELECT fp FROM fingerprints'))
+        return len(self)
+
+    def existing(self, fingerprints: List[int], timestamps: List[Optional[float]] = None) -> Set[int]:
+        """
+        Возвращает отпечатки из списка, которые уже есть в индексе
+        :param fingerprints: список отпечатков
+        :param timestamps: время строк (Start DateTime, секунды) для окна в памяти
+        :return: множество найденных отпечатков
+        """
+        if self.window is None:
+            return self._query(fingerprints)
+
+        window = self.window
+        window.pending = {}
+        found, unknown = set(), []
+        for fp, timestamp in zip(fingerprints, timestamps or [None] * len(fingerprints)):
+            known = window.check(fp)
+            if known is None:
+                unknown.append(fp)
+            elif known:
+                found.add(fp)
+            window.note(fp, timestamp)
+        metrics = get_metrics()
+        metrics.inc('dedup_window_hits', len(found))
+        metrics.inc('dedup_index_lookups', len(unknown))
+        found.update(self._query(unknown))
+        return found
+
+    def _query(self, fingerprints: List[int]) -> Set[int]:
+        found = set()
+        for i in range(0, len(fingerprints), _QUERY_CHUNK_SIZE):
+            chunk = fingerprints[i:i + _QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self.connection.execute(
+                f'SELECT fp FROM fingerprints WHERE fp IN ({placeholders})', chunk
+            )
+            found.update(fp for (fp,) in cursor)
+        return found
+
+    def add(self, fingerprints: Iterable[int], meta: Optional[Dict[str, str]] = None):
+        """
+        Добавляет отпечатки успешно загруженных строк в одной транзакции
+        :param fingerprints: отпечатки строк
+        :param meta: служебные значения, которые нужно сохранить в той же транзакции
+        """
+        if self.window is not None:
+            fingerprints = list(fingerprints)
+        with self.connection:
+            self._drop_saved_bloom()
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO fingerprints (fp) VALUES (?)',
+                ((fp,) for fp in fingerprints)
+            )
+            if meta:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', meta.items()
+                )
+        if self.window is not None:
+            self.window.add(fingerprints)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Возвращает служебное значение по ключу"""
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def delete_meta(self, key: str):
+        """Удаляет служебное значение"""
+        with self.connection:
+            self.connection.execute('DELETE FROM meta WHERE key = ?', (key,))
+
+    def close(self):
+        if self.window is not None:
+            # Сохраняем фильтр, чтобы при следующем открытии не заполнять его по всему индексу
+            self.window.freeze()
+            bloom = self.window.bloom
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO bloom (id, size, hashes, count, bits) VALUES (0, ?, ?, ?, ?)',
+                    (bloom.size, bloom.hashes, bloom.count, bytes(bloom.bits))
+                )
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
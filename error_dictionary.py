@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import hashlib
+from typing import Dict, Iterable, List, Tuple
+
+from schema import DEFAULT_SCHEMA, LogSchema, is_request_slot
+
+# Заголовки листа-словаря ошибок
+ERROR_DICTIONARY_HEADERS = ['Error ID', 'Error']
+
+# Префикс коротких идентификаторов ошибок
+ERROR_ID_PREFIX = 'E'
+
+
+def error_id(text: str) -> str:
+    """
+    Короткий стабильный идентификатор текста ошибки
+    Считается по самому тексту, поэтому совпадает в разных процессах и запусках
+    :return: строка вида E1a2b3c4d5e6f (48 бит хэша)
+    """
+    return ERROR_ID_PREFIX + hashlib.blake2b(text.encode('utf-8'), digest_size=6).hexdigest()
+
+
+class ErrorDictionary:
+    """
+    Словарь ошибок на SQLite для компактной загрузки
+    В столбцы Error n вместо текста пишется короткий идентификатор, а тексты один раз
+    записываются на отдельный лист. Каждому новому тексту сразу назначается строка листа,
+    поэтому повторная запись после сбоя попадает в те же строки
+    """
+
+    def __init__(self, path: str, schema: LogSchema = None):
+        """
+        :param path: путь к файлу базы данных
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.request_columns = (schema or DEFAULT_SCHEMA).request_columns
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS errors ('
+                'id TEXT PRIMARY KEY, text TEXT, sheet_row INTEGER, dirty INTEGER)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS errors_dirty ON errors (dirty)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        # Тексты ошибок повторяются, поэтому идентификаторы кэшируются по тексту
+        self.ids: Dict[str, str] = {}
+        self.known = {row[0] for row in self.connection.execute('SELECT id FROM errors')}
+
+    def compact_rows(self, rows: Iterable[List[str]]) -> List[List[str]]:
+        """
+        Заменяет тексты ошибок в строках таблицы на идентификаторы и запоминает новые тексты
+        Заменяются только ошибки настоящих запросов: в пустых слотах короткой записи
+        в столбце Error оказывается Session ID, его оставляем как есть
+        :param rows: строки таблицы без заголовков
+        :return: новые строки с идентификаторами в столбцах Error n
+        """
+        ids = self.ids
+        new_errors = []
+        compacted = []
+        for row in rows:
+            row = list(row)
+            for status_column, column, duration_column in self.request_columns:
+                text = row[column]
+                if text == ' ' or not text.strip() or not is_request_slot(row[status_column], row[duration_column]):
+                    continue
+                short_id = ids.get(text)
+                if short_id is None:
+                    short_id = ids[text] = error_id(text)
+                    if short_id not in self.known:
+                        self.known.add(short_id)
+                        new_errors.append((short_id, text))
+                row[column] = short_id
+            compacted.append(row)
+
+        if new_errors:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO errors (id, text, sheet_row, dirty) VALUES (?, ?, NULL, 1)', new_errors
+                )
+        return compacted
+
+    def dirty_rows(self, first_row: int) -> List[Tuple[int, List[str]]]:
+        """
+        Возвращает еще не записанные на лист ошибки, назначая им строки листа
+        :param first_row: первая свободная строка листа, если курсор еще не сохранен
+        :return: список пар (номер строки листа, [идентификатор, текст]) по возрастанию строки
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'next_row'").fetchone()
+        next_row = int(row[0]) if row else first_row
+        with self.connection:
+            unassigned = self.connection.execute(
+                'SELECT id FROM errors WHERE sheet_row IS NULL ORDER BY rowid'
+            ).fetchall()
+            for (short_id,) in unassigned:
+                self.connection.execute('UPDATE errors SET sheet_row = ? WHERE id = ?', (next_row, short_id))
+                next_row += 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_row', ?)", (str(next_row),)
+            )
+        return [(sheet_row, [short_id, text]) for short_id, text, sheet_row in self.connection.execute(
+            'SELECT id, text, sheet_row FROM errors WHERE dirty = 1 ORDER BY sheet_row'
+        )]
+
+    def mark_clean(self, sheet_rows: List[int]):
+        """Отмечает строки листа как записанные"""
+        with self.connection:
+            self.connection.executemany('UPDATE errors SET dirty = 0 WHERE sheet_row = ?',
+                                        ((sheet_row,) for sheet_row in sheet_rows))
+
+    def text(self, short_id: str):
+        """Текст ошибки по идентификатору (или None)"""
+        row = self.connection.execute('SELECT text FROM errors WHERE id = ?', (short_id,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+import log_io
+from schema import DEFAULT_SCHEMA, LogSchema
+
+load_dotenv()
+
+# Путь к индексу по умолчанию - рядом с остальным состоянием загрузчика
+ID_INDEX_PATH = os.path.join(os.getenv('STATE_DIR', 'state'), 'ids.sqlite3')
+
+# Сколько строк лога разбирать между фиксациями при догоняющем индексировании
+CATCH_UP_COMMIT_LINES = 20000
+
+
+class IdCollector:
+    """
+    Сбор идентификаторов из строк таблицы по ходу разбора одного файла
+    Строки до сохраненной границы индекса файла пропускаются, поэтому повторный разбор
+    (например, после неудачной загрузки) не создает дублей и не сбивает номера записей
+    """
+
+    def __init__(self, index: 'IdIndex', file_id: int, watermark: int, rows: int):
+        self.index = index
+        self.file_id = file_id
+        self.watermark = watermark
+        self.rows = rows
+        self.request_id_columns = index.request_id_columns
+        self.entries = []
+
+    def add(self, row, line: str, line_offset: int):
+        """
+        Запоминает идентификаторы строки таблицы
+        :param row: строка таблицы в порядке столбцов схемы
+        :param line: строка лога, из которой получена строка таблицы
+        :param line_offset: байтовое смещение начала строки лога
+        """
+        if line_offset < self.watermark:
+            return
+        # Session ID берется из последнего поля строки лога, а не из столбца таблицы: в записи
+        # с меньшим числом запросов он попадает в столбцы первого пустого слота
+        session_id = line[line.rfind(';') + 1:].strip()
+        if session_id:
+            self.entries.append((session_id, self.file_id, line_offset, self.rows, 'session'))
+        for column in self.request_id_columns:
+            value = row[column].strip()
+            if value:
+                self.entries.append((value, self.file_id, line_offset, self.rows, 'request'))
+        self.rows += 1
+
+    def commit(self, offset: int):
+        """
+        Сохраняет накопленные идентификаторы и сдвигает границу индекса файла
+        :param offset: смещение после последней разобранной строки
+        """
+        if offset <= self.watermark:
+            return
+        self.index._commit(self.file_id, self.entries, offset, self.rows)
+        self.entries = []
+        self.watermark = offset
+
+
+class IdIndex:
+    """
+    Индекс Session ID и Request ID по всем лог-файлам на SQLite
+    Для каждого идентификатора хранится файл, байтовое смещение строки и номер записи в файле,
+    поэтому поиск читает с диска только совпавшие строки, не просматривая директорию.
+    Индекс пополняется при разборе и переживает перезапуски: у каждого файла есть граница,
+    до которой он проиндексирован
+    """
+
+    def __init__(self, path: str = ID_INDEX_PATH, schema: LogSchema = None):
+        """
+        :param path: путь к файлу базы данных индекса
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.schema = schema or DEFAULT_SCHEMA
+        self.request_id_columns = [
+            self.schema.column(f'Request ID {slot}') for slot in range(1, self.schema.request_slots + 1)
+        ]
+        # Индекс могут пополнять одновременно несколько процессов разбора
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'file_id INTEGER PRIMARY KEY, path TEXT, device INTEGER, inode INTEGER, '
+                'indexed_offset INTEGER, rows INTEGER)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS ids ('
+                'id TEXT, file_id INTEGER, line_offset INTEGER, row INTEGER, kind TEXT, '
+                'PRIMARY KEY (id, file_id, line_offset)) WITHOUT ROWID'
+            )
+
+    def _file_state(self, log_path: str) -> Tuple[int, int, int]:
+        """
+        Находит или заводит запись о файле с учетом ротации и усечения
+        :return: идентификатор файла, граница индекса и количество проиндексированных записей
+        """
+        path = os.path.abspath(log_path)
+        stat = os.stat(log_path)
+        with self.connection:
+            found = self.connection.execute(
+                'SELECT file_id, path, indexed_offset, rows FROM files WHERE device = ? AND inode = ?',
+                (stat.st_dev, stat.st_ino)
+            ).fetchone()
+            # Прежний файл по этому пути (если он другой) больше не доступен по нему
+            self.connection.execute(
+                'UPDATE files SET path = NULL WHERE path = ? AND NOT (device = ? AND inode = ?)',
+                (path, stat.st_dev, stat.st_ino)
+            )
+            if found is None:
+                cursor = self.connection.execute(
+                    'INSERT INTO files (path, device, inode, indexed_offset, rows) VALUES (?, ?, ?, 0, 0)',
+                    (path, stat.st_dev, stat.st_ino)
+                )
+                return cursor.lastrowid, 0, 0
+
+            file_id, known_path, indexed_offset, rows = found
+            if known_path != path:
+                # Файл переименован при ротации
+                self.connection.execute('UPDATE files SET path = ? WHERE file_id = ?', (path, file_id))
+            if not log_io.is_compressed(log_path) and stat.st_size < indexed_offset:
+                logging.info(f"Файл {log_path} был усечен, индекс идентификаторов по нему строится заново")
+                self.connection.execute('DELETE FROM ids WHERE file_id = ?', (file_id,))
+                self.connection.execute(
+                    'UPDATE files SET indexed_offset = 0, rows = 0 WHERE file_id = ?', (file_id,)
+                )
+                return file_id, 0, 0
+            return file_id, indexed_offset, rows
+
+    def _commit(self, file_id: int, entries: List[tuple], offset: int, rows: int):
+        # Вставка в порядке ключа заметно быстрее вставки в случайном порядке
+        entries.sort()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO ids (id, file_id, line_offset, row, kind) VALUES (?, ?, ?, ?, ?)',
+                entries
+            )
+            self.connection.execute(
+                'UPDATE files SET indexed_offset = ?, rows = ? WHERE file_id = ? AND indexed_offset < ?',
+                (offset, rows, file_id, offset)
+            )
+
+    def collector(self, log_path: str, start_offset: int = 0) -> IdCollector:
+        """
+        Готовит сбор идентификаторов для разбора файла с указанного смещения
+        Если файл проиндексирован не до start_offset (индекс включили позже загрузки),
+        пропущенная часть сначала дочитывается, чтобы номера записей остались сквозными
+        :param log_path: путь к лог-файлу
+        :param start_offset: смещение, с которого начнется разбор
+        """
+        file_id, watermark, rows = self._file_state(log_path)
+        if watermark < start_offset:
+            self.update_file(log_path, limit=start_offset)
+            file_id, watermark, rows = self._file_state(log_path)
+        return IdCollector(self, file_id, watermark, rows)
+
+    def update_file(self, log_path: str, limit: Optional[int] = None, include_partial: bool = False) -> int:
+        """
+        Индексирует файл от сохраненной границы до конца (или до limit)
+        :param log_path: путь к лог-файлу
+        :param limit: смещение начала строки, перед которым нужно остановиться
+        :param include_partial: индексировать последнюю строку без перевода строки
+        :return: количество проиндексированных записей
+        """
+        file_id, watermark, rows = self._file_state(log_path)
+        collector = IdCollector(self, file_id, watermark, rows)
+        convert = self.schema.compile_row_converter()
+        offset = watermark
+        with log_io.open_log_binary(log_path, watermark) as file:
+            for count, raw_line in enumerate(file, 1):
+                if limit is not None and offset >= limit:
+                    break
+                if not raw_line.endswith(b'\n') and not include_partial:
+                    break
+                line_offset = offset
+                offset += len(raw_line)
+                raw_line = raw_line.strip()
+                if raw_line.startswith(log_io.SUMMARY_MARKER):
+                    line = raw_line.decode('utf-8')
+                    collector.add(convert(line), line, line_offset)
+                if count % CATCH_UP_COMMIT_LINES == 0:
+                    collector.commit(offset)
+        collector.commit(offset)
+        return collector.rows - rows
+
+    def locate(self, value: str) -> List[Dict]:
+        """
+        Ищет идентификатор в индексе
+        :param value: Session ID или Request ID
+        :return: места, где он встречается: файл, смещение строки, номер записи в файле и вид
+        """
+        cursor = self.connection.execute(
+            'SELECT files.path, ids.line_offset, ids.row, ids.kind FROM ids '
+            'JOIN files ON files.file_id = ids.file_id '
+            'WHERE ids.id = ? AND files.path IS NOT NULL ORDER BY files.path, ids.line_offset',
+            (value,)
+        )
+        return [{'file': path, 'offset': offset, 'row': row, 'kind': kind}
+                for path, offset, row, kind in cursor]
+
+    def lookup(self, values: Iterable[str]) -> List[Dict]:
+        """
+        Возвращает записи лога с указанными идентификаторами
+        Строки читаются по смещениям из индекса; записи, в которых идентификатора уже нет
+        (файл подменили), отбрасываются
+        :param values: Session ID и/или Request ID
+        :return: места (как у locate) с разобранной записью в поле 'record'
+        """
+        parse_record = self.schema.compile_record_parser()
+        locations = {}
+        for value in values:
+            for location in self.locate(value):
+                location['id'] = value
+                locations.setdefault(location['file'], []).append(location)
+
+        results = []
+        for path, file_locations in locations.items():
+            if not os.path.exists(path):
+                logging.warning(f"Файл {path} из индекса идентификаторов не найден")
+                continue
+            with log_io.open_log_binary(path) as file:
+                position = 0
+                for location in sorted(file_locations, key=lambda item: item['offset']):
+                    if file.seekable():
+                        file.seek(location['offset'])
+                    else:
+                        # Поток без произвольного доступа - смещения идут по возрастанию, дочитываем вперед
+                        while position < location['offset']:
+                            chunk = file.read(min(location['offset'] - position, 1024 * 1024))
+                            if not chunk:
+                                break
+                            position += len(chunk)
+                    raw_line = file.readline()
+                    position = location['offset'] + len(raw_line)
+                    line = raw_line.strip().decode('utf-8', errors='replace')
+                    if not line.startswith(log_io.SUMMARY_MARKER.decode()):
+                        continue
+                    record = parse_record(line)
+                    if location['id'] in (value.strip() for value in record.values()):
+                        location['record'] = record
+                        results.append(location)
+        return results
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Поиск записей по Session ID и Request ID во всех лог-файлах')
+    arg_parser.add_argument('ids', nargs='*', help='идентификаторы для поиска')
+    arg_parser.add_argument('--index', default=ID_INDEX_PATH, help='путь к индексу идентификаторов')
+    arg_parser.add_argument('--logs', help='перед поиском дописать в индекс новые строки из этой директории')
+    arg_parser.add_argument('--json', action='store_true', help='выводить записи в JSON Lines')
+    args = arg_parser.parse_args()
+    if not args.ids and not args.logs:
+        arg_parser.error('нужно указать идентификаторы или директорию с логами')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = IdIndex(args.index)
+    try:
+        if args.logs:
+            indexed = 0
+            for log_file in sorted(os.listdir(args.logs)):
+                log_path = os.path.join(args.logs, log_file)
+                if os.path.isfile(log_path) and log_io.is_log_file(log_file):
+                    indexed += index.update_file(log_path)
+            logging.info(f"Проиндексировано новых записей: {indexed}")
+
+        results = index.lookup(args.ids)
+        for result in results:
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False))
+            else:
+                print(f"{result['file']}:{result['offset']} (запись {result['row']}, {result['kind']} {result['id']})")
+                for key, value in result['record'].items():
+                    if value.strip():
+                        print(f"  {key}: {value}")
+        if args.ids and not results:
+            print("Записи не найдены")
+            sys.exit(1)
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from columnar import to_epoch_us
+from schema import DEFAULT_SCHEMA, LogSchema
+
+
+class LogIndex:
+    """
+    Индексы по загруженным записям лога для повторяющихся запросов фильтрации
+    Строится один раз, после чего фильтр стоит O(log n + k) вместо полного прохода
+    """
+
+    def __init__(self, records: List[Dict], parse_datetime: Callable, parse_duration: Callable,
+                 schema: LogSchema = None):
+        """
+        :param records: загруженные записи лога (LogParser.logs)
+        :param parse_datetime: функция разбора даты
+        :param parse_duration: функция разбора длительности
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        slots = range(1, (schema or DEFAULT_SCHEMA).request_slots + 1)
+        # Отсортированные метки Start DateTime и соответствующие им номера записей
+        dated = []
+        # Инвертированный индекс: код статуса -> номера записей
+        self.status_rows: Dict[str, List[int]] = {}
+        # Длительности запросов каждой записи
+        self.durations: List[tuple] = []
+        max_durations = []
+        min_durations = []
+
+        for row, log in enumerate(records):
+            start = parse_datetime(log.get('Start DateTime', ''))
+            if start is not None:
+                dated.append((to_epoch_us(start), row))
+
+            for status in {log.get(f'Status Code {i}') for i in slots}:
+                if status is not None:
+                    self.status_rows.setdefault(status, []).append(row)
+
+            durations = tuple(parse_duration(log.get(f'Duration {i}', '0 ms')) for i in slots)
+            self.durations.append(durations)
+            max_durations.append((max(durations), row))
+            min_durations.append((min(durations), row))
+
+        dated.sort()
+        self.timestamps = [timestamp for timestamp, _ in dated]
+        self.timestamp_rows = [row for _, row in dated]
+
+        max_durations.sort()
+        self.max_duration_values = [value for value, _ in max_durations]
+        self.max_duration_rows = [row for _, row in max_durations]
+
+        min_durations.sort()
+        self.min_duration_values = [value for value, _ in min_durations]
+        self.min_duration_rows = [row for _, row in min_durations]
+
+    def rows_by_date(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[int]:
+        """Номера записей (по порядку в файле) с Start DateTime в диапазоне [start, end]"""
+        lo = bisect_left(self.timestamps, to_epoch_us(start)) if start is not None else 0
+        hi = bisect_right(self.timestamps, to_epoch_us(end)) if end is not None else len(self.timestamps)
+        return sorted(self.timestamp_rows[lo:hi])
+
+    def rows_by_status(self, status_codes: Iterable) -> List[int]:
+        """Номера записей (по порядку в файле), где хотя бы один запрос имеет один из кодов"""
+        rows = set()
+        for code in status_codes:
+            rows.update(self.status_rows.get(str(code), ()))
+        return sorted(rows)
+
+    def rows_by_duration(self, min_duration: int = None, max_duration: int = None) -> List[int]:
+        """Номера записей (по порядку в файле), где длительность хотя бы одного запроса в диапазоне"""
+        if min_duration is None and max_duration is None:
+            return list(range(len(self.durations)))
+        if max_duration is None:
+            # Хотя бы один запрос не короче min_duration <=> максимальная длительность >= min_duration
+            lo = bisect_left(self.max_duration_values, min_duration)
+            return sorted(self.max_duration_rows[lo:])
+        if min_duration is None:
+            # Хотя бы один запрос не длиннее max_duration <=> минимальная длительность <= max_duration
+            hi = bisect_right(self.min_duration_values, max_duration)
+            return sorted(self.min_duration_rows[:hi])
+
+        # Кандидаты по максимальной длительности, затем точная проверка по запросам
+        lo = bisect_left(self.max_duration_values, min_duration)
+        return sorted(
+            row for row in self.max_duration_rows[lo:]
+            if any(min_duration <= duration <= max_duration for duration in self.durations[row])
+        )
@@ -0,0 +1,147 @@
+import io
+import os
+import gzip
+import lzma
+import mmap
+
+try:
+    import zstandard
+except ImportError:  # zstandard - необязательная зависимость для .zst
+    zstandard = None
+
+SUMMARY_MARKER = b"Summary data"
+
+# Расширения сжатых логов после ротации
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.zst')
+
+# Начиная с какого размера несжатые файлы читаются через mmap
+MMAP_THRESHOLD_BYTES = int(os.getenv('MMAP_THRESHOLD_BYTES', str(16 * 1024 * 1024)))
+
+
+def is_compressed(path: str) -> bool:
+    """Проверяет, сжат ли лог-файл (по расширению)"""
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def is_log_file(name: str) -> bool:
+    """Проверяет, что файл - лог (.txt), возможно сжатый после ротации"""
+    for extension in COMPRESSED_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return name.endswith('.txt')
+
+
+def open_log_binary(path: str, start_offset: int = 0):
+    """
+    Открывает лог-файл на чтение в бинарном режиме, распаковывая сжатые файлы на лету
+    Смещения в сжатых файлах считаются по распакованному содержимому
+    :param start_offset: байтовое смещение, на которое нужно встать после открытия
+    """
+    file = _open_binary(path)
+    try:
+        if start_offset:
+            if file.seekable():
+                file.seek(start_offset)
+            else:
+                # Поток без произвольного доступа - пропускаем данные чтением
+                remaining = start_offset
+                while remaining > 0:
+                    chunk = file.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+    except Exception:
+        file.close()
+        raise
+    return file
+
+
+def _open_binary(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Для чтения .zst нужен пакет zstandard: pip install zstandard")
+        file = open(path, 'rb')
+        try:
+            # Потоковый читатель zstd не умеет читать по строкам - добавляем буферизацию
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(file, closefd=True))
+        except Exception:
+            file.close()
+            raise
+    return open(path, 'rb')
+
+
+def use_mmap(path: str) -> bool:
+    """Читать ли файл через mmap: только большие несжатые файлы"""
+    return not is_compressed(path) and os.path.getsize(path) >= MMAP_THRESHOLD_BYTES
+
+
+class MmapSummaryScanner:
+    """
+    Поиск строк "Summary data" в несжатом файле через mmap
+    Ищет маркер в байтах и выделяет только совпавшие строки, остальные строки
+    не копируются и не декодируются
+    """
+
+    def __init__(self, path: str, start_offset: int = 0, include_partial: bool = True,
+                 count_lines: bool = False):
+        """
+        :param path: путь к файлу
+        :param start_offset: байтовое смещение начала чтения (начало строки)
+        :param include_partial: обрабатывать последнюю строку без перевода строки
+        :param count_lines: считать общее количество просмотренных строк (для метрик)
+        """
+        self.path = path
+        self.start_offset = start_offset
+        self.include_partial = include_partial
+        self.count_lines = count_lines
+        # Смещение сразу после последней просмотренной строки
+        self.offset = start_offset
+        # Смещение начала последней отданной строки
+        self.line_start = start_offset
+        self.lines_read = 0
+
+    def __iter__(self):
+        """
+        Отдает строки "Summary data" без пробельных символов по краям
+        :return: итератор пар (строка в байтах, смещение после строки)
+        """
+        with open(self.path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size <= self.start_offset:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if self.include_partial or mm[size - 1:size] == b'\n':
+                    limit = size
+                else:
+                    # Последняя строка еще дописывается - останавливаемся перед ней
+                    limit = mm.rfind(b'\n', self.start_offset, size) + 1 or self.start_offset
+
+                pos = self.start_offset
+                while pos < limit:
+                    hit = mm.find(SUMMARY_MARKER, pos, limit)
+                    if hit < 0:
+                        break
+                    line_start = mm.rfind(b'\n', pos, hit) + 1 or pos
+                    line_end = mm.find(b'\n', hit, limit)
+                    next_pos = line_end + 1 if line_end >= 0 else limit
+                    if line_end < 0:
+                        line_end = limit
+
+                    if self.count_lines:
+                        self.lines_read += mm[pos:next_pos].count(b'\n')
+
+                    # Маркер должен стоять в начале строки (допускаются пробелы перед ним)
+                    if not mm[line_start:hit].strip():
+                        self.offset = next_pos
+                        self.line_start = line_start
+                        yield mm[hit:line_end].rstrip(), next_pos
+                    pos = next_pos
+
+                if self.count_lines and pos < limit:
+                    self.lines_read += mm[pos:limit].count(b'\n')
+                self.offset = limit
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+# Границы корзин гистограммы задержек запросов к API, в секундах
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_PREFIX = 'gsheet_uploader'
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами в формате Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, snapshot: Dict):
+        for i, count in enumerate(snapshot['counts']):
+            self.counts[i] += count
+        self.count += snapshot['count']
+        self.sum += snapshot['sum']
+
+    def snapshot(self) -> Dict:
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': round(self.sum, 6),
+        }
+
+
+class Metrics:
+    """
+    Счетчики, таймеры этапов и гистограммы одного запуска загрузчика
+    Таймер хранит суммарное время этапа в секундах
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: int = 1):
+        """Увеличивает счетчик"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name: str, seconds: float):
+        """Добавляет время к таймеру этапа"""
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, name: str):
+        """Контекстный менеджер, замеряющий время этапа"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def observe(self, name: str, value: float):
+        """Добавляет значение в гистограмму"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> Dict:
+        """Возвращает состояние метрик для передачи между процессами"""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': dict(self.timers),
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def merge(self, snapshot: Dict):
+        """Добавляет метрики, собранные в другом процессе"""
+        with self.lock:
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, value in snapshot['timers'].items():
+                self.timers[name] = self.timers.get(name, 0.0) + value
+            for name, data in snapshot['histograms'].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram(data['buckets'])
+                histogram.merge(data)
+
+    def summary(self) -> Dict:
+        """Итог запуска: метрики и производные скорости"""
+        data = self.snapshot()
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        counters = data['counters']
+        data['started_at'] = self.started_at
+        data['elapsed_seconds'] = round(elapsed, 3)
+        data['rates'] = {
+            'lines_per_second': round(counters.get('lines_read', 0) / elapsed, 1),
+            'bytes_per_second': round(counters.get('bytes_read', 0) / elapsed, 1),
+            'rows_uploaded_per_second': round(counters.get('rows_uploaded', 0) / elapsed, 1),
+        }
+        return data
+
+    def write_json(self, path: str):
+        """Сохраняет итог запуска в JSON"""
+        _write_atomic(path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path: str):
+        """Сохраняет метрики в формате textfile collector node_exporter"""
+        data = self.summary()
+        lines: List[str] = []
+        for name, value in sorted(data['counters'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+        for name, value in sorted(data['timers'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}_seconds'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value:.6f}']
+        for name, value in sorted(data['rates'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+        for name, histogram in sorted(data['histograms'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{metric}_sum {histogram["sum"]}')
+            lines.append(f'{metric}_count {histogram["count"]}')
+        metric = f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds'
+        lines += [f'# TYPE {metric} gauge', f'{metric} {time.time():.0f}']
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics(Metrics):
+    """Тихий режим: все операции ничего не делают"""
+
+    enabled = False
+
+    def inc(self, name: str, value: int = 1):
+        pass
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def timer(self, name: str):
+        return _NULL_TIMER
+
+    def observe(self, name: str, value: float):
+        pass
+
+    def merge(self, snapshot: Dict):
+        pass
+
+
+def _write_atomic(path: str, content: str):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+_metrics: Metrics = NullMetrics()
+
+
+def get_metrics() -> Metrics:
+    """Возвращает метрики текущего процесса"""
+    return _metrics
+
+
+def set_metrics(metrics: Metrics):
+    """Устанавливает метрики текущего процесса (Metrics или NullMetrics)"""
+    global _metrics
+    _metrics = metrics
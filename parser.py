@@ -1,56 +1,141 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 import os
-from datetime import datetime
+import time
+import logging
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+import columnar
+from log_index import LogIndex
+import log_io
+from metrics import Metrics, NullMetrics, get_metrics, set_metrics
+from schema import DEFAULT_SCHEMA, MAX_CELL_LENGTH, TRUNCATED_SUFFIX, LogSchema
+from id_index import IdCollector, IdIndex
+from error_dictionary import error_id
 
 # Загружаем переменные окружения
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Порядок столбцов в Google Sheets (см. schema.py)
+SHEET_HEADERS = list(DEFAULT_SCHEMA.headers)
+
+LOG_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f %z'
+
+# Кэш разобранных секунд: ('YYYY-MM-DD HH:MM:SS', смещение) -> datetime
+_SECOND_CACHE: Dict[tuple, datetime] = {}
+_SECOND_CACHE_LIMIT = 65536
+_TIMEZONE_CACHE: Dict[str, timezone] = {}
+
+
+def _parse_utc_offset(value: str) -> timezone:
+    """Разбирает смещение часового пояса вида '+03:00' или '+0300'"""
+    tz = _TIMEZONE_CACHE.get(value)
+    if tz is None:
+        digits = value[1:].replace(':', '')
+        if value[0] not in '+-' or len(digits) != 4 or not digits.isdigit():
+            raise ValueError(f"Некорректное смещение часового пояса: {value}")
+        offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+        tz = _TIMEZONE_CACHE[value] = timezone(-offset if value[0] == '-' else offset)
+    return tz
+
+
+def parse_log_datetime(date_str: str) -> datetime:
+    """
+    Быстрый разбор даты лога в формате 'YYYY-MM-DD HH:MM:SS.ffffff +HH:MM'
+    Дата до секунд и часовой пояс разбираются срезами один раз на секунду и кэшируются,
+    для каждой записи разбираются только доли секунды.
+    Строки в другом формате разбираются через strptime
+    :return: datetime с часовым поясом или None, если строку разобрать не удалось
+    """
+    value = date_str.strip()
+    space = value.find(' ', 20)
+    fraction = value[20:space]
+    if (space < 0 or value[19:20] != '.' or not 1 <= len(fraction) <= 6 or not fraction.isdigit()):
+        return _parse_log_datetime_slow(value)
+
+    key = (value[:19], value[space + 1:])
+    base = _SECOND_CACHE.get(key)
+    if base is None:
+        if (value[4] != '-' or value[7] != '-' or value[10] != ' '
+                or value[13] != ':' or value[16] != ':'):
+            return _parse_log_datetime_slow(value)
+        try:
+            base = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                            tzinfo=_parse_utc_offset(key[1]))
+        except ValueError:
+            return _parse_log_datetime_slow(value)
+        if len(_SECOND_CACHE) >= _SECOND_CACHE_LIMIT:
+            _SECOND_CACHE.clear()
+        _SECOND_CACHE[key] = base
+
+    return base.replace(microsecond=int(fraction.ljust(6, '0')))
+
+
+def _parse_log_datetime_slow(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, LOG_DATETIME_FORMAT)
+    except ValueError:
+        return None
+
+
+def parse_date_bound(date_str: str) -> datetime:
+    """
+    Разбирает границу фильтра по дате в формате 'YYYY-MM-DD'
+    Граница считается в UTC, чтобы сравнение с датами лога (с часовым поясом) было корректным
+    """
+    return datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
 class LogParser:
-    def __init__(self, log_path: str):
+    def __init__(self, log_path: str, lazy: bool = False, start_offset: int = 0,
+                 include_partial: bool = True, use_columnar: bool = False, schema: LogSchema = None,
+                 id_collector: IdCollector = None, predicate=None):
         """
         Инициализация парсера логов
         :param log_path: путь к файлу лога
+        :param lazy: не загружать файл в память, а читать записи потоково через iter_records()
+        :param start_offset: байтовое смещение, с которого начинается чтение файла
+        :param include_partial: обрабатывать последнюю строку без перевода строки
+                                (False, если файл еще может дописываться)
+        :param use_columnar: построить колоночное представление на numpy для быстрой
+                             статистики и фильтров (только вместе с загрузкой в память)
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        :param id_collector: куда складывать Session ID и Request ID разобранных строк
+                             (см. id_index.py; только для ленивого чтения без фильтров)
+        :param predicate: условие отбора строк (см. predicates.py); проверяется прямо при чтении,
+                          неподходящие строки не разбираются на поля
         """
         self.log_path = log_path
+        self.lazy = lazy
+        self.start_offset = start_offset
+        self.include_partial = include_partial
+        # Смещение сразу после последней полностью обработанной строки
+        self.offset = start_offset
+        # Смещение начала последней отданной строки "Summary data"
+        self.line_offset = start_offset
+        self.id_collector = id_collector
+        self.predicate = predicate
         self.logs = []
-        self.columns = [
-            'Type',
-            'Start DateTime',
-            'End DateTime',
-            'Status Code 1',
-            'Error 1',
-            'Duration 1',
-            'Request ID 1',
-            'DateTime 1',
-            'Status Code 2',
-            'Error 2',
-            'Duration 2',
-            'Request ID 2',
-            'DateTime 2',
-            'Status Code 3',
-            'Error 3',
-            'Duration 3',
-            'Request ID 3',
-            'DateTime 3',
-            'Status Code 4',
-            'Error 4',
-            'Duration 4',
-            'Request ID 4',
-            'DateTime 4',
-            'Status Code 5',
-            'Error 5',
-            'Duration 5',
-            'Hash',
-            'Session ID'
-        ]
-        self.load_data()
+        self.columnar = None
+        self._index = None
+        self.schema = schema or DEFAULT_SCHEMA
+        self.headers = list(self.schema.headers)
+        # Тексты ошибок интернируются: одинаковые тексты во всех записях - одна строка в памяти
+        self.error_texts = {}
+        # Функции разбора строк собираются по схеме один раз
+        self._parse_record = self.schema.compile_record_parser(self.error_texts)
+        self._convert_row = self.schema.compile_row_converter(self.error_texts)
+        if not lazy:
+            self.load_data()
+            if use_columnar:
+                self.build_columnar()
     
     def parse_datetime(self, date_str: str) -> datetime:
         """Парсит строку даты в datetime"""
         try:
-            return datetime.strptime(date_str.strip(), '%Y-%m-%d %H:%M:%S.%f %z')
-        except ValueError:
+            return parse_log_datetime(date_str)
+        except AttributeError:
             return None
     
     def parse_duration(self, duration_str: str) -> int:
@@ -60,140 +145,232 @@ class LogParser:
         except (ValueError, AttributeError):
             return 0
     
-    def _process_request_data(self, values, start_idx):
+    def _iter_summary_lines(self):
         """
-        Обрабатывает данные запроса из списка значений
-        :param values: список значений
-        :param start_idx: начальный индекс для обработки
-        :return: словарь с данными запроса и следующий индекс
+        Читает файл с self.start_offset и отдает только строки "Summary data"
+        Сжатые файлы (.gz, .xz, .zst) распаковываются на лету, большие несжатые читаются через mmap
+        По мере чтения обновляет self.offset
         """
-        request_data = {}
-        
-        # Status Code
-        request_data['Status Code'] = values[start_idx] if start_idx < len(values) else ' '
-        
-        # Error Message
-        error_idx = start_idx + 1
-        request_data['Error'] = values[error_idx] if error_idx < len(values) else ' '
-        
-        # Duration
-        duration_idx = start_idx + 2
-        duration = values[duration_idx] if duration_idx < len(values) else ' '
-        request_data['Duration'] = duration if duration and 'ms' in duration else ' '
-        
-        # Request ID
-        request_id_idx = start_idx + 3
-        request_data['Request ID'] = values[request_id_idx] if request_id_idx < len(values) else ' '
-        
-        # DateTime
-        datetime_idx = start_idx + 4
-        request_data['DateTime'] = values[datetime_idx] if datetime_idx < len(values) else ' '
-        
-        return request_data, start_idx + 5
+        if log_io.use_mmap(self.log_path):
+            yield from self._iter_summary_lines_mmap()
+        else:
+            yield from self._iter_summary_lines_stream()
+
+    def _iter_summary_lines_mmap(self):
+        """Поиск строк "Summary data" по байтам через mmap"""
+        metrics = get_metrics()
+        timed = metrics.enabled
+        scanner = log_io.MmapSummaryScanner(self.log_path, self.start_offset, self.include_partial,
+                                            count_lines=timed)
+        summary_lines = 0
+        read_time = 0.0
+        try:
+            started = time.perf_counter() if timed else 0.0
+            for raw_line, offset in scanner:
+                self.offset = offset
+                self.line_offset = scanner.line_start
+                summary_lines += 1
+                line = raw_line.decode('utf-8')
+                if timed:
+                    read_time += time.perf_counter() - started
+                yield line
+                if timed:
+                    started = time.perf_counter()
+            self.offset = scanner.offset
+            if timed:
+                read_time += time.perf_counter() - started
+        finally:
+            metrics.inc('lines_read', scanner.lines_read)
+            metrics.inc('summary_lines', summary_lines)
+            metrics.inc('bytes_read', self.offset - self.start_offset)
+            metrics.add_time('read', read_time)
+
+    def _iter_summary_lines_stream(self):
+        """Построчное чтение файла (в том числе сжатого)"""
+        metrics = get_metrics()
+        timed = metrics.enabled
+        lines_read = 0
+        summary_lines = 0
+        read_time = 0.0
+        try:
+            with log_io.open_log_binary(self.log_path, self.start_offset) as file:
+                offset = self.start_offset
+                started = time.perf_counter() if timed else 0.0
+                for raw_line in file:
+                    if not raw_line.endswith(b'\n') and not self.include_partial:
+                        # Строка еще дописывается - дочитаем ее при следующем запуске
+                        break
+                    line_offset = offset
+                    offset += len(raw_line)
+                    self.offset = offset
+                    lines_read += 1
+
+                    # Пропускаем строки, которые не начинаются с "Summary data", не декодируя их
+                    raw_line = raw_line.strip()
+                    if raw_line.startswith(log_io.SUMMARY_MARKER):
+                        summary_lines += 1
+                        self.line_offset = line_offset
+                        line = raw_line.decode('utf-8')
+                        if timed:
+                            read_time += time.perf_counter() - started
+                        yield line
+                        if timed:
+                            started = time.perf_counter()
+                if timed:
+                    read_time += time.perf_counter() - started
+        finally:
+            # Счетчики сбрасываются один раз на файл, чтобы не замедлять цикл
+            metrics.inc('lines_read', lines_read)
+            metrics.inc('summary_lines', summary_lines)
+            metrics.inc('bytes_read', self.offset - self.start_offset)
+            metrics.add_time('read', read_time)
+
+    def _parse_line(self, line: str) -> Dict:
+        """
+        Разбирает одну строку "Summary data" в словарь записи
+        :param line: строка лога без перевода строки
+        :return: словарь с полями записи
+        """
+        return self._parse_record(line)
+
+    def error_dictionary(self) -> Dict[str, str]:
+        """
+        Словарь уже разобранных текстов ошибок
+        :return: короткий идентификатор (как в режиме компактных ошибок загрузчика) -> текст
+        """
+        dictionary = {}
+        for text in self.error_texts:
+            if text.strip():
+                if len(text) > MAX_CELL_LENGTH:
+                    text = text[:MAX_CELL_LENGTH] + TRUNCATED_SUFFIX
+                dictionary[error_id(text)] = text
+        return dictionary
 
     def load_data(self):
         """Загружает данные из лог файла"""
-        with open(self.log_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                # Пропускаем строки, которые не начинаются с "Summary data"
-                if not line.strip().startswith("Summary data"):
-                    continue
-                    
-                # Разбиваем строку по разделителю, сохраняя пустые значения между разделителями
-                values = line.strip().split(';')
-                if not values:  # Пропускаем пустые строки
-                    continue
-                
-                # Создаем словарь для строки лога с правильным порядком полей
-                log_entry = {
-                    'Type': values[0],                                    # Summary data
-                    'CameraSystemName': values[1] if len(values) > 1 else ' ',  # Первая пустая ячейка
-                    'BestShotId': values[2] if len(values) > 2 else ' ',       # Вторая пустая ячейка
-                    'Start DateTime': values[3] if len(values) > 3 else ' ',    # Time bestshot received
-                    'Quality': values[4] if len(values) > 4 else ' ',          # Quality
-                    'QualityErrors': values[5] if len(values) > 5 else ' ',    # QualityErrors
-                    'End DateTime': values[6] if len(values) > 6 else ' ',     # Common Time ident request
-                }
-                
-                # Индексы для важных полей
-                current_idx = 7  # Начало первого запроса
-                
-                # Добавляем данные о запросах
-                for i in range(1, 6):  # Обрабатываем до 5 запросов
-                    if current_idx < len(values):
-                        request_data, current_idx = self._process_request_data(values, current_idx)
-                        for key, value in request_data.items():
-                            log_entry[f'{key} {i}'] = value
-                    else:
-                        # Если не хватает значений, добавляем пробелы
-                        log_entry[f'Status Code {i}'] = ' '
-                        log_entry[f'Error {i}'] = ' '
-                        log_entry[f'Duration {i}'] = ' '
-                        log_entry[f'Request ID {i}'] = ' '
-                        log_entry[f'DateTime {i}'] = ' '
-                
-                # Добавляем Hash и Session ID в конце
-                if len(values) > current_idx + 1:
-                    log_entry['Hash'] = values[-2] or ' '
-                    log_entry['Session ID'] = values[-1] or ' '
-                else:
-                    log_entry['Hash'] = ' '
-                    log_entry['Session ID'] = ' '
-                
-                # Отладочная информация для проверки разделителей
-                print("\nОтладка разделителей:")
-                print(f"Исходная строка: {line.strip()}")
-                print(f"Количество значений после split: {len(values)}")
-                print("Первые 10 значений:")
-                for i, v in enumerate(values[:10]):
-                    print(f"{i}: '{v}'")
-                
-                # Добавляем запись в список
-                self.logs.append(log_entry)
+        self._index = None
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for log_entry in self._iter_parsed_records():
+            # Добавляем запись в список
+            self.logs.append(log_entry)
         
         # Отладочная информация
-        if self.logs:
-            print("\nОтладка загруженных данных:")
-            print(f"Всего записей Summary data: {len(self.logs)}")
-            print("Пример первой записи (первые 7 полей):")
+        if debug and self.logs:
             first_entry = self.logs[0]
             fields = ['Type', 'CameraSystemName', 'BestShotId', 'Start DateTime', 'Quality', 'QualityErrors', 'End DateTime']
-            for key in fields:
-                value = first_entry.get(key, ' ')
-                print(f"{key}: '{value}'")
-            
-            # Показываем значения длительности
-            print("\nЗначения длительности в первой записи:")
-            for i in range(1, 6):
-                duration_key = f'Duration {i}'
-                if duration_key in first_entry:
-                    print(f"{duration_key}: {first_entry[duration_key]}")
+            logger.debug("Пример первой записи: %s", {key: first_entry.get(key, ' ') for key in fields})
+            logger.debug("Значения длительности в первой записи: %s",
+                         {f'Duration {i}': first_entry.get(f'Duration {i}') for i in range(1, self.schema.request_slots + 1)})
         
-        print(f"\nЗагружено {len(self.logs)} записей из лога")
+        logger.info(f"Загружено {len(self.logs)} записей из лога {self.log_path}")
     
+    def build_columnar(self):
+        """Строит колоночное представление загруженных записей, если установлен numpy"""
+        if not columnar.is_available():
+            logger.warning("numpy не установлен, колоночное представление не используется")
+            return None
+        self.columnar = columnar.ColumnarLogs(self.logs, self.parse_datetime, self.parse_duration, self.schema)
+        return self.columnar
+
+    def get_index(self) -> LogIndex:
+        """Возвращает индексы по загруженным записям, строя их при первом обращении"""
+        if self._index is None:
+            self._index = LogIndex(self.logs, self.parse_datetime, self.parse_duration, self.schema)
+        return self._index
+
+    def _rows_by_ids(self, row_ids: List[int]) -> List[Dict]:
+        """Возвращает записи по номерам"""
+        return [self.logs[row] for row in row_ids]
+
+    def _rows_by_mask(self, mask) -> List[Dict]:
+        """Возвращает записи, отмеченные маской колоночного представления"""
+        return [self.logs[row] for row in mask.nonzero()[0]]
+
+    def iter_records(self) -> Iterator[Dict]:
+        """
+        Отдает записи лога по одной
+        В ленивом режиме файл читается потоково, иначе используются загруженные self.logs
+        :return: итератор словарей записей
+        """
+        if not self.lazy:
+            yield from self.logs
+            return
+
+        yield from self._iter_parsed_records()
+
+    def filter(self, predicate) -> List[Dict]:
+        """
+        Отбирает записи по условию из predicates.py
+        В ленивом режиме условие проверяется при чтении: сначала дешево по сырой строке,
+        и только подходящие строки разбираются в словари
+        :param predicate: условие отбора
+        :return: отфильтрованный список логов
+        """
+        if not self.lazy:
+            return [log for log in self.logs if predicate.matches_record(log)]
+
+        saved_predicate = self.predicate
+        self.predicate = predicate if saved_predicate is None else saved_predicate & predicate
+        try:
+            return list(self._iter_parsed_records())
+        finally:
+            self.predicate = saved_predicate
+
+    def _iter_summary_lines_for(self, predicate) -> Iterator[str]:
+        """Строки "Summary data", прошедшие дешевую проверку условия (все строки без условия)"""
+        lines = self._iter_summary_lines()
+        return lines if predicate is None else filter(predicate.prefilter, lines)
+
+    def _iter_parsed_records(self) -> Iterator[Dict]:
+        """Читает и разбирает записи из файла, учитывая время разбора в метриках"""
+        metrics = get_metrics()
+        predicate = self.predicate
+        lines = self._iter_summary_lines_for(predicate)
+        if not metrics.enabled:
+            for line in lines:
+                record = self._parse_line(line)
+                if predicate is None or predicate.matches_record(record):
+                    yield record
+            return
+
+        parse_time = 0.0
+        try:
+            for line in lines:
+                started = time.perf_counter()
+                record = self._parse_line(line)
+                matched = predicate is None or predicate.matches_record(record)
+                parse_time += time.perf_counter() - started
+                if matched:
+                    yield record
+        finally:
+            metrics.add_time('parse', parse_time)
+
     def filter_by_date(self, start_date: str = None, end_date: str = None) -> List[Dict]:
         """
         Фильтрует логи по дате
-        :param start_date: начальная дата в формате 'YYYY-MM-DD'
-        :param end_date: конечная дата в формате 'YYYY-MM-DD'
+        :param start_date: начальная дата в формате 'YYYY-MM-DD' (UTC)
+        :param end_date: конечная дата в формате 'YYYY-MM-DD' (UTC)
         :return: отфильтрованный список логов
         """
-        filtered_logs = self.logs.copy()
-        
-        if start_date:
-            start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-            filtered_logs = [
-                log for log in filtered_logs 
-                if self.parse_datetime(log.get('Start DateTime', '')) >= start_datetime
-            ]
-            
-        if end_date:
-            end_datetime = datetime.strptime(end_date, '%Y-%m-%d')
-            filtered_logs = [
-                log for log in filtered_logs 
-                if self.parse_datetime(log.get('Start DateTime', '')) <= end_datetime
-            ]
-            
+        start_datetime = parse_date_bound(start_date) if start_date else None
+        end_datetime = parse_date_bound(end_date) if end_date else None
+        if self.columnar is not None:
+            return self._rows_by_mask(self.columnar.date_mask(start_datetime, end_datetime))
+        if not self.lazy:
+            return self._rows_by_ids(self.get_index().rows_by_date(start_datetime, end_datetime))
+
+        filtered_logs = []
+
+        for log in self.iter_records():
+            log_datetime = self.parse_datetime(log.get('Start DateTime', ''))
+            if log_datetime is None:
+                continue
+            if start_datetime and log_datetime < start_datetime:
+                continue
+            if end_datetime and log_datetime > end_datetime:
+                continue
+            filtered_logs.append(log)
+
         return filtered_logs
     
     def filter_by_status(self, status_codes: List[int]) -> List[Dict]:
@@ -202,12 +379,17 @@ class LogParser:
         :param status_codes: список кодов статуса
         :return: отфильтрованный список логов
         """
+        if self.columnar is not None:
+            return self._rows_by_mask(self.columnar.status_mask(status_codes))
+        if not self.lazy:
+            return self._rows_by_ids(self.get_index().rows_by_status(status_codes))
+
         status_codes = [str(code) for code in status_codes]  # Конвертируем в строки
         filtered_logs = []
         
-        for log in self.logs:
+        for log in self.iter_records():
             # Проверяем все столбцы с кодами статуса
-            for i in range(1, 6):
+            for i in range(1, self.schema.request_slots + 1):
                 status_key = f'Status Code {i}'
                 if status_key in log and log[status_key] in status_codes:
                     filtered_logs.append(log)
@@ -222,11 +404,16 @@ class LogParser:
         :param max_duration: максимальная длительность в мс
         :return: отфильтрованный список логов
         """
+        if self.columnar is not None:
+            return self._rows_by_mask(self.columnar.duration_mask(min_duration, max_duration))
+        if not self.lazy:
+            return self._rows_by_ids(self.get_index().rows_by_duration(min_duration, max_duration))
+
         filtered_logs = []
         
-        for log in self.logs:
+        for log in self.iter_records():
             # Проверяем все столбцы с длительностью
-            for i in range(1, 6):
+            for i in range(1, self.schema.request_slots + 1):
                 duration_key = f'Duration {i}'
                 if duration_key in log:
                     duration = self.parse_duration(log[duration_key])
@@ -243,11 +430,11 @@ class LogParser:
     
     def get_statistics(self) -> Dict:
         """
-        Получает базовую статистику по логам
+        Получает базовую статистику по логам за один проход
         :return: словарь со статистикой
         """
         stats = {
-            'total_records': len(self.logs),
+            'total_records': 0,
             'date_range': {
                 'start': None,
                 'end': None
@@ -255,111 +442,262 @@ class LogParser:
             'status_codes': {},
             'avg_duration': {}
         }
-        
-        if self.logs:
+        if self.columnar is not None:
+            return self._columnar_statistics(stats)
+
+        duration_sums = {f'Duration {i}': 0 for i in range(1, self.schema.request_slots + 1)}
+
+        for log in self.iter_records():
+            stats['total_records'] += 1
+
             # Находим диапазон дат
-            dates = [self.parse_datetime(log.get('Start DateTime', '')) for log in self.logs]
-            dates = [d for d in dates if d is not None]
-            if dates:
-                stats['date_range']['start'] = min(dates)
-                stats['date_range']['end'] = max(dates)
-            
+            date = self.parse_datetime(log.get('Start DateTime', ''))
+            if date is not None:
+                if stats['date_range']['start'] is None or date < stats['date_range']['start']:
+                    stats['date_range']['start'] = date
+                if stats['date_range']['end'] is None or date > stats['date_range']['end']:
+                    stats['date_range']['end'] = date
+
             # Собираем статистику по кодам статуса
-            for i in range(1, 6):
+            for i in range(1, self.schema.request_slots + 1):
                 status_key = f'Status Code {i}'
-                stats['status_codes'][status_key] = {}
-                for log in self.logs:
-                    if status_key in log:
-                        status = log[status_key]
-                        stats['status_codes'][status_key][status] = stats['status_codes'][status_key].get(status, 0) + 1
-            
+                status_counts = stats['status_codes'].setdefault(status_key, {})
+                if status_key in log:
+                    status = log[status_key]
+                    status_counts[status] = status_counts.get(status, 0) + 1
+
             # Собираем статистику по длительности
-            for i in range(1, 6):
-                duration_key = f'Duration {i}'
-                durations = [self.parse_duration(log.get(duration_key, '0 ms')) for log in self.logs]
-                if durations:
-                    stats['avg_duration'][duration_key] = sum(durations) / len(durations)
-        
+            for duration_key in duration_sums:
+                duration_sums[duration_key] += self.parse_duration(log.get(duration_key, '0 ms'))
+
+        if stats['total_records']:
+            for duration_key, total in duration_sums.items():
+                stats['avg_duration'][duration_key] = total / stats['total_records']
+
         return stats
     
+    def _columnar_statistics(self, stats: Dict) -> Dict:
+        """Заполняет статистику по колоночному представлению"""
+        stats['total_records'] = self.columnar.size
+        if not self.columnar.size:
+            return stats
+
+        date_rows = self.columnar.date_range_rows()
+        if date_rows is not None:
+            start_row, end_row = date_rows
+            stats['date_range']['start'] = self.parse_datetime(self.logs[start_row]['Start DateTime'])
+            stats['date_range']['end'] = self.parse_datetime(self.logs[end_row]['Start DateTime'])
+
+        stats['status_codes'] = self.columnar.status_counts()
+        stats['avg_duration'] = self.columnar.avg_duration()
+        return stats
+
+    def _record_to_row(self, log: Dict) -> List[str]:
+        """
+        Преобразует запись лога в строку таблицы в порядке столбцов схемы
+        :param log: словарь записи
+        :return: список значений ячеек
+        """
+        row = []
+        for column in self.headers:
+            value = log.get(column, ' ')  # Если значение отсутствует, используем пробел
+            
+            # Убираем 'ms' из значений длительности
+            if 'Duration' in column and value and value.strip():  # Проверяем, что значение не пустое и не состоит только из пробелов
+                try:
+                    # Пробуем извлечь числовое значение
+                    value = str(int(value.replace(' ms', '')))
+                except (ValueError, AttributeError):
+                    value = ' '  # Если не удалось преобразовать, используем пробел
+            
+            # Преобразуем в строку и проверяем длину
+            value = str(value)
+            if not value.strip():  # Если строка пустая или состоит только из пробелов
+                value = ' '  # Заменяем на один пробел
+            elif len(value) > MAX_CELL_LENGTH:
+                value = value[:MAX_CELL_LENGTH] + TRUNCATED_SUFFIX
+            
+            row.append(value)
+        
+        return row
+
+    def iter_rows(self, filtered_logs: Iterable[Dict] = None) -> Iterator[List[str]]:
+        """
+        Потоково отдает строки таблицы без заголовков
+        В ленивом режиме без фильтра строки собираются прямо из строк лога, минуя словари записей
+        :param filtered_logs: отфильтрованные записи (по умолчанию все записи лога)
+        :return: итератор строк таблицы
+        """
+        if filtered_logs is None and self.lazy:
+            yield from self._iter_converted_rows()
+            return
+
+        logs_to_process = filtered_logs if filtered_logs is not None else self.iter_records()
+        metrics = get_metrics()
+        if not metrics.enabled:
+            for log in logs_to_process:
+                yield self._record_to_row(log)
+            return
+
+        prepare_time = 0.0
+        rows = 0
+        try:
+            for log in logs_to_process:
+                started = time.perf_counter()
+                row = self._record_to_row(log)
+                prepare_time += time.perf_counter() - started
+                rows += 1
+                yield row
+        finally:
+            metrics.add_time('prepare', prepare_time)
+            metrics.inc('rows_prepared', rows)
+
+    def _iter_converted_rows(self) -> Iterator[List[str]]:
+        """Читает строки лога и сразу превращает их в строки таблицы (списки)"""
+        convert = self._convert_row
+        metrics = get_metrics()
+        predicate = self.predicate
+        if self.id_collector is not None:
+            # Индекс идентификаторов должен видеть все строки - дешевую проверку пропускаем
+            convert = self._collecting_converter(convert)
+            lines = self._iter_summary_lines()
+        else:
+            lines = self._iter_summary_lines_for(predicate)
+        if not metrics.enabled:
+            if predicate is None:
+                yield from map(convert, lines)
+            else:
+                yield from filter(predicate.matches_row, map(convert, lines))
+            return
+
+        parse_time = 0.0
+        rows = 0
+        try:
+            for line in lines:
+                started = time.perf_counter()
+                row = convert(line)
+                matched = predicate is None or predicate.matches_row(row)
+                parse_time += time.perf_counter() - started
+                if matched:
+                    rows += 1
+                    yield row
+        finally:
+            metrics.add_time('parse', parse_time)
+            metrics.inc('rows_prepared', rows)
+
+    def _collecting_converter(self, convert):
+        """Оборачивает преобразование строки так, чтобы идентификаторы попадали в id_collector"""
+        collector = self.id_collector
+
+        def convert_and_collect(line: str) -> List[str]:
+            row = convert(line)
+            collector.add(row, line, self.line_offset)
+            return row
+
+        return convert_and_collect
+
     def prepare_for_sheets(self, filtered_logs: List[Dict] = None) -> List[List]:
         """
         Подготавливает данные для записи в Google Sheets
         :param filtered_logs: отфильтрованный список логов
         :return: список списков для записи в таблицу
         """
-        MAX_CELL_LENGTH = 40000  # Максимальная длина значения в ячейке
-        logs_to_process = filtered_logs if filtered_logs is not None else self.logs
-        
-        # Подготавливаем заголовки в правильном порядке
-        headers = [
-            'Type',
-            'CameraSystemName',
-            'BestShotId',
-            'Start DateTime',
-            'Quality',
-            'QualityErrors',
-            'End DateTime',
-            'Status Code 1', 'Error 1', 'Duration 1', 'Request ID 1', 'DateTime 1',
-            'Status Code 2', 'Error 2', 'Duration 2', 'Request ID 2', 'DateTime 2',
-            'Status Code 3', 'Error 3', 'Duration 3', 'Request ID 3', 'DateTime 3',
-            'Status Code 4', 'Error 4', 'Duration 4', 'Request ID 4', 'DateTime 4',
-            'Status Code 5', 'Error 5', 'Duration 5', 'Request ID 5', 'DateTime 5',
-            'Hash',
-            'Session ID'
-        ]
+        rows = [list(self.headers)]
+        rows.extend(self.iter_rows(filtered_logs))
         
-        # Подготавливаем данные
-        rows = [headers]
-        for log in logs_to_process:
-            # Создаем список значений, соответствующий порядку заголовков
-            row = []
-            for column in headers:
-                value = log.get(column, ' ')  # Если значение отсутствует, используем пробел
-                
-                # Убираем 'ms' из значений длительности
-                if 'Duration' in column and value and value.strip():  # Проверяем, что значение не пустое и не состоит только из пробелов
-                    print(f"Обработка {column}: исходное значение = '{value}'")  # Отладка
-                    try:
-                        # Пробуем извлечь числовое значение
-                        numeric_value = int(value.replace(' ms', ''))
-                        value = str(numeric_value)
-                        print(f"  преобразовано в: '{value}'")  # Отладка
-                    except (ValueError, AttributeError) as e:
-                        print(f"  ошибка преобразования: {e}")  # Отладка
-                        value = ' '  # Если не удалось преобразовать, используем пробел
-                
-                # Преобразуем в строку и проверяем длину
-                value = str(value)
-                if not value.strip():  # Если строка пустая или состоит только из пробелов
-                    value = ' '  # Заменяем на один пробел
-                elif len(value) > MAX_CELL_LENGTH:
-                    value = value[:MAX_CELL_LENGTH] + '...(truncated)'
-                
-                row.append(value)
-            
-            # Проверяем, что длина строки соответствует количеству заголовков
-            if len(row) != len(headers):
-                print(f"Внимание: длина строки ({len(row)}) не соответствует количеству заголовков ({len(headers)})")
-                # Добавляем пробелы, если не хватает столбцов
-                while len(row) < len(headers):
-                    row.append(' ')
-            
-            rows.append(row)
-            
-            # Показываем первую строку для отладки
-            if len(rows) == 2:
-                print("\nПервая строка данных:")
-                for i, (header, value) in enumerate(zip(headers, row)):
-                    print(f"{header}: '{value}'")
-        
-        # Отладочная информация
-        print("\nОтладка prepare_for_sheets:")
-        print(f"Количество строк: {len(rows)}")
-        print(f"Количество столбцов: {len(headers)}")
+        if len(rows) > 1:
+            logger.debug("Первая строка данных: %s", dict(zip(self.headers, rows[1])))
+        logger.debug(f"prepare_for_sheets: строк {len(rows)}, столбцов {len(self.headers)}")
             
         return rows
 
+    def prepare_for_sheets_batches(self, batch_size: int = 1000,
+                                   filtered_logs: Iterable[Dict] = None) -> Iterator[List[List]]:
+        """
+        Подготавливает данные для Google Sheets порциями фиксированного размера
+        Каждая порция начинается со строки заголовков, как и результат prepare_for_sheets
+        :param batch_size: максимальное количество строк данных в порции
+        :param filtered_logs: отфильтрованные записи (по умолчанию все записи лога)
+        :return: итератор порций строк
+        """
+        batch = [list(self.headers)]
+        for row in self.iter_rows(filtered_logs):
+            batch.append(row)
+            if len(batch) > batch_size:
+                yield batch
+                batch = [list(self.headers)]
+
+        if len(batch) > 1:
+            yield batch
+
+    def export(self, sink, batch_size: int = 10000, filtered_logs: Iterable[Dict] = None) -> int:
+        """
+        Записывает строки в получателя (см. sinks.py) потоково, не собирая их в памяти
+        :param sink: получатель строк
+        :param batch_size: количество строк в одной порции записи
+        :param filtered_logs: отфильтрованные записи (по умолчанию все записи лога)
+        :return: количество записанных строк
+        """
+        rows = 0
+        for batch in self.prepare_for_sheets_batches(batch_size, filtered_logs):
+            if not sink.write(batch):
+                raise IOError(f"Получатель {sink.name} не принял порцию строк")
+            rows += len(batch) - 1
+        sink.flush()
+        return rows
+
+def iter_file_batches(log_path: str, start_offset: int = 0, include_partial: bool = True,
+                      batch_size: int = 1000, id_index_path: str = None, predicate=None) -> Iterator:
+    """
+    Потоково разбирает файл на порции строк для Google Sheets
+    Последней может идти порция только с заголовками - она сдвигает смещение
+    за строки, не содержащие "Summary data"
+    :param log_path: путь к файлу лога
+    :param start_offset: байтовое смещение начала чтения
+    :param include_partial: обрабатывать последнюю строку без перевода строки
+    :param batch_size: максимальное количество строк данных в порции
+    :param id_index_path: путь к индексу идентификаторов, который пополняется по ходу разбора
+    :param predicate: условие отбора строк (см. predicates.py)
+    :return: итератор пар (порция строк с заголовками, смещение после порции)
+    """
+    id_index = IdIndex(id_index_path) if id_index_path else None
+    try:
+        id_collector = id_index.collector(log_path, start_offset) if id_index is not None else None
+        parser = LogParser(log_path, lazy=True, start_offset=start_offset, include_partial=include_partial,
+                           id_collector=id_collector, predicate=predicate)
+        offset = start_offset
+        for batch in parser.prepare_for_sheets_batches(batch_size):
+            offset = parser.offset
+            if id_collector is not None:
+                id_collector.commit(offset)
+            yield batch, offset
+
+        if parser.offset != offset:
+            if id_collector is not None:
+                id_collector.commit(parser.offset)
+            yield [list(parser.headers)], parser.offset
+    finally:
+        if id_index is not None:
+            id_index.close()
+
+
+def parse_file_batches(log_path: str, start_offset: int = 0, include_partial: bool = True,
+                       batch_size: int = 1000, collect_metrics: bool = False, id_index_path: str = None,
+                       predicate=None):
+    """
+    Разбирает файл целиком в список порций (для выполнения в отдельном процессе)
+    :param collect_metrics: собрать метрики разбора и вернуть их вместе с порциями
+    :param id_index_path: путь к индексу идентификаторов (см. iter_file_batches)
+    :param predicate: условие отбора строк (см. iter_file_batches)
+    :return: список пар (порция строк с заголовками, смещение после порции)
+             и снимок метрик процесса (или None)
+    """
+    # Процесс пула мог унаследовать метрики родителя - собираем свои с нуля
+    set_metrics(Metrics() if collect_metrics else NullMetrics())
+    batches = list(iter_file_batches(log_path, start_offset, include_partial, batch_size, id_index_path,
+                                     predicate))
+    return batches, get_metrics().snapshot() if collect_metrics else None
+
 def main():
     """Пример использования парсера логов"""
     # Путь к файлу лога
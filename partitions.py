@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from schema import DEFAULT_SCHEMA
+
+# Индекс столбца Start DateTime (D) в строке таблицы
+START_DATETIME_COLUMN = DEFAULT_SCHEMA.column('Start DateTime')
+
+# Ключ раздела для строк без корректной даты начала
+UNDATED_KEY = 'undated'
+
+_DAY_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+class PartitionPolicy:
+    """
+    Правило разбиения загружаемых строк на листы-разделы
+    - none - все строки в первый лист таблицы (как раньше);
+    - day / month - отдельный лист на каждый день / месяц по Start DateTime;
+    - rows:N - новый лист, когда в текущем набралось N строк.
+    Если в таблице заканчиваются ячейки, раздел продолжается на следующем листе
+    (при необходимости - в новой таблице)
+    """
+
+    KINDS = ('none', 'day', 'month', 'rows')
+
+    def __init__(self, spec: str = 'none'):
+        """
+        :param spec: описание правила: none, day, month или rows:N
+        """
+        kind, _, argument = spec.strip().lower().partition(':')
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестное правило разбиения на листы: {spec}")
+        self.kind = kind
+        self.max_rows = None
+        if kind == 'rows':
+            try:
+                self.max_rows = int(argument)
+            except ValueError:
+                raise ValueError(f"Для правила rows нужно количество строк, например rows:100000: {spec}")
+            if self.max_rows <= 0:
+                raise ValueError(f"Количество строк в листе должно быть положительным: {spec}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != 'none'
+
+    def key_for_row(self, row: List[str]) -> str:
+        """Определяет ключ раздела для строки таблицы"""
+        if self.kind == 'rows':
+            return 'rows'
+        start = row[START_DATETIME_COLUMN] if len(row) > START_DATETIME_COLUMN else ''
+        day = start[:10]
+        if not _DAY_RE.fullmatch(day):
+            return UNDATED_KEY
+        return day if self.kind == 'day' else day[:7]
+
+    def split(self, data: List[List[str]]) -> List[Tuple[str, List[List[str]]]]:
+        """
+        Распределяет строки порции по разделам с сохранением порядка строк внутри раздела
+        :param data: строки с заголовками в первой строке
+        :return: список пар (ключ раздела, строки раздела с заголовками)
+        """
+        headers = data[0]
+        groups = {}
+        for row in data[1:]:
+            key = self.key_for_row(row)
+            if key not in groups:
+                groups[key] = [headers]
+            groups[key].append(row)
+        return list(groups.items())
+
+    def segment_title(self, key: str, number: int) -> str:
+        """Название листа для number-го листа раздела (нумерация с 1)"""
+        if self.kind == 'rows':
+            return f'logs_{number:04d}'
+        if number == 1:
+            return f'logs_{key}'
+        return f'logs_{key}_{number}'
+
+
+class PartitionCatalog:
+    """
+    Локальный каталог листов-разделов
+    Хранит, в какой таблице лежит каждый лист, сколько в нем строк и сколько ячеек занято
+    в каждой таблице, чтобы не запрашивать это у Google API при каждом запуске
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: путь к JSON-файлу каталога
+        """
+        self.path = path
+        catalog = self._load()
+        self.spreadsheets = catalog.get('spreadsheets', [])
+        self.segments = catalog.get('segments', [])
+
+    def _load(self) -> Dict:
+        """Загружает каталог с диска"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ошибка при чтении каталога листов {self.path}: {e}")
+            return {}
+
+    def save(self):
+        """Атомарно сохраняет каталог на диск"""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'spreadsheets': self.spreadsheets, 'segments': self.segments},
+                      file, ensure_ascii=False, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def add_spreadsheet(self, spreadsheet_id: str, base_cells: int, base_sheets: int):
+        """
+        Регистрирует таблицу, в которой можно создавать листы
+        :param base_cells: ячейки, уже занятые листами не из каталога
+        :param base_sheets: количество листов не из каталога
+        """
+        self.spreadsheets.append({'id': spreadsheet_id, 'base_cells': base_cells, 'base_sheets': base_sheets})
+
+    def segments_for_key(self, key: str) -> List[Dict]:
+        """Листы раздела в порядке создания"""
+        return [segment for segment in self.segments if segment['key'] == key]
+
+    def active_segment(self, key: str) -> Optional[Dict]:
+        """Последний лист раздела, в который идет запись"""
+        segments = self.segments_for_key(key)
+        return segments[-1] if segments else None
+
+    def add_segment(self, key: str, title: str, spreadsheet_id: str, grid_rows: int, cols: int) -> Dict:
+        """Регистрирует новый лист раздела"""
+        segment = {
+            'key': key,
+            'number': len(self.segments_for_key(key)) + 1,
+            'title': title,
+            'spreadsheet_id': spreadsheet_id,
+            'rows': 0,
+            'grid_rows': grid_rows,
+            'cols': cols,
+        }
+        self.segments.append(segment)
+        return segment
+
+    @staticmethod
+    def record_rows(segment: Dict, rows: int, grid_rows: int):
+        """
+        Учитывает записанные в лист строки
+        :param rows: количество добавленных строк данных
+        :param grid_rows: текущее количество строк сетки листа
+        """
+        segment['rows'] += rows
+        # Заголовок занимает первую строку; values.append сам расширяет сетку
+        segment['grid_rows'] = max(segment['grid_rows'], grid_rows, segment['rows'] + 1)
+
+    def used_cells(self, spreadsheet_id: str) -> int:
+        """Оценка количества ячеек, занятых в таблице"""
+        cells = 0
+        for spreadsheet in self.spreadsheets:
+            if spreadsheet['id'] == spreadsheet_id:
+                cells += spreadsheet['base_cells']
+        for segment in self.segments:
+            if segment['spreadsheet_id'] == spreadsheet_id:
+                cells += segment['grid_rows'] * segment['cols']
+        return cells
+
+    def sheet_count(self, spreadsheet_id: str) -> int:
+        """Количество листов в таблице"""
+        count = sum(spreadsheet['base_sheets'] for spreadsheet in self.spreadsheets
+                    if spreadsheet['id'] == spreadsheet_id)
+        return count + sum(1 for segment in self.segments if segment['spreadsheet_id'] == spreadsheet_id)
@@ -0,0 +1,132 @@
+import queue
+import logging
+import threading
+from typing import Iterator, Tuple
+
+# Виды событий конвейера
+FILE_START = 'start'
+FILE_BATCH = 'batch'
+FILE_END = 'end'
+FILE_ERROR = 'error'
+
+_DONE = object()
+
+
+class _Fatal:
+    """Ошибка, из-за которой разбор остановился целиком"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class ParsePipeline:
+    """
+    Конвейер "разбор -> загрузка"
+    Разбор выполняется в отдельном потоке и складывает порции строк в ограниченную очередь,
+    загрузка забирает их в вызывающем потоке. Когда очередь заполнена, разбор ждет (backpressure).
+    Порции отдаются строго в порядке файлов и строк в файле, поэтому загрузчик один.
+
+    События - кортежи (вид, описание файла, данные, смещение):
+    - FILE_START - начало файла;
+    - FILE_BATCH - порция строк с заголовками и смещение после нее;
+    - FILE_END - файл разобран до конца, смещение после последней строки;
+    - FILE_ERROR - ошибка разбора файла (в поле данных), следующие файлы продолжают разбираться.
+
+    Использование:
+        with ParsePipeline(parsed_files, queue_size) as pipeline:
+            for kind, file_info, data, offset in pipeline:
+                ...
+    """
+
+    def __init__(self, parsed_files, queue_size: int = 4):
+        """
+        :param parsed_files: итератор пар (описание файла, итератор пар (порция, смещение))
+        :param queue_size: сколько событий может ждать загрузки; 0 - без отдельного потока
+        """
+        self.parsed_files = parsed_files
+        self.queue_size = queue_size
+        self.queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.stop_event = threading.Event()
+        self.skipped = set()
+        self.thread = None
+
+    def skip_file(self, file_info):
+        """Прекращает разбор файла (например, после ошибки загрузки его порции)"""
+        self.skipped.add(file_info[1])
+
+    def _events(self) -> Iterator[Tuple]:
+        """Разбирает файлы и формирует события конвейера"""
+        for file_info, batches in self.parsed_files:
+            if self.stop_event.is_set():
+                return
+            yield FILE_START, file_info, None, None
+            offset = None
+            try:
+                for data, offset in batches:
+                    if self.stop_event.is_set():
+                        return
+                    if file_info[1] in self.skipped:
+                        break
+                    yield FILE_BATCH, file_info, data, offset
+            except Exception as e:
+                yield FILE_ERROR, file_info, e, None
+                continue
+            if file_info[1] not in self.skipped:
+                yield FILE_END, file_info, None, offset
+
+    def _put(self, item) -> bool:
+        """Кладет событие в очередь, пока конвейер не остановлен"""
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        """Поток разбора"""
+        try:
+            for event in self._events():
+                if not self._put(event):
+                    return
+        except Exception as e:
+            logging.error(f"Критическая ошибка разбора: {e}")
+            self._put(_Fatal(e))
+        finally:
+            close = getattr(self.parsed_files, 'close', None)
+            if close is not None:
+                close()
+            self._put(_DONE)
+
+    def __enter__(self):
+        if self.queue_size > 0:
+            self.thread = threading.Thread(target=self._produce, name='log-parser', daemon=True)
+            self.thread.start()
+        return self
+
+    def __iter__(self):
+        if self.thread is None:
+            # Без отдельного потока: разбор и загрузка чередуются
+            yield from self._events()
+            return
+
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Fatal):
+                raise item.error
+            yield item
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Останавливаем разбор и освобождаем очередь, чтобы поток не завис на put
+        self.stop_event.set()
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.thread.join()
+        return False
@@ -0,0 +1,219 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from parser import parse_log_datetime
+from schema import DEFAULT_SCHEMA, LogSchema
+
+
+def _raw_field(line: str, index: int) -> Optional[str]:
+    """Поле строки лога по номеру без разбиения всей строки (None, если полей меньше)"""
+    start = 0
+    for _ in range(index):
+        start = line.find(';', start) + 1
+        if not start:
+            return None
+    end = line.find(';', start)
+    return line[start:] if end < 0 else line[start:end]
+
+
+def parse_time_bound(value: str) -> datetime:
+    """
+    Разбирает границу фильтра по времени: 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' или 'YYYY-MM-DD HH:MM:SS'
+    Граница считается в UTC
+    """
+    for date_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value.strip(), date_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная граница времени: {value} (ожидается YYYY-MM-DD[ HH:MM[:SS]])")
+
+
+class Predicate:
+    """
+    Условие отбора строк лога
+    prefilter - дешевая проверка сырой строки до разбиения на поля: False означает, что строка
+    точно не подходит, True - что ее нужно проверить полностью. matches_row и matches_record -
+    точные проверки строки таблицы и словаря записи. Условия объединяются через & (AllOf)
+    """
+
+    def prefilter(self, line: str) -> bool:
+        return True
+
+    def matches_row(self, row) -> bool:
+        raise NotImplementedError
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        raise NotImplementedError
+
+    def __and__(self, other: 'Predicate') -> 'Predicate':
+        return AllOf([self, other])
+
+
+class AllOf(Predicate):
+    """Строка подходит, если подходит под все условия; дешевые проверки идут первыми"""
+
+    def __init__(self, predicates: Iterable[Predicate]):
+        self.predicates = []
+        for predicate in predicates:
+            self.predicates.extend(predicate.predicates if isinstance(predicate, AllOf) else [predicate])
+
+    def prefilter(self, line: str) -> bool:
+        return all(predicate.prefilter(line) for predicate in self.predicates)
+
+    def matches_row(self, row) -> bool:
+        return all(predicate.matches_row(row) for predicate in self.predicates)
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        return all(predicate.matches_record(record) for predicate in self.predicates)
+
+
+class CameraIn(Predicate):
+    """CameraSystemName из списка"""
+
+    def __init__(self, cameras: Iterable[str], schema: LogSchema = None):
+        self.cameras = frozenset(cameras)
+        self.column = (schema or DEFAULT_SCHEMA).column('CameraSystemName')
+
+    def prefilter(self, line: str) -> bool:
+        return _raw_field(line, self.column) in self.cameras
+
+    def matches_row(self, row) -> bool:
+        return row[self.column] in self.cameras
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        return record.get('CameraSystemName') in self.cameras
+
+
+class TimeRange(Predicate):
+    """Start DateTime в диапазоне [start, end]; записи без корректной даты не подходят"""
+
+    def __init__(self, start: datetime = None, end: datetime = None, schema: LogSchema = None):
+        """
+        :param start: нижняя граница (с часовым поясом) или None
+        :param end: верхняя граница (с часовым поясом) или None
+        """
+        self.start = start
+        self.end = end
+        self.column = (schema or DEFAULT_SCHEMA).column('Start DateTime')
+
+    def _matches(self, value: Optional[str]) -> bool:
+        if not value:
+            return False
+        # Даты разбираются с кэшем по секундам, поэтому проверка дешевая
+        timestamp = parse_log_datetime(value)
+        if timestamp is None:
+            return False
+        if self.start is not None and timestamp < self.start:
+            return False
+        if self.end is not None and timestamp > self.end:
+            return False
+        return True
+
+    def prefilter(self, line: str) -> bool:
+        return self._matches(_raw_field(line, self.column))
+
+    def matches_row(self, row) -> bool:
+        return self._matches(row[self.column])
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        return self._matches(record.get('Start DateTime'))
+
+
+class StatusIn(Predicate):
+    """Хотя бы один запрос с кодом статуса из списка"""
+
+    def __init__(self, status_codes: Iterable, schema: LogSchema = None):
+        schema = schema or DEFAULT_SCHEMA
+        self.status_codes = frozenset(str(code) for code in status_codes)
+        # Код статуса всегда стоит сразу после ';' - без такой подстроки строка точно не подходит
+        self.markers = tuple(f';{code}' for code in self.status_codes)
+        self.columns = tuple(schema.column(f'Status Code {slot}') for slot in range(1, schema.request_slots + 1))
+        self.keys = tuple(f'Status Code {slot}' for slot in range(1, schema.request_slots + 1))
+
+    def prefilter(self, line: str) -> bool:
+        return any(marker in line for marker in self.markers)
+
+    def matches_row(self, row) -> bool:
+        return any(row[column] in self.status_codes for column in self.columns)
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        return any(record.get(key) in self.status_codes for key in self.keys)
+
+
+class DurationRange(Predicate):
+    """Хотя бы один запрос с длительностью в диапазоне [min_duration, max_duration] мс"""
+
+    def __init__(self, min_duration: int = None, max_duration: int = None, schema: LogSchema = None):
+        schema = schema or DEFAULT_SCHEMA
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.columns = schema.duration_columns
+        self.keys = tuple(f'Duration {slot}' for slot in range(1, schema.request_slots + 1))
+
+    def _matches(self, duration: int) -> bool:
+        if self.min_duration is not None and duration < self.min_duration:
+            return False
+        if self.max_duration is not None and duration > self.max_duration:
+            return False
+        return True
+
+    def prefilter(self, line: str) -> bool:
+        return ' ms' in line
+
+    def matches_row(self, row) -> bool:
+        for column in self.columns:
+            # В строке таблицы длительность - число миллисекунд или пробел
+            value = row[column]
+            if value != ' ' and self._matches(int(value)):
+                return True
+        return False
+
+    def matches_record(self, record: Dict[str, str]) -> bool:
+        for key in self.keys:
+            value = record.get(key, ' ')
+            if 'ms' not in value:
+                continue
+            try:
+                duration = int(value.replace(' ms', ''))
+            except ValueError:
+                continue
+            if self._matches(duration):
+                return True
+        return False
+
+
+def _split_values(values: Optional[List[str]]) -> List[str]:
+    """Значения из повторяющихся параметров и/или через запятую"""
+    return [item.strip() for value in values or [] for item in value.split(',') if item.strip()]
+
+
+def build_predicate(since: str = None, until: str = None, statuses: List[str] = None,
+                    min_duration: int = None, max_duration: int = None,
+                    cameras: List[str] = None) -> Optional[Predicate]:
+    """
+    Собирает условие отбора из параметров командной строки
+    :param since: нижняя граница Start DateTime (UTC), включительно
+    :param until: верхняя граница Start DateTime (UTC), включительно
+    :param statuses: коды статуса (можно через запятую)
+    :param min_duration: минимальная длительность запроса в мс
+    :param max_duration: максимальная длительность запроса в мс
+    :param cameras: имена камер (можно через запятую)
+    :return: условие или None, если ничего не задано
+    """
+    predicates = []
+    cameras = _split_values(cameras)
+    if cameras:
+        predicates.append(CameraIn(cameras))
+    if since or until:
+        predicates.append(TimeRange(parse_time_bound(since) if since else None,
+                                    parse_time_bound(until) if until else None))
+    statuses = _split_values(statuses)
+    if statuses:
+        predicates.append(StatusIn(statuses))
+    if min_duration is not None or max_duration is not None:
+        predicates.append(DurationRange(min_duration, max_duration))
+
+    if not predicates:
+        return None
+    return predicates[0] if len(predicates) == 1 else AllOf(predicates)
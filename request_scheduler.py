@@ -0,0 +1,179 @@
+import time
+import random
+import socket
+import logging
+import threading
+
+from metrics import get_metrics
+
+# HTTP-статусы, при которых запрос к Google API имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def error_status(error):
+    """
+    Извлекает HTTP-статус из исключения Google API
+    :return: код статуса или None, если это не HTTP-ошибка
+    """
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None)
+    if status is None and isinstance(resp, dict):
+        status = resp.get('status')
+    if status is None:
+        status = getattr(error, 'status_code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(error):
+    """Возвращает задержку из заголовка Retry-After, если сервер ее прислал"""
+    resp = getattr(error, 'resp', None)
+    try:
+        value = resp.get('retry-after') if resp is not None else None
+        return float(value) if value is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов по алгоритму "ведро токенов" """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate_per_minute: сколько запросов в минуту разрешено в среднем
+        :param capacity: сколько запросов можно выполнить подряд без ожидания
+        :param clock: источник времени (подменяется в тестах и бенчмарках)
+        :param sleep: функция ожидания (подменяется в тестах и бенчмарках)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 6.0)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> float:
+        """
+        Забирает один токен, при необходимости дожидаясь его появления
+        :return: сколько секунд пришлось ждать
+        """
+        waited = 0.0
+        with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= 1
+        return waited
+
+
+class RequestScheduler:
+    """
+    Единая точка выполнения запросов к Google Sheets API
+    Соблюдает квоту запросов в минуту и повторяет запросы при 429/5xx
+    с экспоненциальной задержкой и случайным разбросом
+    """
+
+    def __init__(self, rate_per_minute: float = 60, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 64.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate_per_minute: квота запросов в минуту
+        :param max_retries: максимальное количество повторов одного запроса
+        :param base_delay: начальная задержка перед повтором в секундах
+        :param max_delay: максимальная задержка перед повтором в секундах
+        :param clock: источник времени
+        :param sleep: функция ожидания
+        """
+        self.bucket = TokenBucket(rate_per_minute, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def _is_retryable(self, error, idempotent: bool) -> bool:
+        """
+        Определяет, можно ли повторить запрос после ошибки
+        Неидемпотентные запросы (добавление строк) повторяются только при 429:
+        в этом случае сервер гарантированно отклонил запрос и строки не записаны.
+        Поэтому неидемпотентная функция должна делать ровно один запрос к API
+        """
+        status = error_status(error)
+        if status == 429:
+            return True
+        if not idempotent:
+            return False
+        if status is not None:
+            return status in RETRYABLE_STATUSES
+        return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+    def _backoff(self, attempt: int, error) -> float:
+        """Вычисляет задержку перед повтором: экспонента с равномерным разбросом"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def call(self, func, *args, idempotent: bool = True, **kwargs):
+        """
+        Выполняет запрос с учетом квоты и повторами
+        :param func: функция pygsheets, выполняющая запрос (один запрос - одна единица квоты)
+        :param idempotent: безопасно ли повторять запрос, если неизвестно, выполнился ли он
+        :return: результат func
+        """
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            with self.lock:
+                self.requests += 1
+                self.wait_seconds += waited
+            metrics.inc('api_requests')
+            metrics.add_time('api_quota_wait', waited)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                metrics.observe('api_latency_seconds', time.perf_counter() - started)
+                return result
+            except Exception as e:
+                metrics.observe('api_latency_seconds', time.perf_counter() - started)
+                metrics.inc('api_errors')
+                if attempt >= self.max_retries or not self._is_retryable(e, idempotent):
+                    raise
+                delay = self._backoff(attempt, e)
+                with self.lock:
+                    self.retries += 1
+                    self.wait_seconds += delay
+                    if error_status(e) == 429:
+                        self.throttled += 1
+                metrics.inc('api_retries')
+                logging.warning(f"Ошибка запроса к Google API ({e}), повтор через {delay:.1f} с")
+                self.sleep(delay)
+                attempt += 1
+
+    def get_stats(self):
+        """Возвращает статистику запросов за запуск"""
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'wait_seconds': round(self.wait_seconds, 3),
+            }
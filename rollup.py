@@ -0,0 +1,182 @@
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from parser import parse_log_datetime
+from schema import DEFAULT_SCHEMA, LogSchema, is_request_slot
+from sketches import LatencyHistogram
+
+# Заголовки листа с агрегатами
+ROLLUP_HEADERS = [
+    'Bucket Start (UTC)', 'CameraSystemName', 'Slot', 'Status Code',
+    'Requests', 'Errors', 'Error Rate', 'p50 ms', 'p95 ms', 'p99 ms'
+]
+
+
+def _duration_value(value: str):
+    """Длительность из ячейки таблицы в мс или None, если в ячейке не число"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RollupStore:
+    """
+    Агрегаты по интервалам времени, камерам, слотам запросов и кодам статуса на SQLite
+    Хранит состояние между запусками и номер строки листа для каждого агрегата,
+    чтобы перезаписывать в таблице только изменившиеся строки
+    """
+
+    def __init__(self, path: str, bucket_seconds: int = 3600, schema: LogSchema = None):
+        """
+        :param path: путь к файлу базы данных
+        :param bucket_seconds: размер интервала агрегации в секундах
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.bucket_seconds = bucket_seconds
+        schema = schema or DEFAULT_SCHEMA
+        self.width = schema.width
+        self.camera_column = schema.column('CameraSystemName')
+        self.start_column = schema.column('Start DateTime')
+        self.slot_columns = [
+            (schema.column(f'Status Code {slot}'), schema.column(f'Error {slot}'), schema.column(f'Duration {slot}'))
+            for slot in range(1, schema.request_slots + 1)
+        ]
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS rollup (
+                    bucket INTEGER, camera TEXT, slot INTEGER, status TEXT,
+                    requests INTEGER, errors INTEGER, histogram TEXT,
+                    sheet_row INTEGER, dirty INTEGER,
+                    PRIMARY KEY (bucket, camera, slot, status)
+                ) WITHOUT ROWID
+            ''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS rollup_dirty ON rollup (dirty)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+        stored = self._get_meta('bucket_seconds')
+        if stored is not None and int(stored) != bucket_seconds:
+            raise ValueError(f"Агрегаты в {path} посчитаны по интервалу {stored} с, а не {bucket_seconds} с; "
+                             f"удалите файл, чтобы пересчитать их заново")
+        self._set_meta('bucket_seconds', str(bucket_seconds))
+
+    def _get_meta(self, key: str):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _aggregate(self, rows: Iterable[List[str]]) -> Dict[Tuple, list]:
+        """Агрегирует строки таблицы в памяти: ключ -> [запросы, ошибки, гистограмма]"""
+        aggregates = {}
+        for row in rows:
+            if len(row) < self.width:
+                continue
+            start = parse_log_datetime(row[self.start_column].strip())
+            if start is None:
+                continue
+            timestamp = start.timestamp() if start.tzinfo else start.replace(tzinfo=timezone.utc).timestamp()
+            bucket = int(timestamp) // self.bucket_seconds * self.bucket_seconds
+            camera = row[self.camera_column].strip()
+
+            for slot, (status_column, error_column, duration_column) in enumerate(self.slot_columns, 1):
+                status = row[status_column].strip()
+                if not is_request_slot(status, row[duration_column]):
+                    continue
+                duration = _duration_value(row[duration_column])
+                aggregate = aggregates.get((bucket, camera, slot, status))
+                if aggregate is None:
+                    aggregate = aggregates[(bucket, camera, slot, status)] = [0, 0, LatencyHistogram()]
+                aggregate[0] += 1
+                if row[error_column].strip():
+                    aggregate[1] += 1
+                if duration is not None:
+                    aggregate[2].add(duration)
+        return aggregates
+
+    def add_rows(self, rows: Iterable[List[str]]) -> int:
+        """
+        Учитывает новые строки таблицы (без заголовков и уже без дубликатов)
+        :return: количество изменившихся агрегатов
+        """
+        aggregates = self._aggregate(rows)
+        with self.connection:
+            for key, (requests, errors, histogram) in aggregates.items():
+                existing = self.connection.execute(
+                    'SELECT requests, errors, histogram FROM rollup '
+                    'WHERE bucket = ? AND camera = ? AND slot = ? AND status = ?', key
+                ).fetchone()
+                if existing is None:
+                    self.connection.execute(
+                        'INSERT INTO rollup (bucket, camera, slot, status, requests, errors, histogram, '
+                        'sheet_row, dirty) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, 1)',
+                        (*key, requests, errors, histogram.to_json())
+                    )
+                    continue
+                histogram.merge(LatencyHistogram.from_json(existing[2]))
+                self.connection.execute(
+                    'UPDATE rollup SET requests = ?, errors = ?, histogram = ?, dirty = 1 '
+                    'WHERE bucket = ? AND camera = ? AND slot = ? AND status = ?',
+                    (existing[0] + requests, existing[1] + errors, histogram.to_json(), *key)
+                )
+        return len(aggregates)
+
+    def dirty_rows(self, first_row: int) -> List[Tuple[int, List[str]]]:
+        """
+        Возвращает изменившиеся агрегаты для записи в лист
+        Новым агрегатам сразу назначаются строки листа, начиная с сохраненного курсора,
+        поэтому повторная запись после сбоя попадает в те же строки
+        :param first_row: первая свободная строка листа, если курсор еще не сохранен
+        :return: список пар (номер строки листа, значения) по возрастанию номера строки
+        """
+        with self.connection:
+            next_row = int(self._get_meta('next_row') or first_row)
+            new_keys = self.connection.execute(
+                'SELECT bucket, camera, slot, status FROM rollup WHERE dirty = 1 AND sheet_row IS NULL '
+                'ORDER BY bucket, camera, slot, status'
+            ).fetchall()
+            for key in new_keys:
+                self.connection.execute(
+                    'UPDATE rollup SET sheet_row = ? WHERE bucket = ? AND camera = ? AND slot = ? AND status = ?',
+                    (next_row, *key)
+                )
+                next_row += 1
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_row', ?)",
+                                    (str(next_row),))
+
+        cursor = self.connection.execute(
+            'SELECT sheet_row, bucket, camera, slot, status, requests, errors, histogram '
+            'FROM rollup WHERE dirty = 1 ORDER BY sheet_row'
+        )
+        return [(sheet_row, self._format_row(bucket, camera, slot, status, requests, errors, histogram))
+                for sheet_row, bucket, camera, slot, status, requests, errors, histogram in cursor]
+
+    @staticmethod
+    def _format_row(bucket, camera, slot, status, requests, errors, histogram) -> List[str]:
+        histogram = LatencyHistogram.from_json(histogram)
+        started = datetime.fromtimestamp(bucket, timezone.utc).strftime('%Y-%m-%d %H:%M')
+        return [
+            started, camera or ' ', str(slot), status or ' ',
+            str(requests), str(errors), f'{errors / requests:.4f}' if requests else '0',
+            str(round(histogram.percentile(50))), str(round(histogram.percentile(95))),
+            str(round(histogram.percentile(99))),
+        ]
+
+    def mark_clean(self, sheet_rows: List[int]):
+        """Отмечает агрегаты, записанные в лист"""
+        with self.connection:
+            self.connection.executemany('UPDATE rollup SET dirty = 0 WHERE sheet_row = ?',
+                                        ((row,) for row in sheet_rows))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,190 @@
+import os
+from typing import Callable, Dict, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Количество запросов (слотов) в строке "Summary data"
+REQUEST_SLOTS = int(os.getenv('REQUEST_SLOTS', '5'))
+
+MAX_CELL_LENGTH = 40000  # Максимальная длина значения в ячейке
+TRUNCATED_SUFFIX = '...(truncated)'
+
+# Поля строки лога до запросов
+FIXED_COLUMNS = (
+    'Type',
+    'CameraSystemName',
+    'BestShotId',
+    'Start DateTime',         # Time bestshot received
+    'Quality',
+    'QualityErrors',
+    'End DateTime',           # Common Time ident request
+)
+
+# Поля одного запроса
+SLOT_FIELDS = ('Status Code', 'Error', 'Duration', 'Request ID', 'DateTime')
+
+# Поля, которые берутся с конца строки
+TAIL_COLUMNS = ('Hash', 'Session ID')
+
+
+def is_status_code(value: str) -> bool:
+    """Похоже ли значение на код статуса HTTP"""
+    value = value.strip()
+    return len(value) == 3 and value.isdigit() and '1' <= value[0] <= '5'
+
+
+def is_request_slot(status: str, duration: str) -> bool:
+    """
+    Заполнен ли слот настоящим запросом
+    В записи с меньшим числом запросов хвост строки (Hash, Session ID) попадает в столбцы
+    Status Code/Error следующего слота - такой слот запросом не считается
+    :param status: значение Status Code слота
+    :param duration: значение Duration слота в мс (без ' ms')
+    :return: True, если длительность - число или статус похож на код HTTP
+    """
+    try:
+        float(duration)
+        return True
+    except ValueError:
+        return is_status_code(status)
+
+
+class LogSchema:
+    """
+    Описание столбцов строки "Summary data" и листа таблицы
+    Строка лога: поля FIXED_COLUMNS, затем request_slots запросов по полям SLOT_FIELDS,
+    в конце Hash и Session ID. По описанию один раз собираются функции разбора строки
+    """
+
+    def __init__(self, request_slots: int = REQUEST_SLOTS):
+        """
+        :param request_slots: сколько запросов может быть в строке
+        """
+        self.request_slots = request_slots
+        self.slot_headers = tuple(
+            tuple(f'{field} {slot}' for field in SLOT_FIELDS) for slot in range(1, request_slots + 1)
+        )
+        self.headers = FIXED_COLUMNS + tuple(h for slot in self.slot_headers for h in slot) + TAIL_COLUMNS
+        self.width = len(self.headers)
+        self.duration_columns = tuple(
+            len(FIXED_COLUMNS) + slot * len(SLOT_FIELDS) + SLOT_FIELDS.index('Duration')
+            for slot in range(request_slots)
+        )
+        # Столбцы (Status Code, Error, Duration) каждого запроса
+        self.request_columns = tuple(
+            tuple(len(FIXED_COLUMNS) + slot * len(SLOT_FIELDS) + SLOT_FIELDS.index(field)
+                  for field in ('Status Code', 'Error', 'Duration'))
+            for slot in range(request_slots)
+        )
+
+    def column(self, name: str) -> int:
+        """Номер столбца по заголовку"""
+        return self.headers.index(name)
+
+    def _split_values(self, values: List[str]) -> List[str]:
+        """
+        Раскладывает значения строки неполной или избыточной длины по столбцам схемы
+        Недостающие поля запроса заполняются пробелом, Hash и Session ID берутся с конца строки,
+        если после последнего запроса осталось хотя бы два значения
+        """
+        count = len(values)
+        fixed = len(FIXED_COLUMNS)
+        slot_width = len(SLOT_FIELDS)
+        result = values[:fixed]
+        if count < fixed:
+            result += [' '] * (fixed - count)
+
+        current = fixed
+        for _ in range(self.request_slots):
+            if current < count:
+                chunk = values[current:current + slot_width]
+                if len(chunk) < slot_width:
+                    chunk += [' '] * (slot_width - len(chunk))
+                result += chunk
+                current += slot_width
+            else:
+                result += [' '] * slot_width
+
+        if count > current + 1:
+            result += values[-2:]
+        else:
+            result += [' ', ' ']
+        return result
+
+    def compile_record_parser(self, error_texts: Dict[str, str] = None) -> Callable[[str], Dict[str, str]]:
+        """
+        Собирает функцию разбора строки в словарь записи (для LogParser.logs и фильтров)
+        Значения остаются как в логе, длительность без ' ms' заменяется пробелом
+        :param error_texts: словарь для интернирования текстов ошибок - одинаковые тексты
+                            во всех записях будут одной строкой в памяти (только ошибки
+                            настоящих запросов, см. is_request_slot)
+        """
+        headers = self.headers
+        width = self.width
+        request_columns = self.request_columns
+        split_values = self._split_values
+        intern_error = (error_texts if error_texts is not None else {}).setdefault
+
+        def parse_record(line: str) -> Dict[str, str]:
+            values = line.split(';')
+            if len(values) != width:
+                values = split_values(values)
+            for status_column, error_column, duration_column in request_columns:
+                duration = values[duration_column]
+                if not (duration and 'ms' in duration):
+                    values[duration_column] = duration = ' '
+                error = values[error_column]
+                if error and is_request_slot(values[status_column], duration.replace(' ms', '')):
+                    values[error_column] = intern_error(error, error)
+            record = dict(zip(headers, values))
+            # Пустые Hash и Session ID заменяются пробелом
+            record['Hash'] = values[-2] or ' '
+            record['Session ID'] = values[-1] or ' '
+            return record
+
+        return parse_record
+
+    def compile_row_converter(self, error_texts: Dict[str, str] = None) -> Callable[[str], List[str]]:
+        """
+        Собирает функцию, которая сразу превращает строку лога в строку таблицы (список, как
+        ждет pygsheets: append_table считает одной строкой все, что не список),
+        без промежуточного словаря: пустые значения заменяются пробелом, длительности
+        приводятся к числу миллисекунд, слишком длинные значения обрезаются
+        :param error_texts: словарь для интернирования текстов ошибок (см. compile_record_parser)
+        """
+        width = self.width
+        duration_columns = self.duration_columns
+        request_columns = self.request_columns
+        split_values = self._split_values
+        intern_error = (error_texts if error_texts is not None else {}).setdefault
+
+        def truncate(value: str) -> str:
+            return value[:MAX_CELL_LENGTH] + TRUNCATED_SUFFIX if len(value) > MAX_CELL_LENGTH else value
+
+        def convert(line: str) -> List[str]:
+            values = line.split(';')
+            if len(values) != width:
+                values = split_values(values)
+            row = [value if value and not value.isspace() else ' ' for value in values]
+            for column in duration_columns:
+                duration = values[column]
+                if 'ms' in duration:
+                    try:
+                        row[column] = str(int(duration.replace(' ms', '')))
+                    except ValueError:
+                        row[column] = ' '
+                else:
+                    row[column] = ' '
+            if len(line) > MAX_CELL_LENGTH:
+                row = [truncate(value) for value in row]
+            for status_column, error_column, duration_column in request_columns:
+                error = row[error_column]
+                if error != ' ' and is_request_slot(row[status_column], row[duration_column]):
+                    row[error_column] = intern_error(error, error)
+            return row
+
+        return convert
+
+
+DEFAULT_SCHEMA = LogSchema()
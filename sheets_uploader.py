@@ -1,14 +1,113 @@
 import pygsheets
 import os
 import sys
+import time
 import logging
-from datetime import datetime
+import signal
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from parser import LogParser
+from parser import iter_file_batches, parse_file_batches, parse_log_datetime
+from checkpoints import CheckpointStore
+from log_io import is_log_file
+from dedup_index import DedupIndex, DedupWindow, row_fingerprint
+from request_scheduler import RequestScheduler
+from metrics import Metrics, get_metrics, set_metrics
+from pipeline import ParsePipeline, FILE_START, FILE_BATCH, FILE_END, FILE_ERROR
+from partitions import PartitionPolicy, PartitionCatalog
+from rollup import RollupStore, ROLLUP_HEADERS
+from sketches import parse_bucket
+from spool import Spool
+from watcher import DirectoryWatcher
+from sinks import FanoutSink, SheetsSink, create_local_sink
+from schema import DEFAULT_SCHEMA
+from error_dictionary import ErrorDictionary, ERROR_DICTIONARY_HEADERS
+from predicates import build_predicate
 
 # Загружаем переменные окружения
 load_dotenv()
 
+# Количество строк, отправляемых в таблицу за одну порцию
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', '5000'))
+
+# Режим записи: 'append' - Sheets API values.append, 'cursor' - запись по сохраненному номеру строки
+UPLOAD_MODE = os.getenv('UPLOAD_MODE', 'append')
+
+# Ограничения на размер одного запроса записи в таблицу
+CHUNK_MAX_ROWS = int(os.getenv('CHUNK_MAX_ROWS', '1000'))
+CHUNK_MAX_BYTES = int(os.getenv('CHUNK_MAX_BYTES', str(2 * 1024 * 1024)))
+
+# Квота Google Sheets API и политика повторов
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv('SHEETS_REQUESTS_PER_MINUTE', '60'))
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '5'))
+
+# Во сколько раз увеличивать таблицу, когда в ней заканчиваются строки
+SHEET_GROWTH_FACTOR = 1.5
+
+# Директория для состояния между запусками (контрольные точки и т.п.)
+STATE_DIRECTORY = os.getenv('STATE_DIR', 'state')
+
+# Через сколько секунд без изменений файл считается дописанным,
+# и его последняя строка без перевода строки обрабатывается
+FILE_SETTLE_SECONDS = int(os.getenv('FILE_SETTLE_SECONDS', '300'))
+
+# Разбиение на листы: none, day, month или rows:N
+PARTITION_POLICY = os.getenv('PARTITION_POLICY', 'none')
+
+# Лимит ячеек в одной таблице Google Sheets и листов в ней
+SPREADSHEET_CELL_LIMIT = int(os.getenv('SPREADSHEET_CELL_LIMIT', '10000000'))
+SPREADSHEET_SHEET_LIMIT = int(os.getenv('SPREADSHEET_SHEET_LIMIT', '200'))
+
+# Начальный размер нового листа-раздела
+PARTITION_INITIAL_ROWS = 1000
+
+# Кому открыть доступ к новым таблицам, созданным при переполнении (адреса через запятую)
+PARTITION_SHARE_WITH = os.getenv('PARTITION_SHARE_WITH', '')
+
+# Сколько локальных индексов дубликатов разделов держать открытыми
+PARTITION_OPEN_INDEXES = 8
+
+# Агрегаты по интервалам времени: off - нет, alongside - вместе с исходными строками, only - только агрегаты
+ROLLUP_MODE = os.getenv('ROLLUP_MODE', 'off')
+ROLLUP_BUCKET = os.getenv('ROLLUP_BUCKET', '1h')
+ROLLUP_WORKSHEET = os.getenv('ROLLUP_WORKSHEET', 'Rollup')
+
+# Компактные ошибки: в столбцы Error n пишутся короткие идентификаторы, тексты - на отдельный лист
+COMPACT_ERRORS = os.getenv('COMPACT_ERRORS', '0') == '1'
+ERRORS_WORKSHEET = os.getenv('ERRORS_WORKSHEET', 'Errors')
+
+# Сохранять разобранные порции в локальный спул и загружать их оттуда крупными порциями
+USE_SPOOL = os.getenv('USE_SPOOL', '0') == '1'
+SPOOL_DRAIN_ROWS = int(os.getenv('SPOOL_DRAIN_ROWS', '20000'))
+
+# Режим демона: сброс накопленных строк по количеству или по времени с появления первой строки
+DAEMON_FLUSH_ROWS = int(os.getenv('DAEMON_FLUSH_ROWS', '500'))
+DAEMON_FLUSH_SECONDS = float(os.getenv('DAEMON_FLUSH_SECONDS', '10'))
+# Период опроса директории без inotify и пауза после неудачной загрузки
+DAEMON_POLL_SECONDS = float(os.getenv('DAEMON_POLL_SECONDS', '5'))
+DAEMON_RETRY_SECONDS = float(os.getenv('DAEMON_RETRY_SECONDS', '60'))
+# Как часто пересматривать файлы без событий (дописанная последняя строка без перевода строки)
+DAEMON_RESCAN_SECONDS = 60
+
+# Проверка дубликатов в памяти перед локальным индексом: окно точных отпечатков по Start DateTime
+# (пусто - выключено), допустимое опоздание строк и фильтр Блума для более старых отпечатков
+DEDUP_WINDOW = os.getenv('DEDUP_WINDOW', '')
+DEDUP_LATENESS = os.getenv('DEDUP_LATENESS', '5m')
+DEDUP_BLOOM_CAPACITY = int(os.getenv('DEDUP_BLOOM_CAPACITY', '10000000'))
+DEDUP_BLOOM_FP_RATE = float(os.getenv('DEDUP_BLOOM_FP_RATE', '0.01'))
+
+# Куда записывать строки: sheets, jsonl:путь, csv:путь, sqlite:путь, sketch[:путь] (через запятую)
+OUTPUT_SINKS = os.getenv('OUTPUT_SINKS', 'sheets')
+
+# Пополнять индекс Session ID и Request ID по ходу разбора (поиск: python id_index.py ID)
+USE_ID_INDEX = os.getenv('ID_INDEX', '0') == '1'
+
+# Сколько разобранных порций может ждать загрузки (0 - разбор и загрузка по очереди в одном потоке)
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '4'))
+
 # Настраиваем логирование
 log_directory = 'logs'
 if not os.path.exists(log_directory):
@@ -32,178 +131,964 @@ def col_num_to_letter(n):
         result = chr(65 + remainder) + result
     return result
 
+def _numbered_row_ranges(rows, last_col_letter):
+    """
+    Готовит запись строк с заранее назначенными номерами одним запросом update_values_batch
+    Соседние строки объединяются в один диапазон
+    :param rows: пары (номер строки листа, значения) по возрастанию номера
+    :return: диапазоны вида A2:J5 и значения для каждого из них
+    """
+    ranges, values = [], []
+    for sheet_row, row in rows:
+        if ranges and sheet_row == ranges[-1][1] + 1:
+            ranges[-1][1] = sheet_row
+            values[-1].append(row)
+        else:
+            ranges.append([sheet_row, sheet_row])
+            values.append([row])
+    return [f'A{first}:{last_col_letter}{last}' for first, last in ranges], values
+
 class SheetsUploader:
-    def __init__(self):
+    def __init__(self, rebuild_index=False, partition_policy=None, rollup_mode=None, rollup_bucket=None,
+                 compact_errors=None, dedup_window=None, schema=None):
+        """
+        :param rebuild_index: принудительно перестроить локальный индекс дубликатов по таблице
+        :param partition_policy: правило разбиения на листы (по умолчанию PARTITION_POLICY)
+        :param rollup_mode: режим агрегатов off, alongside или only (по умолчанию ROLLUP_MODE)
+        :param rollup_bucket: интервал агрегации, например 5m или 1h (по умолчанию ROLLUP_BUCKET)
+        :param compact_errors: писать вместо текстов ошибок идентификаторы из листа-словаря
+                               (по умолчанию COMPACT_ERRORS)
+        :param dedup_window: окно точной проверки дубликатов в памяти, например 15m
+                             (по умолчанию DEDUP_WINDOW; пусто - только локальный индекс)
+        :param schema: описание столбцов листа (по умолчанию DEFAULT_SCHEMA)
+        """
+        self.schema = schema or DEFAULT_SCHEMA
         self.credentials_file = 'fair-root-445807-i5-aa2407460343.json'
         self.spreadsheet_id = os.getenv('SPREADSHEET_ID')
+        self.api = RequestScheduler(rate_per_minute=SHEETS_REQUESTS_PER_MINUTE,
+                                    max_retries=SHEETS_MAX_RETRIES)
         self.client = self._get_client()
-        self.spreadsheet = self.client.open_by_key(self.spreadsheet_id)
+        self.spreadsheet = self.api.call(self.client.open_by_key, self.spreadsheet_id)
+        self.partition_policy = PartitionPolicy(partition_policy or PARTITION_POLICY)
+        self.rebuild_index = rebuild_index
+        # Активный лист-раздел (None - запись в первый лист таблицы)
+        self.segment = None
+        self.cursor_key = 'next_row'
+        dedup_window = DEDUP_WINDOW if dedup_window is None else dedup_window
+        self.dedup_window_seconds = parse_bucket(dedup_window) if dedup_window else None
+        self.dedup_lateness_seconds = parse_bucket(DEDUP_LATENESS)
+
+        self.rollup_mode = rollup_mode or ROLLUP_MODE
+        if self.rollup_mode not in ('off', 'alongside', 'only'):
+            raise ValueError(f"Неизвестный режим агрегатов: {self.rollup_mode}")
+        self.rollup = None
+        self.rollup_worksheet = None
+        if self.rollup_mode != 'off':
+            self.rollup = RollupStore(os.path.join(STATE_DIRECTORY, 'rollup.sqlite3'),
+                                      parse_bucket(rollup_bucket or ROLLUP_BUCKET), self.schema)
+
+        self.error_dictionary = None
+        self.errors_worksheet = None
+        if COMPACT_ERRORS if compact_errors is None else compact_errors:
+            self.error_dictionary = ErrorDictionary(os.path.join(STATE_DIRECTORY, 'errors.sqlite3'), self.schema)
+
+        if self.partition_policy.enabled:
+            self.catalog = PartitionCatalog(os.path.join(STATE_DIRECTORY, 'partitions.json'))
+            self.spreadsheets = {self.spreadsheet.id: self.spreadsheet}
+            self.worksheets = {}
+            self.partition_indexes = OrderedDict()
+            self.rebuilt_keys = set()
+            self.worksheet = None
+            self.dedup_index = None
+            return
+
         self.worksheet = self.spreadsheet.sheet1
         self._ensure_headers()
-        self.existing_data = self._get_existing_data()
+        self.dedup_index = DedupIndex(os.path.join(STATE_DIRECTORY, 'dedup.sqlite3'), self._new_dedup_window())
+        if rebuild_index or not self.dedup_index.is_valid():
+            self._rebuild_dedup_index()
+            # Таблица могла измениться - номер следующей строки определим заново
+            self.dedup_index.delete_meta('next_row')
     
+    def _new_dedup_window(self):
+        """Проверка дубликатов в памяти для нового локального индекса (или None, если выключена)"""
+        if self.dedup_window_seconds is None:
+            return None
+        return DedupWindow(self.dedup_window_seconds, self.dedup_lateness_seconds,
+                           DEDUP_BLOOM_CAPACITY, DEDUP_BLOOM_FP_RATE)
+
+    def close(self):
+        """Закрывает локальные индексы дубликатов"""
+        indexes = list(self.partition_indexes.values()) if self.partition_policy.enabled else [self.dedup_index]
+        for index in indexes:
+            index.close()
+
     def _get_client(self):
         """Создает клиент pygsheets"""
-        return pygsheets.authorize(service_file=self.credentials_file)
+        # Повторы и ожидание квоты выполняет RequestScheduler, встроенные в pygsheets отключаем
+        return pygsheets.authorize(service_file=self.credentials_file, retries=0, check=False)
     
-    def _get_existing_data(self):
-        """Получает существующие данные из таблице по столбцам D и G"""
-        try:
-            start_dates = self.worksheet.get_col(4, include_empty=False)
-            end_dates = self.worksheet.get_col(7, include_empty=False)
-            existing_records = set()
+    def _get_existing_data(self, worksheets=None):
+        """Получает существующие данные из листов (по умолчанию текущего) по столбцам D и G"""
+        for worksheet in worksheets or [self.worksheet]:
+            start_dates = self.api.call(worksheet.get_col, 4, include_empty=False)
+            end_dates = self.api.call(worksheet.get_col, 7, include_empty=False)
             
             for start_date, end_date in zip(start_dates[1:], end_dates[1:]):
                 if start_date and end_date:
-                    record_id = f"{start_date}_{end_date}"
-                    existing_records.add(record_id)
-            
-            logging.info(f"Загружено {len(existing_records)} существующих записей")
-            return existing_records
+                    yield start_date, end_date
+
+    def _rebuild_dedup_index(self, worksheets=None):
+        """Перестраивает локальный индекс дубликатов по столбцам D и G таблицы"""
+        try:
+            logging.info("Перестроение локального индекса дубликатов по таблице...")
+            count = self.dedup_index.rebuild(self._get_existing_data(worksheets))
+            logging.info(f"Загружено {count} существующих записей")
             
         except Exception as e:
             logging.error(f"Ошибка при получении существующих данных: {e}")
-            return set()
     
     def _filter_duplicates(self, data):
-        """Фильтрует дубликаты из новых данных по столбцам D и G"""
+        """
+        Фильтрует дубликаты из новых данных по столбцам D и G
+        :return: отфильтрованные данные и отпечатки оставшихся строк
+        """
         if len(data) <= 1:
-            return data
+            return data, []
         
         try:
-            start_dt_idx = 3  # D = 4-й столбец (индекс 3)
-            end_dt_idx = 6    # G = 7-й столбец (индекс 6)
-            
-            filtered_data = [data[0]]  # Сохраняем заголовки
-            duplicates_count = 0
-            
-            for row in data[1:]:
-                if len(row) > max(start_dt_idx, end_dt_idx):
-                    record_id = f"{row[start_dt_idx]}_{row[end_dt_idx]}"
-                    if record_id not in self.existing_data:
-                        filtered_data.append(row)
-                        self.existing_data.add(record_id)
-                    else:
-                        duplicates_count += 1
-            
-            logging.info(f"Найдено {duplicates_count} дубликатов")
-            logging.info(f"Осталось {len(filtered_data) - 1} уникальных записей")
-            return filtered_data
+            with get_metrics().timer('dedup'):
+                return self._filter_duplicates_by_index(data)
             
         except Exception as e:
             logging.error(f"Ошибка при фильтрации дубликатов: {e}")
-            return data
+            return data, [None] * (len(data) - 1)
+    
+    def _filter_duplicates_by_index(self, data):
+        """Отбрасывает строки, отпечатки которых уже есть в локальном индексе"""
+        start_dt_idx = self.schema.column('Start DateTime')  # D
+        end_dt_idx = self.schema.column('End DateTime')      # G
+        
+        candidates = []
+        for row in data[1:]:
+            if len(row) > max(start_dt_idx, end_dt_idx):
+                candidates.append((row_fingerprint(row[start_dt_idx], row[end_dt_idx]), row))
+        
+        timestamps = None
+        if self.dedup_index.window is not None:
+            # Время строк нужно окну в памяти, чтобы вытеснять старые отпечатки в фильтр Блума
+            timestamps = []
+            for _, row in candidates:
+                start = parse_log_datetime(row[start_dt_idx])
+                if start is not None and start.tzinfo is None:
+                    start = start.replace(tzinfo=timezone.utc)
+                timestamps.append(start.timestamp() if start is not None else None)
+        existing = self.dedup_index.existing([fp for fp, _ in candidates], timestamps)
+        filtered_data = [data[0]]  # Сохраняем заголовки
+        fingerprints = []
+        duplicates_count = 0
+        
+        for fp, row in candidates:
+            if fp not in existing:
+                filtered_data.append(row)
+                fingerprints.append(fp)
+                existing.add(fp)
+            else:
+                duplicates_count += 1
+        
+        get_metrics().inc('duplicates_dropped', duplicates_count)
+        logging.info(f"Найдено {duplicates_count} дубликатов")
+        logging.info(f"Осталось {len(filtered_data) - 1} уникальных записей")
+        return filtered_data, fingerprints
     
-    def _ensure_sheet_size(self, required_rows):
-        """Проверяет и при необходимости расширяет размер таблицы"""
+    def _ensure_sheet_size(self, required_rows, worksheet=None):
+        """Проверяет и при необходимости расширяет размер таблицы с геометрическим ростом"""
         try:
-            current_rows = self.worksheet.rows
+            worksheet = worksheet or self.worksheet
+            current_rows = worksheet.rows
             if required_rows > current_rows:
-                new_rows = required_rows + 1000
-                self.worksheet.resize(rows=new_rows)
+                new_rows = max(required_rows, int(current_rows * SHEET_GROWTH_FACTOR), current_rows + 1000)
+                if self.segment is not None and worksheet is self.worksheet:
+                    # Не выходим за лимит ячеек таблицы
+                    new_rows = max(required_rows, min(new_rows, self._segment_grid_limit()))
+                self.api.call(worksheet.resize, rows=new_rows)
                 logging.info(f"Таблица расширена до {new_rows} строк")
                 
         except Exception as e:
             logging.error(f"Ошибка при расширении таблицы: {e}")
     
+    def _iter_chunks(self, values, fingerprints):
+        """
+        Разбивает строки на порции, ограниченные по количеству строк и объему данных
+        :return: итератор пар (строки порции, отпечатки строк порции)
+        """
+        chunk, chunk_fingerprints, chunk_bytes = [], [], 0
+        for row, fp in zip(values, fingerprints):
+            # Приблизительный размер строки в JSON-запросе: значения плюс кавычки и запятые
+            row_bytes = sum(len(value) for value in row) + 3 * len(row)
+            if chunk and (len(chunk) >= CHUNK_MAX_ROWS or chunk_bytes + row_bytes > CHUNK_MAX_BYTES):
+                yield chunk, chunk_fingerprints
+                chunk, chunk_fingerprints, chunk_bytes = [], [], 0
+            chunk.append(row)
+            chunk_fingerprints.append(fp)
+            chunk_bytes += row_bytes
+        
+        if chunk:
+            yield chunk, chunk_fingerprints
+    
+    def _next_row(self):
+        """Возвращает номер первой свободной строки по сохраненному курсору"""
+        next_row = self.dedup_index.get_meta(self.cursor_key)
+        if next_row is not None:
+            return int(next_row)
+        
+        # Курсора еще нет - один раз определяем его по столбцу A
+        last_row = len(self.api.call(self.worksheet.get_col, 1, include_empty=False))
+        return last_row + 1
+    
+    def _write_chunk(self, values, fingerprints):
+        """Записывает одну порцию строк и фиксирует ее в локальном индексе"""
+        if UPLOAD_MODE == 'cursor':
+            next_row = self._next_row()
+            self._ensure_sheet_size(next_row + len(values) - 1)
+            
+            last_col_letter = col_num_to_letter(len(values[0]))
+            start_cell = f'A{next_row}'
+            end_cell = f'{last_col_letter}{next_row + len(values) - 1}'
+            
+            # Запись в фиксированный диапазон идемпотентна - ее можно безопасно повторять
+            self.api.call(
+                self.worksheet.update_values,
+                crange=f'{start_cell}:{end_cell}',
+                values=values
+            )
+            meta = {self.cursor_key: str(next_row + len(values))}
+        else:
+            # values.append сам находит конец таблицы и вставляет строки. Вызываем его напрямую:
+            # append_table после него делает еще refresh, и 429 на refresh повторял бы всю запись
+            title = self.worksheet.title.replace("'", "''")
+            self.api.call(self.client.sheet.values_append, self.worksheet.spreadsheet.id, values, 'ROWS',
+                          range=f"'{title}'!A1", insertDataOption='INSERT_ROWS', idempotent=False)
+            meta = None
+        
+        # Порция записана - фиксируем ее строки в агрегатах и локальном индексе
+        self._commit_rows(values, fingerprints, meta)
+        if self.segment is not None:
+            if UPLOAD_MODE != 'cursor':
+                # Вставка строк увеличила лист - размер для учета ячеек узнаем отдельным запросом
+                self.api.call(self.worksheet.refresh, False)
+            self.catalog.record_rows(self.segment, len(values), self.worksheet.rows)
+            self.catalog.save()
+    
+    def _commit_rows(self, values, fingerprints, meta=None):
+        """
+        Учитывает записанные строки в агрегатах и сразу же - в локальном индексе дубликатов
+        Строки порции, которую записать не удалось, не попадают ни туда, ни туда, поэтому
+        при повторе они не будут учтены в агрегатах дважды
+        """
+        if self.rollup is not None:
+            self.rollup.add_rows(values)
+        self.dedup_index.add((fp for fp in fingerprints if fp is not None), meta)
+
     def _ensure_headers(self):
         """Проверяет и при необходимости создает заголовки в таблице"""
         try:
-            headers = self.worksheet.get_row(1)
-            required_headers = [
-                'Type', 'CameraSystemName', 'BestShotId', 'Start DateTime',
-                'Quality', 'QualityErrors', 'End DateTime',
-                'Status Code 1', 'Error 1', 'Duration 1', 'Request ID 1', 'DateTime 1',
-                'Status Code 2', 'Error 2', 'Duration 2', 'Request ID 2', 'DateTime 2',
-                'Status Code 3', 'Error 3', 'Duration 3', 'Request ID 3', 'DateTime 3',
-                'Status Code 4', 'Error 4', 'Duration 4', 'Request ID 4', 'DateTime 4',
-                'Status Code 5', 'Error 5', 'Duration 5', 'Request ID 5', 'DateTime 5',
-                'Hash', 'Session ID'
-            ]
+            headers = self.api.call(self.worksheet.get_row, 1)
+            required_headers = list(self.schema.headers)
             
             if not headers or headers != required_headers:
                 logging.info("Обновление заголовков таблицы...")
-                self.worksheet.update_row(1, required_headers)
+                self.api.call(self.worksheet.update_row, 1, required_headers)
                 logging.info("Заголовки обновлены")
             
         except Exception as e:
             logging.error(f"Ошибка при проверке/создании заголовков: {e}")
     
+    def _open_spreadsheet(self, spreadsheet_id):
+        """Открывает таблицу по идентификатору (с кэшем)"""
+        if spreadsheet_id not in self.spreadsheets:
+            self.spreadsheets[spreadsheet_id] = self.api.call(self.client.open_by_key, spreadsheet_id)
+        return self.spreadsheets[spreadsheet_id]
+    
+    def _open_segment_worksheet(self, segment):
+        """Открывает лист раздела (с кэшем)"""
+        title = segment['title']
+        if title not in self.worksheets:
+            spreadsheet = self._open_spreadsheet(segment['spreadsheet_id'])
+            self.worksheets[title] = self.api.call(spreadsheet.worksheet_by_title, title)
+        return self.worksheets[title]
+    
+    def _segment_free_cells(self, spreadsheet_id):
+        return SPREADSHEET_CELL_LIMIT - self.catalog.used_cells(spreadsheet_id)
+    
+    def _segment_grid_limit(self):
+        """Сколько строк может занять сетка активного листа, не превышая лимит ячеек таблицы"""
+        segment = self.segment
+        return segment['grid_rows'] + self._segment_free_cells(segment['spreadsheet_id']) // segment['cols']
+    
+    def _segment_room(self):
+        """Сколько строк данных еще можно записать в активный лист (None - без ограничений)"""
+        if self.segment is None:
+            return None
+        room = self._segment_grid_limit() - 1 - self.segment['rows']
+        if self.partition_policy.max_rows is not None:
+            room = min(room, self.partition_policy.max_rows - self.segment['rows'])
+        return room
+    
+    def _target_spreadsheet(self, cols):
+        """Выбирает таблицу для нового листа; создает новую таблицу, если в текущей нет места"""
+        if not self.catalog.spreadsheets:
+            # Первая таблица - основная; учитываем уже существующие в ней листы
+            worksheets = self.api.call(self.spreadsheet.worksheets)
+            self.catalog.add_spreadsheet(self.spreadsheet.id,
+                                         sum(ws.rows * ws.cols for ws in worksheets), len(worksheets))
+        
+        spreadsheet_id = self.catalog.spreadsheets[-1]['id']
+        has_room = (self._segment_free_cells(spreadsheet_id) >= PARTITION_INITIAL_ROWS * cols
+                    and self.catalog.sheet_count(spreadsheet_id) < SPREADSHEET_SHEET_LIMIT)
+        if has_room:
+            return self._open_spreadsheet(spreadsheet_id)
+        
+        number = len(self.catalog.spreadsheets) + 1
+        title = f'{self.spreadsheet.title} ({number})'
+        logging.info(f"В таблице {spreadsheet_id} заканчиваются ячейки, создается таблица {title}")
+        spreadsheet = self.api.call(self.client.create, title, idempotent=False)
+        for email in filter(None, (address.strip() for address in PARTITION_SHARE_WITH.split(','))):
+            self.api.call(spreadsheet.share, email, role='writer')
+        worksheets = self.api.call(spreadsheet.worksheets)
+        self.catalog.add_spreadsheet(spreadsheet.id, sum(ws.rows * ws.cols for ws in worksheets), len(worksheets))
+        self.spreadsheets[spreadsheet.id] = spreadsheet
+        return spreadsheet
+    
+    def _create_segment(self, key, cols):
+        """Создает следующий лист раздела с заголовками и делает его активным"""
+        spreadsheet = self._target_spreadsheet(cols)
+        number = len(self.catalog.segments_for_key(key)) + 1
+        title = self.partition_policy.segment_title(key, number)
+        worksheet = self.api.call(spreadsheet.add_worksheet, title, rows=PARTITION_INITIAL_ROWS, cols=cols,
+                                  idempotent=False)
+        segment = self.catalog.add_segment(key, title, spreadsheet.id, PARTITION_INITIAL_ROWS, cols)
+        self.catalog.save()
+        self.worksheets[title] = worksheet
+        logging.info(f"Создан лист {title} в таблице {spreadsheet.id}")
+        
+        self.segment = segment
+        self.worksheet = worksheet
+        self.cursor_key = f'next_row:{title}'
+        self._ensure_headers()
+        self.dedup_index.add([], {self.cursor_key: '2'})
+    
+    def _activate_partition(self, key, cols):
+        """
+        Делает активным последний лист раздела и его локальный индекс дубликатов
+        Индекс дубликатов общий для всех листов раздела, курсор записи - свой у каждого листа
+        """
+        if key in self.partition_indexes:
+            self.partition_indexes.move_to_end(key)
+        else:
+            self.partition_indexes[key] = DedupIndex(os.path.join(STATE_DIRECTORY, 'partitions', f'{key}.sqlite3'),
+                                                     self._new_dedup_window())
+            if len(self.partition_indexes) > PARTITION_OPEN_INDEXES:
+                _, index = self.partition_indexes.popitem(last=False)
+                index.close()
+        self.dedup_index = self.partition_indexes[key]
+        
+        segment = self.catalog.active_segment(key)
+        if segment is None:
+            self.dedup_index.rebuild([])
+            self._create_segment(key, cols)
+            return
+        
+        self.segment = segment
+        self.worksheet = self._open_segment_worksheet(segment)
+        self.cursor_key = f'next_row:{segment["title"]}'
+        
+        needs_rebuild = self.rebuild_index and key not in self.rebuilt_keys
+        if needs_rebuild or not self.dedup_index.is_valid():
+            segments = self.catalog.segments_for_key(key)
+            self._rebuild_dedup_index([self._open_segment_worksheet(item) for item in segments])
+            for item in segments:
+                self.dedup_index.delete_meta(f'next_row:{item["title"]}')
+        self.rebuilt_keys.add(key)
+    
+    def _upload_to_active(self, data):
+        """Загружает строки в активный лист, переходя на следующий лист раздела при заполнении"""
+        filtered_data, fingerprints = self._filter_duplicates(data)
+        
+        if len(filtered_data) <= 1:
+            logging.info("После фильтрации дубликатов нет данных для загрузки")
+            return
+        
+        values = filtered_data[1:]
+        if self.rollup_mode == 'only':
+            # Исходные строки не пишем, но запоминаем их, чтобы не учесть повторно
+            self._commit_rows(values, fingerprints)
+            logging.info(f"Учтено в агрегатах {len(values)} новых строк")
+            return
+        
+        if self.error_dictionary is not None:
+            values = self.error_dictionary.compact_rows(values)
+            # Сначала словарь: идентификаторы в строках всегда должны быть расшифрованы
+            self._flush_error_dictionary()
+        
+        uploaded_rows = 0
+        metrics = get_metrics()
+        for chunk, chunk_fingerprints in self._iter_chunks(values, fingerprints):
+            while chunk:
+                room = self._segment_room()
+                if room is not None and room <= 0:
+                    self._create_segment(self.segment['key'], self.segment['cols'])
+                    continue
+                size = len(chunk) if room is None else min(room, len(chunk))
+                with metrics.timer('upload'):
+                    self._write_chunk(chunk[:size], chunk_fingerprints[:size])
+                chunk, chunk_fingerprints = chunk[size:], chunk_fingerprints[size:]
+                uploaded_rows += size
+                metrics.inc('rows_uploaded', size)
+                metrics.inc('chunks_uploaded')
+                logging.info(f"Загружено {uploaded_rows} из {len(values)} строк")
+        
+        logging.info(f"Добавлено {len(values)} новых строк")
+    
+    def _get_errors_worksheet(self):
+        """Открывает лист-словарь ошибок, создавая его с заголовками при первом запуске"""
+        if self.errors_worksheet is None:
+            try:
+                self.errors_worksheet = self.api.call(self.spreadsheet.worksheet_by_title, ERRORS_WORKSHEET)
+            except pygsheets.WorksheetNotFound:
+                self.errors_worksheet = self.api.call(self.spreadsheet.add_worksheet, ERRORS_WORKSHEET, rows=1000,
+                                                      cols=len(ERROR_DICTIONARY_HEADERS), idempotent=False)
+                self.api.call(self.errors_worksheet.update_row, 1, ERROR_DICTIONARY_HEADERS)
+                logging.info(f"Создан лист-словарь ошибок {ERRORS_WORKSHEET}")
+        return self.errors_worksheet
+    
+    def _flush_error_dictionary(self):
+        """Дописывает на лист-словарь тексты ошибок, которых там еще нет"""
+        rows = self.error_dictionary.dirty_rows(first_row=2)
+        if not rows:
+            return
+        
+        worksheet = self._get_errors_worksheet()
+        self._ensure_sheet_size(rows[-1][0], worksheet)
+        last_col_letter = col_num_to_letter(len(ERROR_DICTIONARY_HEADERS))
+        for i in range(0, len(rows), CHUNK_MAX_ROWS):
+            chunk = rows[i:i + CHUNK_MAX_ROWS]
+            self.api.call(worksheet.update_values_batch, *_numbered_row_ranges(chunk, last_col_letter))
+            self.error_dictionary.mark_clean([sheet_row for sheet_row, _ in chunk])
+            get_metrics().inc('error_texts_uploaded', len(chunk))
+        
+        logging.info(f"Добавлено {len(rows)} текстов в лист-словарь ошибок")
+    
+    def _get_rollup_worksheet(self):
+        """Открывает лист агрегатов, создавая его с заголовками при первом запуске"""
+        if self.rollup_worksheet is None:
+            try:
+                self.rollup_worksheet = self.api.call(self.spreadsheet.worksheet_by_title, ROLLUP_WORKSHEET)
+            except pygsheets.WorksheetNotFound:
+                self.rollup_worksheet = self.api.call(self.spreadsheet.add_worksheet, ROLLUP_WORKSHEET,
+                                                      rows=1000, cols=len(ROLLUP_HEADERS), idempotent=False)
+                self.api.call(self.rollup_worksheet.update_row, 1, ROLLUP_HEADERS)
+                logging.info(f"Создан лист агрегатов {ROLLUP_WORKSHEET}")
+        return self.rollup_worksheet
+    
+    def flush_rollup(self):
+        """Записывает в лист агрегатов только изменившиеся строки"""
+        if self.rollup is None:
+            return
+        try:
+            rows = self.rollup.dirty_rows(first_row=2)
+            if not rows:
+                return
+            
+            worksheet = self._get_rollup_worksheet()
+            self._ensure_sheet_size(rows[-1][0], worksheet)
+            last_col_letter = col_num_to_letter(len(ROLLUP_HEADERS))
+            metrics = get_metrics()
+            
+            for i in range(0, len(rows), CHUNK_MAX_ROWS):
+                chunk = rows[i:i + CHUNK_MAX_ROWS]
+                with metrics.timer('rollup_upload'):
+                    self.api.call(worksheet.update_values_batch, *_numbered_row_ranges(chunk, last_col_letter))
+                self.rollup.mark_clean([sheet_row for sheet_row, _ in chunk])
+                metrics.inc('rollup_rows_upserted', len(chunk))
+            
+            logging.info(f"Обновлено {len(rows)} строк в листе агрегатов")
+            
+        except Exception as e:
+            get_metrics().inc('upload_failures')
+            logging.error(f"Ошибка при обновлении листа агрегатов: {e}")
+    
     def upload_data(self, data):
-        """Добавляет новые данные в конец таблицы"""
+        """Добавляет новые данные в конец таблицы (или листов-разделов)"""
         try:
             if not data or len(data) <= 1:
                 logging.info("Нет данных для загрузки")
                 return True
             
-            filtered_data = self._filter_duplicates(data)
-            
-            if len(filtered_data) <= 1:
-                logging.info("После фильтрации дубликатов нет данных для загрузки")
+            if not self.partition_policy.enabled:
+                self._upload_to_active(data)
                 return True
             
-            last_row = len(self.worksheet.get_col(1, include_empty=False))
-            next_row = last_row + 1
-            
-            required_rows = next_row + len(filtered_data) - 1
-            self._ensure_sheet_size(required_rows)
-            
-            values = filtered_data[1:]
-            last_col = len(filtered_data[0])
-            last_col_letter = col_num_to_letter(last_col)
-            
-            start_cell = f'A{next_row}'
-            end_cell = f'{last_col_letter}{next_row + len(values) - 1}'
-            
-            self.worksheet.update_values(
-                crange=f'{start_cell}:{end_cell}',
-                values=values
-            )
-            
-            logging.info(f"Добавлено {len(values)} новых строк")
+            for key, partition_data in self.partition_policy.split(data):
+                self._activate_partition(key, len(data[0]))
+                self._upload_to_active(partition_data)
             return True
             
         except Exception as e:
+            get_metrics().inc('upload_failures')
             logging.error(f"Ошибка при добавлении данных: {e}")
             return False
 
+def _write_metrics(metrics_dir):
+    """Сохраняет итог запуска в JSON и в файл для textfile collector node_exporter"""
+    if not metrics_dir:
+        return
+    try:
+        metrics = get_metrics()
+        metrics.write_json(os.path.join(metrics_dir, 'uploader_metrics.json'))
+        metrics.write_prometheus(os.path.join(metrics_dir, 'gsheet_uploader.prom'))
+    except OSError as e:
+        logging.error(f"Ошибка при сохранении метрик: {e}")
+
+def _create_sink(specs, create_uploader):
+    """
+    Создает получателя строк по списку описаний
+    :param specs: описания получателей: sheets, jsonl:путь, csv:путь, sqlite:путь
+    :param create_uploader: функция, создающая SheetsUploader (вызывается, только если нужен sheets)
+    :return: получатель (несколько - через FanoutSink) и загрузчик в Google Sheets или None
+    """
+    sinks = []
+    uploader = None
+    for spec in specs:
+        spec = spec.strip()
+        if spec == 'sheets':
+            uploader = create_uploader()
+            sinks.append(SheetsSink(uploader))
+        elif spec:
+            sinks.append(create_local_sink(spec))
+    if not sinks:
+        raise ValueError("Не указано, куда записывать строки")
+    return (sinks[0] if len(sinks) == 1 else FanoutSink(sinks)), uploader
+
+def _drain_spool(spool, sink):
+    """
+    Загружает строки из спула крупными порциями (в том числе из разных файлов)
+    Порции удаляются из спула только после успешной загрузки
+    :return: False, если загрузка не удалась и строки остались в спуле
+    """
+    while True:
+        ids, data = spool.next_batch(SPOOL_DRAIN_ROWS)
+        if not ids:
+            return True
+        if not sink.write(data):
+            logging.error(f"Загрузка из спула прервана, ожидают загрузки {spool.pending_rows()} строк")
+            return False
+        spool.ack(ids)
+        get_metrics().inc('spool_batches_drained', len(ids))
+
+def _find_pending_files(logs_dir, checkpoints):
+    """
+    Определяет по контрольным точкам, в каких лог-файлах появились новые данные
+    :return: имена всех лог-файлов директории и кортежи
+             (имя, путь, stat, начальное смещение, обрабатывать ли последнюю строку без перевода строки)
+    """
+    log_files = [f for f in os.listdir(logs_dir) if is_log_file(f)]
+    pending_files = []
+    for log_file in sorted(log_files):
+        log_path = os.path.join(logs_dir, log_file)
+        stat = os.stat(log_path)
+        start_offset = checkpoints.get_start_offset(log_path, stat)
+        if start_offset is None:
+            get_metrics().inc('files_skipped')
+            continue
+        # Последнюю строку без перевода строки обрабатываем, только если файл уже не дописывается
+        include_partial = time.time() - stat.st_mtime > FILE_SETTLE_SECONDS
+        pending_files.append((log_file, log_path, stat, start_offset, include_partial))
+    return log_files, pending_files
+
+class UploadDaemon:
+    """
+    Постоянно работающий загрузчик
+    Держит авторизованный клиент и индекс дубликатов открытыми, ждет изменений в директории
+    с логами, дочитывает файлы с контрольных точек и отправляет накопленные строки, когда их
+    набралось DAEMON_FLUSH_ROWS или с появления первой из них прошло DAEMON_FLUSH_SECONDS
+    """
+
+    def __init__(self, logs_dir, sink, checkpoints, spool=None, metrics_dir=None, id_index_path=None,
+                 predicate=None):
+        """
+        :param sink: получатель строк (Google Sheets и/или локальные файлы)
+        :param spool: локальный спул; без него строки копятся в памяти, а контрольные точки
+                      сохраняются только после загрузки
+        :param id_index_path: индекс идентификаторов, который пополняется по ходу разбора
+        :param predicate: условие отбора строк (см. predicates.py)
+        """
+        self.logs_dir = logs_dir
+        self.sink = sink
+        self.checkpoints = checkpoints
+        self.spool = spool
+        self.metrics_dir = metrics_dir
+        self.id_index_path = id_index_path
+        self.predicate = predicate
+        self.stop_event = threading.Event()
+        self.headers = None
+        self.buffer = []
+        self.buffered_since = None
+        self.retry_at = 0.0
+    
+    def stop(self, signum=None, frame=None):
+        """Просит демона сбросить накопленные строки и завершиться"""
+        logging.info("Получен сигнал остановки")
+        self.stop_event.set()
+    
+    def _pending_rows(self):
+        return self.spool.pending_rows() if self.spool is not None else len(self.buffer)
+    
+    def _add_batch(self, file_info, data, offset):
+        """Принимает порцию файла: в спул или в буфер в памяти"""
+        _, log_path, stat, _, _ = file_info
+        if len(data) > 1:
+            if self.spool is not None:
+                self.spool.append(data)
+            else:
+                self.headers = data[0]
+                self.buffer.extend(data[1:])
+            if self.buffered_since is None:
+                self.buffered_since = time.monotonic()
+        self.checkpoints.update(log_path, stat, offset)
+        if self.spool is not None or not self.buffer:
+            # Строки уже на диске или их нет - прогресс можно сохранить сразу
+            self.checkpoints.save()
+    
+    def _scan(self):
+        """
+        Дочитывает новые данные из всех изменившихся файлов
+        :return: False, если загрузка по ходу чтения не удалась
+        """
+        log_files, pending_files = _find_pending_files(self.logs_dir, self.checkpoints)
+        for file_info in pending_files:
+            log_file, log_path, stat, start_offset, include_partial = file_info
+            offset = start_offset
+            try:
+                for data, offset in iter_file_batches(log_path, start_offset, include_partial, UPLOAD_BATCH_SIZE,
+                                                      self.id_index_path, self.predicate):
+                    self._add_batch(file_info, data, offset)
+                    if self._pending_rows() >= DAEMON_FLUSH_ROWS and not self._flush():
+                        return False
+                    if self.stop_event.is_set():
+                        return True
+            except Exception as e:
+                logging.error(f"Ошибка при обработке файла {log_file}: {e}")
+                continue
+            self.checkpoints.update(log_path, stat, offset, complete=include_partial)
+        
+        self.checkpoints.prune(os.path.join(self.logs_dir, log_file) for log_file in log_files)
+        if self.spool is not None or not self.buffer:
+            self.checkpoints.save()
+        return True
+    
+    def _flush(self):
+        """
+        Отправляет накопленные строки в таблицу
+        :return: True, если все строки загружены
+        """
+        if time.monotonic() < self.retry_at:
+            return self.spool is not None
+        
+        if self.spool is not None:
+            flushed = _drain_spool(self.spool, self.sink)
+        else:
+            flushed = not self.buffer or self.sink.write([self.headers] + self.buffer)
+            if flushed:
+                self.checkpoints.save()
+            else:
+                # Строки не загружены - вернемся к сохраненным контрольным точкам и прочитаем их заново
+                self.checkpoints.reload()
+            self.buffer = []
+        
+        if flushed:
+            self.buffered_since = None
+            self.sink.flush()
+        else:
+            self.retry_at = time.monotonic() + DAEMON_RETRY_SECONDS
+            logging.error(f"Загрузка не удалась, повтор через {DAEMON_RETRY_SECONDS} с")
+        _write_metrics(self.metrics_dir)
+        return flushed
+    
+    def _flush_due(self):
+        pending_rows = self._pending_rows()
+        if not pending_rows or time.monotonic() < self.retry_at:
+            return False
+        return (pending_rows >= DAEMON_FLUSH_ROWS
+                or time.monotonic() - self.buffered_since >= DAEMON_FLUSH_SECONDS)
+    
+    def _wait_timeout(self):
+        """
+        Сколько ждать изменений в директории: период опроса DAEMON_POLL_SECONDS,
+        но не дольше, чем до сброса накопленных строк
+        """
+        timeout = DAEMON_POLL_SECONDS
+        if self.buffered_since is not None and self._pending_rows():
+            due = max(self.retry_at, self.buffered_since + DAEMON_FLUSH_SECONDS)
+            timeout = min(timeout, due - time.monotonic())
+        return max(timeout, 0.0)
+    
+    def run(self):
+        """Основной цикл; завершается по SIGTERM или SIGINT после сброса накопленных строк"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        watcher = DirectoryWatcher(self.logs_dir, DAEMON_POLL_SECONDS)
+        logging.info(f"Демон запущен: {self.logs_dir}, сброс каждые {DAEMON_FLUSH_ROWS} строк "
+                     f"или {DAEMON_FLUSH_SECONDS} с")
+        
+        changed = True
+        last_scan = 0.0
+        try:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                # Без спула после неудачной загрузки не читаем дальше, чтобы не копить строки в памяти
+                can_scan = self.spool is not None or now >= self.retry_at
+                if can_scan and (changed or now - last_scan >= DAEMON_RESCAN_SECONDS):
+                    last_scan = now
+                    self._scan()
+                if self._flush_due():
+                    self._flush()
+                changed = watcher.wait(self._wait_timeout())
+        finally:
+            watcher.close()
+            if self._pending_rows():
+                self.retry_at = 0.0
+                self._flush()
+            logging.info("Демон остановлен")
+
+def _future_batches(future):
+    """Отдает порции из результата процесса; ошибка разбора всплывает при переборе"""
+    batches, metrics_snapshot = future.result()
+    if metrics_snapshot is not None:
+        get_metrics().merge(metrics_snapshot)
+    yield from batches
+
+def _iter_parsed_files(pending_files, workers, id_index_path=None, predicate=None):
+    """
+    Разбирает файлы и отдает их порции строго в порядке pending_files
+    При workers > 1 файлы разбираются параллельно в пуле процессов,
+    но вперед разбирается не больше workers * 2 файлов, чтобы ограничить память
+    :param id_index_path: индекс идентификаторов, который пополняется по ходу разбора
+    :param predicate: условие отбора строк (см. predicates.py)
+    :return: итератор пар (описание файла, итератор пар (порция, смещение))
+    """
+    if workers <= 1:
+        for file_info in pending_files:
+            _, log_path, _, start_offset, include_partial = file_info
+            yield file_info, iter_file_batches(log_path, start_offset, include_partial, UPLOAD_BATCH_SIZE,
+                                               id_index_path, predicate)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        files = iter(pending_files)
+        futures = deque()
+
+        def submit_next():
+            file_info = next(files, None)
+            if file_info is not None:
+                _, log_path, _, start_offset, include_partial = file_info
+                futures.append((file_info, executor.submit(
+                    parse_file_batches, log_path, start_offset, include_partial, UPLOAD_BATCH_SIZE,
+                    get_metrics().enabled, id_index_path, predicate)))
+
+        for _ in range(workers * 2):
+            submit_next()
+
+        while futures:
+            file_info, future = futures.popleft()
+            submit_next()
+            yield file_info, _future_batches(future)
+
 def main():
     try:
-        # Проверяем наличие аргумента с путем к директории
-        if len(sys.argv) < 2:
-            logging.error("Не указан путь к директории с логами")
-            logging.error("Использование: python sheets_uploader.py путь/к/директории")
-            sys.exit(1)
+        arg_parser = argparse.ArgumentParser(description='Загрузка лог-файлов в Google Sheets')
+        arg_parser.add_argument('logs_dir', nargs='?', help='путь к директории с логами')
+        arg_parser.add_argument('--rebuild-index', action='store_true',
+                                help='перестроить локальный индекс дубликатов по данным таблицы')
+        arg_parser.add_argument('--dedup-window', default=DEDUP_WINDOW,
+                                help='хранить в памяти отпечатки строк за это окно времени (например 15m), '
+                                     'а более старые - в фильтре Блума, чтобы реже обращаться к индексу '
+                                     'дубликатов; пусто - выключено')
+        arg_parser.add_argument('--workers', type=int, default=1,
+                                help='количество процессов для параллельного разбора файлов')
+        arg_parser.add_argument('--metrics-dir', default=os.getenv('METRICS_DIR'),
+                                help='директория для итогов запуска (JSON и textfile collector Prometheus); '
+                                     'без нее метрики не собираются')
+        arg_parser.add_argument('--partition', default=PARTITION_POLICY,
+                                help='разбиение на листы: none, day, month или rows:N')
+        arg_parser.add_argument('--rollup', choices=('off', 'alongside', 'only'), default=ROLLUP_MODE,
+                                help='агрегаты по интервалам времени: off, alongside - вместе с исходными '
+                                     'строками, only - только агрегаты')
+        arg_parser.add_argument('--rollup-bucket', default=ROLLUP_BUCKET,
+                                help='интервал агрегации, например 5m или 1h')
+        arg_parser.add_argument('--compact-errors', action='store_true', default=COMPACT_ERRORS,
+                                help='писать в столбцы Error n короткие идентификаторы, а тексты ошибок - '
+                                     f'один раз на лист {ERRORS_WORKSHEET}')
+        arg_parser.add_argument('--queue-size', type=int, default=PIPELINE_QUEUE_SIZE,
+                                help='сколько разобранных порций может ждать загрузки, пока идет запрос '
+                                     'к Google API; 0 - без фонового разбора')
+        arg_parser.add_argument('--spool', action='store_true', default=USE_SPOOL,
+                                help='сохранять разобранные строки в локальный спул до подтверждения загрузки')
+        arg_parser.add_argument('--sink', action='append',
+                                help='куда записывать строки: sheets, jsonl:путь, csv:путь, sqlite:путь или sketch[:путь]; '
+                                     'можно указать несколько раз (по умолчанию OUTPUT_SINKS или sheets)')
+        arg_parser.add_argument('--id-index', action='store_true', default=USE_ID_INDEX,
+                                help='пополнять индекс Session ID и Request ID для поиска по всем файлам '
+                                     '(python id_index.py ID)')
+        arg_parser.add_argument('--since', help='загружать только записи с Start DateTime не раньше '
+                                                '(UTC, YYYY-MM-DD[ HH:MM[:SS]])')
+        arg_parser.add_argument('--until', help='загружать только записи с Start DateTime не позже '
+                                                '(UTC, YYYY-MM-DD[ HH:MM[:SS]])')
+        arg_parser.add_argument('--status', action='append',
+                                help='загружать только записи с запросом с таким кодом статуса '
+                                     '(можно несколько раз или через запятую)')
+        arg_parser.add_argument('--min-duration', type=int,
+                                help='загружать только записи с запросом не короче стольких мс')
+        arg_parser.add_argument('--max-duration', type=int,
+                                help='загружать только записи с запросом не длиннее стольких мс')
+        arg_parser.add_argument('--camera', action='append',
+                                help='загружать только записи этих камер (можно несколько раз или через запятую)')
+        arg_parser.add_argument('--daemon', action='store_true',
+                                help='работать постоянно: следить за директорией и загружать новые строки '
+                                     'по мере появления')
+        arg_parser.add_argument('--drain-only', action='store_true',
+                                help='только загрузить строки, накопленные в спуле, без разбора логов')
+        args = arg_parser.parse_args()
+        if not args.logs_dir and not args.drain_only:
+            arg_parser.error('нужно указать директорию с логами')
+        try:
+            predicate = build_predicate(args.since, args.until, args.status, args.min_duration,
+                                        args.max_duration, args.camera)
+        except ValueError as e:
+            arg_parser.error(str(e))
         
-        logs_dir = sys.argv[1]
+        if args.metrics_dir:
+            set_metrics(Metrics())
+        
+        sink_specs = args.sink or OUTPUT_SINKS.split(',')
+        def create_uploader():
+            return SheetsUploader(rebuild_index=args.rebuild_index, partition_policy=args.partition,
+                                  rollup_mode=args.rollup, rollup_bucket=args.rollup_bucket,
+                                  compact_errors=args.compact_errors, dedup_window=args.dedup_window)
+        
+        spool = None
+        if args.spool or args.drain_only:
+            spool = Spool(os.path.join(STATE_DIRECTORY, 'spool.sqlite3'))
+        
+        if args.drain_only:
+            logging.info(f"В спуле ожидают загрузки {spool.pending_rows()} строк")
+            sink, _ = _create_sink(sink_specs, create_uploader)
+            drained = _drain_spool(spool, sink)
+            sink.close()
+            _write_metrics(args.metrics_dir)
+            sys.exit(0 if drained else 1)
+        
+        logs_dir = args.logs_dir
         
         if not os.path.exists(logs_dir):
             logging.error(f"Директория {logs_dir} не найдена")
             sys.exit(1)
         
-        log_files = [f for f in os.listdir(logs_dir) if f.endswith('.txt')]
+        checkpoints = CheckpointStore(os.path.join(STATE_DIRECTORY, 'checkpoints.json'))
+        id_index_path = os.path.join(STATE_DIRECTORY, 'ids.sqlite3') if args.id_index else None
+        if args.daemon:
+            sink, _ = _create_sink(sink_specs, create_uploader)
+            UploadDaemon(logs_dir, sink, checkpoints, spool, args.metrics_dir, id_index_path, predicate).run()
+            sink.close()
+            return
+        
+        # Определяем, какие файлы изменились с прошлого запуска, до авторизации в Google
+        log_files, pending_files = _find_pending_files(logs_dir, checkpoints)
         
         if not log_files:
             logging.info(f"В директории {logs_dir} не найдено лог-файлов")
             sys.exit(0)
         
         logging.info(f"Найдено {len(log_files)} лог-файлов")
-        uploader = SheetsUploader()
+
+        if not pending_files and not args.rebuild_index and not (spool is not None and len(spool)):
+            logging.info("Новых данных в лог-файлах нет")
+            _write_metrics(args.metrics_dir)
+            sys.exit(0)
+
+        logging.info(f"Файлов с новыми данными: {len(pending_files)}")
+        try:
+            sink, uploader = _create_sink(sink_specs, create_uploader)
+        except Exception as e:
+            if spool is None:
+                raise
+            # Без доступа к таблице продолжаем разбор в спул, загрузим при следующем запуске
+            logging.error(f"Google Sheets недоступен, разобранные строки будут сохранены в спул: {e}")
+            sink = uploader = None
+        can_drain = sink is not None
         
-        for log_file in sorted(log_files):
-            log_path = os.path.join(logs_dir, log_file)
-            logging.info(f"Обработка файла: {log_file}")
-            
-            try:
-                parser = LogParser(log_path)
-                data = parser.prepare_for_sheets()
-                
-                if len(data) > 1:
-                    uploader.upload_data(data)
-                    
-            except Exception as e:
-                logging.error(f"Ошибка при обработке файла {log_file}: {e}")
-                continue
+        # Разбор идет в фоне и заполняет ограниченную очередь, пока загрузчик ждет ответа Google API
+        if predicate is not None:
+            logging.info("Загружаются только записи, подходящие под условия отбора")
+        parsed_files = _iter_parsed_files(pending_files, args.workers, id_index_path, predicate)
+        failed_files = set()
+        with ParsePipeline(parsed_files, args.queue_size) as pipeline:
+            for kind, file_info, data, offset in pipeline:
+                log_file, log_path, stat, start_offset, include_partial = file_info
+
+                if kind == FILE_START:
+                    logging.info(f"Обработка файла: {log_file} с позиции {start_offset}")
+                    get_metrics().inc('files_processed')
+
+                elif kind == FILE_ERROR:
+                    logging.error(f"Ошибка при обработке файла {log_file}: {data}")
+
+                elif log_path in failed_files:
+                    # Порции, разобранные до остановки файла, пропускаем
+                    continue
+
+                elif kind == FILE_BATCH:
+                    try:
+                        if spool is not None:
+                            # Порция сохранена на диск - разбирать ее повторно уже не придется
+                            spool.append(data)
+                            stored = True
+                            if can_drain and spool.pending_rows() >= SPOOL_DRAIN_ROWS:
+                                can_drain = _drain_spool(spool, sink)
+                        else:
+                            stored = sink.write(data)
+                    except Exception as e:
+                        logging.error(f"Ошибка при обработке файла {log_file}: {e}")
+                        stored = False
+                    if not stored:
+                        failed_files.add(log_path)
+                        pipeline.skip_file(file_info)
+                        continue
+                    # Порция загружена (или сохранена в спул) - фиксируем прогресс по файлу
+                    checkpoints.update(log_path, stat, offset)
+                    checkpoints.save()
+
+                elif kind == FILE_END:
+                    # Файл дочитан до конца и загружен полностью
+                    checkpoints.update(log_path, stat, start_offset if offset is None else offset,
+                                       complete=include_partial)
+                    checkpoints.save()
+
+        if spool is not None and can_drain:
+            _drain_spool(spool, sink)
+
+        checkpoints.prune(os.path.join(logs_dir, log_file) for log_file in log_files)
+        checkpoints.save()
+
+        if sink is not None:
+            sink.close()
+        if uploader is not None:
+            api_stats = uploader.api.get_stats()
+            logging.info(f"Запросов к Google API: {api_stats['requests']}, повторов: {api_stats['retries']}, "
+                         f"из них из-за квоты: {api_stats['throttled']}, ожидание: {api_stats['wait_seconds']} с")
+        if spool is not None and len(spool):
+            logging.info(f"В спуле ожидают загрузки {spool.pending_rows()} строк")
+        _write_metrics(args.metrics_dir)
         
     except Exception as e:
         logging.error(f"Критическая ошибка: {e}")
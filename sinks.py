@@ -0,0 +1,328 @@
+import os
+import csv
+import json
+import sqlite3
+import logging
+from json.encoder import encode_basestring
+from typing import Callable, List, Optional, Set, Tuple
+
+from dedup_index import DedupIndex, row_fingerprint
+from sketches import LATENCY_SKETCHES_PATH, SketchStore
+
+# Размер буфера записи локальных файлов
+FILE_BUFFER_BYTES = 1024 * 1024
+
+
+class Sink:
+    """
+    Получатель строк таблицы
+    Принимает потоком порции строк (заголовки в первой строке порции), write возвращает True,
+    когда порцию можно считать записанной и сдвигать контрольную точку файла
+    """
+
+    name = 'sink'
+
+    def write(self, data: List[List[str]]) -> bool:
+        raise NotImplementedError
+
+    def flush(self):
+        """Сбрасывает буферы (вызывается в конце запуска и после сброса порций в режиме демона)"""
+
+    def close(self):
+        self.flush()
+
+
+def _ensure_directory(path: str):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def _row_fingerprints(data: List[List[str]]) -> List[Optional[int]]:
+    """
+    Отпечатки строк порции по Start DateTime и End DateTime, как в индексе дубликатов таблицы
+    :return: отпечаток каждой строки без заголовков (None, если в строке нет этих столбцов)
+    """
+    headers = data[0]
+    if 'Start DateTime' not in headers or 'End DateTime' not in headers:
+        return [None] * (len(data) - 1)
+    start_idx, end_idx = headers.index('Start DateTime'), headers.index('End DateTime')
+    last_idx = max(start_idx, end_idx)
+    return [row_fingerprint(row[start_idx], row[end_idx]) if len(row) > last_idx else None for row in data[1:]]
+
+
+def _new_rows(data: List[List[str]],
+              find_known: Callable[[List[int]], Set[int]]) -> Tuple[List[List[str]], List[Optional[int]]]:
+    """
+    Оставляет строки, которые получатель еще не сохранял
+    Порция повторяется после сбоя загрузки, а файл перечитывается целиком после ротации
+    или потери контрольных точек - такие строки не должны попадать в получателя второй раз
+    :param find_known: функция, возвращающая отпечатки из списка, которые получатель уже сохранил
+    :return: новые строки и их отпечатки (None у строк без отпечатка - они записываются всегда)
+    """
+    fingerprints = _row_fingerprints(data)
+    rows, new_fingerprints = [], []
+    seen = find_known([fp for fp in fingerprints if fp is not None])
+    for row, fp in zip(data[1:], fingerprints):
+        if fp is not None:
+            if fp in seen:
+                continue
+            seen.add(fp)
+        rows.append(row)
+        new_fingerprints.append(fp)
+    return rows, new_fingerprints
+
+
+def _open_fingerprints(path: str) -> DedupIndex:
+    """Отпечатки строк, уже записанных в файл получателя; хранятся рядом с файлом"""
+    index = DedupIndex(path + '.fingerprints.sqlite3')
+    # Как у SqliteSink: одна запись журнала на порцию вместо двух fsync
+    index.connection.execute('PRAGMA journal_mode=WAL')
+    index.connection.execute('PRAGMA synchronous=NORMAL')
+    return index
+
+
+class JsonlSink(Sink):
+    """
+    Запись строк в JSON Lines: по объекту {заголовок: значение} на строку
+    Строки, которые уже есть в файле (по отпечаткам), повторно не пишутся
+    """
+
+    name = 'jsonl'
+
+    def __init__(self, path: str):
+        _ensure_directory(path)
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8', buffering=FILE_BUFFER_BYTES)
+        self.fingerprints = _open_fingerprints(path)
+        self.headers = None
+        self.template = None
+
+    def write(self, data: List[List[str]]) -> bool:
+        if len(data) <= 1:
+            return True
+        rows, fingerprints = _new_rows(data, self.fingerprints.existing)
+        if not rows:
+            return True
+        headers = data[0]
+        if headers != self.headers:
+            # Ключи кодируются один раз в шаблон строки, для строк остается кодирование значений
+            self.headers = headers
+            self.template = '{' + ','.join(
+                json.dumps(header, ensure_ascii=False).replace('%', '%%') + ':%s' for header in headers
+            ) + '}\n'
+        template = self.template
+        try:
+            lines = [template % tuple(map(encode_basestring, row)) for row in rows]
+        except TypeError:
+            # Строка другой длины или не из строк - кодируем медленно, но корректно
+            lines = [json.dumps(dict(zip(headers, row)), ensure_ascii=False) + '\n' for row in rows]
+        self.file.writelines(lines)
+        # Отпечатки сохраняются, только когда строки уже переданы системе
+        self.file.flush()
+        self.fingerprints.add(fp for fp in fingerprints if fp is not None)
+        return True
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.fingerprints.close()
+
+
+class CsvSink(Sink):
+    """
+    Запись строк в CSV; заголовки пишутся, если файл новый
+    Строки, которые уже есть в файле (по отпечаткам), повторно не пишутся
+    """
+
+    name = 'csv'
+
+    def __init__(self, path: str):
+        _ensure_directory(path)
+        self.path = path
+        self.write_headers = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', encoding='utf-8', newline='', buffering=FILE_BUFFER_BYTES)
+        self.writer = csv.writer(self.file)
+        self.fingerprints = _open_fingerprints(path)
+
+    def write(self, data: List[List[str]]) -> bool:
+        if len(data) <= 1:
+            return True
+        rows, fingerprints = _new_rows(data, self.fingerprints.existing)
+        if not rows:
+            return True
+        if self.write_headers:
+            self.writer.writerow(data[0])
+            self.write_headers = False
+        self.writer.writerows(rows)
+        # Отпечатки сохраняются, только когда строки уже переданы системе
+        self.file.flush()
+        self.fingerprints.add(fp for fp in fingerprints if fp is not None)
+        return True
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.fingerprints.close()
+
+
+class SqliteSink(Sink):
+    """
+    Запись строк в таблицу SQLite; столбцы таблицы совпадают с заголовками листа
+    Уникальный столбец _fingerprint с отпечатком строки не дает записать ее второй раз
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, table: str = 'logs'):
+        _ensure_directory(path)
+        self.path = path
+        self.table = table
+        self.connection = sqlite3.connect(path)
+        # WAL и synchronous=NORMAL: одна запись журнала на транзакцию вместо двух fsync
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.insert_sql = None
+        self.headers = None
+
+    def _prepare(self, headers: List[str]):
+        columns = ', '.join('"{}"'.format(header.replace('"', '""')) for header in headers)
+        with self.connection:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns}, _fingerprint INTEGER)')
+            existing = {row[1] for row in self.connection.execute(f'PRAGMA table_info("{self.table}")')}
+            if '_fingerprint' not in existing:
+                # Таблица создана до появления отпечатков: у старых строк он пустой
+                self.connection.execute(f'ALTER TABLE "{self.table}" ADD COLUMN _fingerprint INTEGER')
+            self.connection.execute(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS "{self.table}_fingerprint" ON "{self.table}" (_fingerprint)'
+            )
+        self.insert_sql = (f'INSERT OR IGNORE INTO "{self.table}" ({columns}, _fingerprint) '
+                           f'VALUES ({", ".join("?" * (len(headers) + 1))})')
+        self.headers = headers
+
+    def write(self, data: List[List[str]]) -> bool:
+        if len(data) <= 1:
+            return True
+        if data[0] != self.headers:
+            self._prepare(data[0])
+        with self.connection:
+            self.connection.executemany(self.insert_sql, (
+                (*row, fp) for row, fp in zip(data[1:], _row_fingerprints(data))
+            ))
+        return True
+
+    def close(self):
+        self.connection.close()
+
+
+class SketchSink(Sink):
+    """
+    Накопление эскизов длительностей по интервалам, слотам и кодам статуса (см. sketches.py)
+    Эскизы порции сразу складываются с сохраненными, поэтому файл эскизов не отстает
+    от контрольных точек. Строки, отпечатки которых уже учтены, пропускаются - повтор порции
+    или повторное чтение файла не искажают накопленные перцентили
+    """
+
+    name = 'sketch'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.store = SketchStore(path)
+
+    def write(self, data: List[List[str]]) -> bool:
+        if len(data) <= 1:
+            return True
+        rows, fingerprints = _new_rows(data, self.store.known)
+        sketches = self.store.new_sketches()
+        sketches.add_rows(rows)
+        self.store.save(sketches, [fp for fp in fingerprints if fp is not None])
+        return True
+
+    def close(self):
+        self.store.close()
+
+
+class SheetsSink(Sink):
+    """Загрузка строк в Google Sheets через SheetsUploader"""
+
+    name = 'sheets'
+
+    def __init__(self, uploader):
+        self.uploader = uploader
+
+    def write(self, data: List[List[str]]) -> bool:
+        return self.uploader.upload_data(data)
+
+    def flush(self):
+        self.uploader.flush_rollup()
+
+    def close(self):
+        self.flush()
+        self.uploader.close()
+
+
+class FanoutSink(Sink):
+    """
+    Запись каждой порции сразу в несколько получателей за один проход
+    Порция считается записанной, только если ее приняли все получатели; при повторе после
+    сбоя локальные получатели получают ее второй раз, но уже сохраненные строки пропускают
+    """
+
+    name = 'fanout'
+
+    def __init__(self, sinks: List[Sink]):
+        self.sinks = sinks
+
+    def write(self, data: List[List[str]]) -> bool:
+        written = True
+        for sink in self.sinks:
+            try:
+                if not sink.write(data):
+                    written = False
+            except Exception as e:
+                logging.error(f"Ошибка записи в {sink.name}: {e}")
+                written = False
+        return written
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# Получатели, которые создаются по описанию вида тип:путь
+LOCAL_SINKS = {
+    'jsonl': JsonlSink,
+    'csv': CsvSink,
+    'sqlite': SqliteSink,
+    'sketch': SketchSink,
+}
+
+# Пути по умолчанию для получателей, у которых путь можно не указывать
+LOCAL_SINK_DEFAULT_PATHS = {
+    'sketch': LATENCY_SKETCHES_PATH,
+}
+
+
+def create_local_sink(spec: str) -> Sink:
+    """
+    Создает локального получателя по описанию
+    :param spec: jsonl:путь, csv:путь, sqlite:путь или sketch[:путь]
+    """
+    kind, _, path = spec.partition(':')
+    path = path or LOCAL_SINK_DEFAULT_PATHS.get(kind, '')
+    if kind not in LOCAL_SINKS or not path:
+        raise ValueError(f"Некорректный получатель: {spec} (ожидается sheets, "
+                         f"{', '.join(f'{name}:путь' for name in LOCAL_SINKS)})")
+    return LOCAL_SINKS[kind](path)
@@ -0,0 +1,356 @@
+import os
+import sys
+import math
+import json
+import sqlite3
+import argparse
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+from parser import parse_log_datetime
+from predicates import parse_time_bound
+from schema import DEFAULT_SCHEMA, LogSchema
+
+load_dotenv()
+
+# Файл эскизов и интервал, по которому они копятся
+LATENCY_SKETCHES_PATH = os.path.join(os.getenv('STATE_DIR', 'state'), 'latency.sqlite3')
+LATENCY_SKETCH_BUCKET = os.getenv('LATENCY_SKETCH_BUCKET', '1h')
+
+# Ограничение SQLite на количество параметров в одном запросе
+_QUERY_CHUNK_SIZE = 500
+
+_BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Перцентили, которые выводятся по умолчанию
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def parse_bucket(spec: str) -> int:
+    """
+    Разбирает размер интервала агрегации
+    :param spec: '300', '5m', '1h', '1d'
+    :return: размер интервала в секундах
+    """
+    spec = spec.strip().lower()
+    unit = _BUCKET_UNITS.get(spec[-1:])
+    try:
+        seconds = int(spec[:-1]) * unit if unit else int(spec)
+    except ValueError:
+        raise ValueError(f"Некорректный интервал агрегации: {spec}")
+    if seconds <= 0:
+        raise ValueError(f"Интервал агрегации должен быть положительным: {spec}")
+    return seconds
+
+
+def _decode_histogram(value: bytes) -> Tuple[array, array]:
+    """Номера корзин и количества из двоичного представления LatencyHistogram.to_bytes"""
+    size = len(value) // 6
+    indexes = array('H')
+    indexes.frombytes(value[:size * 2])
+    counts = array('I')
+    counts.frombytes(value[size * 2:])
+    return indexes, counts
+
+
+class LatencyHistogram:
+    """
+    Гистограмма длительностей с логарифмическими корзинами
+    Относительная ошибка перцентилей не больше RELATIVE_ACCURACY, гистограммы можно складывать
+    """
+
+    RELATIVE_ACCURACY = 0.01
+
+    _GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _LOG_GAMMA = math.log(_GAMMA)
+
+    def __init__(self, counts: Dict[int, int] = None):
+        # Корзина 0 - нулевые длительности, корзина k > 0 - (gamma^(k-2), gamma^(k-1)]
+        self.counts = counts or {}
+
+    def add(self, value: float, count: int = 1):
+        index = 0 if value <= 0 else max(1, math.ceil(math.log(value) / self._LOG_GAMMA) + 1)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def percentile(self, q: float) -> float:
+        """Оценка q-го перцентиля (q от 0 до 100)"""
+        total = self.total
+        if not total:
+            return 0.0
+        rank = q / 100 * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                if index == 0:
+                    return 0.0
+                # Значение с одинаковой относительной ошибкой до обеих границ корзины
+                return 2 * self._GAMMA ** (index - 1) / (self._GAMMA + 1)
+        return 0.0
+
+    def to_json(self) -> str:
+        return json.dumps(self.counts, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, value: str) -> 'LatencyHistogram':
+        return cls({int(index): count for index, count in json.loads(value).items()})
+
+    def to_bytes(self) -> bytes:
+        """
+        Компактное двоичное представление: номера корзин (uint16), затем количества (uint32)
+        Номер корзины при точности 1% не превышает ~2000 даже для длительностей в сутки
+        """
+        indexes = sorted(self.counts)
+        return array('H', indexes).tobytes() + array('I', (self.counts[index] for index in indexes)).tobytes()
+
+    @classmethod
+    def from_bytes(cls, value: bytes) -> 'LatencyHistogram':
+        return cls(dict(zip(*_decode_histogram(value))))
+
+
+class LatencySketches:
+    """
+    Эскизы длительностей по интервалам времени, слотам запросов и кодам статуса
+    Заполняются за один проход по строкам таблицы и складываются с сохраненными в SketchStore
+    """
+
+    def __init__(self, bucket_seconds: int, schema: LogSchema = None):
+        """
+        :param bucket_seconds: размер интервала времени в секундах
+        :param schema: описание столбцов (по умолчанию DEFAULT_SCHEMA)
+        """
+        schema = schema or DEFAULT_SCHEMA
+        self.bucket_seconds = bucket_seconds
+        self.start_column = schema.column('Start DateTime')
+        self.slot_columns = [
+            (slot, schema.column(f'Status Code {slot}'), schema.column(f'Duration {slot}'))
+            for slot in range(1, schema.request_slots + 1)
+        ]
+        # (интервал, слот, код статуса) -> гистограмма
+        self.histograms: Dict[Tuple[int, int, str], LatencyHistogram] = {}
+
+    def add_rows(self, rows: Iterable) -> int:
+        """
+        Учитывает строки таблицы (без заголовков)
+        :return: количество учтенных длительностей
+        """
+        histograms = self.histograms
+        added = 0
+        for row in rows:
+            start = parse_log_datetime(row[self.start_column])
+            if start is None:
+                continue
+            timestamp = start.timestamp() if start.tzinfo else start.replace(tzinfo=timezone.utc).timestamp()
+            bucket = int(timestamp) // self.bucket_seconds * self.bucket_seconds
+            for slot, status_column, duration_column in self.slot_columns:
+                duration = row[duration_column].strip()
+                if not duration:
+                    continue
+                try:
+                    value = float(duration)
+                except ValueError:
+                    continue
+                key = (bucket, slot, row[status_column].strip())
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = LatencyHistogram()
+                histogram.add(value)
+                added += 1
+        return added
+
+    def __len__(self) -> int:
+        return len(self.histograms)
+
+    def clear(self):
+        self.histograms = {}
+
+
+class SketchStore:
+    """
+    Эскизы длительностей между запусками на SQLite
+    После каждого запуска новые эскизы складываются с сохраненными, поэтому перцентили за день
+    или неделю считаются сложением эскизов, а не повторным разбором логов
+    """
+
+    def __init__(self, path: str = LATENCY_SKETCHES_PATH, bucket_seconds: int = None):
+        """
+        :param path: путь к файлу эскизов
+        :param bucket_seconds: интервал накопления (по умолчанию LATENCY_SKETCH_BUCKET);
+                               после первого сохранения менять нельзя
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS sketches (
+                    bucket INTEGER, slot INTEGER, status TEXT, count INTEGER, histogram BLOB,
+                    PRIMARY KEY (bucket, slot, status)
+                ) WITHOUT ROWID
+            ''')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # Отпечатки учтенных строк: повторно прочитанные строки в эскизы не добавляются
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints (fp INTEGER PRIMARY KEY) WITHOUT ROWID'
+            )
+
+        stored = self.connection.execute("SELECT value FROM meta WHERE key = 'bucket_seconds'").fetchone()
+        if bucket_seconds is None:
+            bucket_seconds = int(stored[0]) if stored else parse_bucket(LATENCY_SKETCH_BUCKET)
+        elif stored is not None and int(stored[0]) != bucket_seconds:
+            raise ValueError(f"Эскизы в {path} накоплены по интервалу {stored[0]} с, а не {bucket_seconds} с")
+        self.bucket_seconds = bucket_seconds
+
+    def new_sketches(self) -> LatencySketches:
+        """Пустой набор эскизов с интервалом хранилища"""
+        return LatencySketches(self.bucket_seconds)
+
+    def known(self, fingerprints: List[int]) -> Set[int]:
+        """Возвращает отпечатки из списка, строки которых уже учтены в эскизах"""
+        found = set()
+        for i in range(0, len(fingerprints), _QUERY_CHUNK_SIZE):
+            chunk = fingerprints[i:i + _QUERY_CHUNK_SIZE]
+            cursor = self.connection.execute(
+                f'SELECT fp FROM fingerprints WHERE fp IN ({",".join("?" * len(chunk))})', chunk
+            )
+            found.update(fp for (fp,) in cursor)
+        return found
+
+    def save(self, sketches: LatencySketches, fingerprints: List[int] = ()):
+        """
+        Складывает эскизы с сохраненными одной транзакцией
+        :param fingerprints: отпечатки учтенных строк, сохраняются в той же транзакции
+        """
+        if not sketches.histograms and not fingerprints:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO fingerprints (fp) VALUES (?)',
+                                        ((fp,) for fp in fingerprints))
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bucket_seconds', ?)",
+                                    (str(self.bucket_seconds),))
+            for key, histogram in sketches.histograms.items():
+                existing = self.connection.execute(
+                    'SELECT histogram FROM sketches WHERE bucket = ? AND slot = ? AND status = ?', key
+                ).fetchone()
+                if existing is not None:
+                    histogram = LatencyHistogram(dict(histogram.counts))
+                    histogram.merge(LatencyHistogram.from_bytes(existing[0]))
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO sketches (bucket, slot, status, count, histogram) VALUES (?, ?, ?, ?, ?)',
+                    (*key, histogram.total, histogram.to_bytes())
+                )
+
+    def query(self, start: datetime = None, end: datetime = None, slot: int = None,
+              statuses: Iterable[str] = None, group_by: str = None) -> Dict[str, LatencyHistogram]:
+        """
+        Складывает эскизы за период
+        :param start: начало периода (интервалы, начавшиеся не раньше)
+        :param end: конец периода (интервалы, начавшиеся раньше)
+        :param slot: только этот слот запроса
+        :param statuses: только эти коды статуса
+        :param group_by: None, 'slot', 'status', 'day' или 'week'
+        :return: группа -> гистограмма ('all' без группировки)
+        """
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('bucket >= ?')
+            params.append(int(start.timestamp()))
+        if end is not None:
+            conditions.append('bucket < ?')
+            params.append(int(end.timestamp()))
+        if slot is not None:
+            conditions.append('slot = ?')
+            params.append(slot)
+        statuses = list(statuses or [])
+        if statuses:
+            conditions.append(f'status IN ({", ".join("?" * len(statuses))})')
+            params.extend(statuses)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        groups: Dict[str, Dict[int, int]] = {}
+        for bucket, bucket_slot, status, histogram in self.connection.execute(
+                f'SELECT bucket, slot, status, histogram FROM sketches{where} ORDER BY bucket', params):
+            group = self._group_key(group_by, bucket, bucket_slot, status)
+            counts = groups.get(group)
+            if counts is None:
+                counts = groups[group] = {}
+            # Складываем сразу в общий словарь, не создавая гистограмму на каждую строку
+            for index, count in zip(*_decode_histogram(histogram)):
+                counts[index] = counts.get(index, 0) + count
+        return {group: LatencyHistogram(counts) for group, counts in groups.items()}
+
+    @staticmethod
+    def _group_key(group_by: Optional[str], bucket: int, slot: int, status: str) -> str:
+        if group_by is None:
+            return 'all'
+        if group_by == 'slot':
+            return f'Duration {slot}'
+        if group_by == 'status':
+            return status or ' '
+        started = datetime.fromtimestamp(bucket, timezone.utc)
+        if group_by == 'day':
+            return started.strftime('%Y-%m-%d')
+        if group_by == 'week':
+            return started.strftime('%G-W%V')
+        raise ValueError(f"Неизвестная группировка: {group_by}")
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Перцентили длительности запросов по накопленным эскизам')
+    arg_parser.add_argument('--sketches', default=LATENCY_SKETCHES_PATH, help='путь к файлу эскизов')
+    arg_parser.add_argument('--since', help='начало периода (UTC, YYYY-MM-DD[ HH:MM[:SS]])')
+    arg_parser.add_argument('--until', help='конец периода, не включая (UTC, YYYY-MM-DD[ HH:MM[:SS]])')
+    arg_parser.add_argument('--slot', type=int, help='только этот слот запроса')
+    arg_parser.add_argument('--status', action='append', help='только эти коды статуса (можно несколько раз)')
+    arg_parser.add_argument('--by', choices=('slot', 'status', 'day', 'week'), help='группировка')
+    arg_parser.add_argument('--percentiles', default=','.join(str(q) for q in DEFAULT_PERCENTILES),
+                            help='какие перцентили выводить, через запятую')
+    arg_parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    args = arg_parser.parse_args()
+
+    try:
+        start = parse_time_bound(args.since) if args.since else None
+        end = parse_time_bound(args.until) if args.until else None
+        percentiles = [float(q) for q in args.percentiles.split(',') if q.strip()]
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    store = SketchStore(args.sketches)
+    try:
+        groups = store.query(start, end, args.slot, args.status, args.by)
+    finally:
+        store.close()
+
+    result = {
+        group: {'count': histogram.total,
+                **{f'p{q:g}': round(histogram.percentile(q), 1) for q in percentiles}}
+        for group, histogram in sorted(groups.items())
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif not result:
+        print("Нет данных за период")
+    else:
+        for group, values in result.items():
+            print(f"{group}: " + ', '.join(f'{name} {value}' for name, value in values.items()))
+    sys.exit(0 if result else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import json
+import sqlite3
+from typing import List, Tuple
+
+
+class Spool:
+    """
+    Надежная очередь подготовленных строк на SQLite между разбором и загрузкой
+    Порции записываются на диск сразу после разбора и удаляются только после того,
+    как Google Sheets подтвердил их загрузку
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: путь к файлу базы данных очереди
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS batches ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, row_count INTEGER, data TEXT)'
+            )
+
+    def append(self, data: List[List[str]]) -> int:
+        """
+        Сохраняет порцию строк
+        :param data: строки с заголовками в первой строке
+        :return: идентификатор порции
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO batches (row_count, data) VALUES (?, ?)',
+                (len(data) - 1, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            )
+        return cursor.lastrowid
+
+    def pending_rows(self) -> int:
+        """Количество строк, ожидающих загрузки"""
+        return self.connection.execute('SELECT COALESCE(SUM(row_count), 0) FROM batches').fetchone()[0]
+
+    def next_batch(self, max_rows: int) -> Tuple[List[int], List[List[str]]]:
+        """
+        Собирает из самых старых порций одну крупную порцию для загрузки
+        :param max_rows: сколько строк набирать (не меньше одной порции целиком)
+        :return: идентификаторы вошедших порций и строки с заголовками
+        """
+        ids, data = [], []
+        cursor = self.connection.execute('SELECT id, row_count, data FROM batches ORDER BY id')
+        for batch_id, row_count, batch_data in cursor:
+            if ids and len(data) - 1 + row_count > max_rows:
+                break
+            rows = json.loads(batch_data)
+            if not data:
+                data.append(rows[0])
+            data.extend(rows[1:])
+            ids.append(batch_id)
+        cursor.close()
+        return ids, data
+
+    def ack(self, ids: List[int]):
+        """Удаляет порции, загрузка которых подтверждена"""
+        with self.connection:
+            self.connection.executemany('DELETE FROM batches WHERE id = ?', ((batch_id,) for batch_id in ids))
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM batches').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
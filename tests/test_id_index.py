@@ -0,0 +1,64 @@
+"""
+Индекс идентификаторов: Session ID записей с меньшим числом запросов, чем слотов в схеме,
+находится так же, как у полных записей
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.log_generator import LogGenerator
+from id_index import IdIndex
+from parser import iter_file_batches
+from schema import DEFAULT_SCHEMA
+
+
+class IdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'log.txt')
+        LogGenerator(seed=3, malformed_ratio=0).write(self.log_path, 400)
+        self.index_path = os.path.join(self.directory, 'ids.sqlite3')
+
+        self.sessions = {}
+        with open(self.log_path, encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('Summary data'):
+                    values = line.rstrip('\n').split(';')
+                    self.sessions[values[-1]] = len(values) < DEFAULT_SCHEMA.width
+        self.assertTrue(any(self.sessions.values()), 'в логе нет коротких записей')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_sessions(self):
+        index = IdIndex(self.index_path)
+        try:
+            for session_id, short in self.sessions.items():
+                locations = index.locate(session_id)
+                self.assertEqual([location['kind'] for location in locations], ['session'], session_id)
+            # Запись находится и разбирается по смещению из индекса
+            short_session = next(session_id for session_id, short in self.sessions.items() if short)
+            results = index.lookup([short_session])
+            self.assertEqual(len(results), 1)
+            self.assertIn(short_session, results[0]['record'].values())
+        finally:
+            index.close()
+
+    def test_short_record_session_from_upload_parse(self):
+        for _ in iter_file_batches(self.log_path, batch_size=50, id_index_path=self.index_path):
+            pass
+        self._check_sessions()
+
+    def test_short_record_session_from_catch_up(self):
+        index = IdIndex(self.index_path)
+        try:
+            self.assertEqual(index.update_file(self.log_path), len(self.sessions))
+        finally:
+            index.close()
+        self._check_sessions()
+
+
+if __name__ == '__main__':
+    unittest.main()
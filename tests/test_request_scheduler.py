@@ -0,0 +1,133 @@
+"""
+RequestScheduler против локальной замены Google Sheets с квотой и ошибками сервера:
+429 повторяются для любых запросов, 5xx - только для идемпотентных, а строки
+при повторах не дублируются. Время общее у планировщика и замены и идет без ожидания
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from functools import partial
+
+import sheets_uploader
+from benchmarks.fake_sheets import FakeBackend, FakeClient, FakeHttpError
+from benchmarks.log_generator import LogGenerator
+from parser import LogParser, SHEET_HEADERS
+from request_scheduler import RequestScheduler, error_status
+
+
+class FakeClock:
+    """Время, которое сдвигается только ожиданием"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _scheduler(self, rate_per_minute=600, max_retries=10):
+        return RequestScheduler(rate_per_minute=rate_per_minute, max_retries=max_retries,
+                                clock=self.clock.time, sleep=self.clock.sleep)
+
+    def test_throttled_append_is_retried(self):
+        backend = FakeBackend(quota_per_minute=10, clock=self.clock.time)
+        scheduler = self._scheduler()
+        for _ in range(40):
+            scheduler.call(backend.request, 'values_append', idempotent=False)
+
+        stats = scheduler.get_stats()
+        self.assertGreater(backend.throttled, 0)
+        self.assertEqual(stats['throttled'], backend.throttled)
+        self.assertEqual(stats['retries'], backend.throttled)
+        self.assertEqual(stats['requests'], backend.requests)
+        self.assertEqual(backend.requests, 40 + backend.throttled)
+        self.assertGreater(stats['wait_seconds'], 60)
+
+    def test_server_error_not_retried_for_append(self):
+        backend = FakeBackend(error_rate=1.0, clock=self.clock.time)
+        scheduler = self._scheduler()
+        with self.assertRaises(FakeHttpError) as raised:
+            scheduler.call(backend.request, 'values_append', idempotent=False)
+
+        self.assertEqual(error_status(raised.exception), 503)
+        self.assertEqual(backend.requests, 1)
+        self.assertEqual(scheduler.get_stats()['retries'], 0)
+
+    def test_server_error_retried_for_idempotent(self):
+        backend = FakeBackend(error_rate=1.0, clock=self.clock.time)
+        scheduler = self._scheduler(max_retries=3)
+        with self.assertRaises(FakeHttpError):
+            scheduler.call(backend.request, 'update_values')
+
+        stats = scheduler.get_stats()
+        self.assertEqual(backend.requests, 4)
+        self.assertEqual(stats['retries'], 3)
+        self.assertEqual(stats['throttled'], 0)
+
+
+class UploadUnderThrottlingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'log.txt')
+        LogGenerator(seed=9, malformed_ratio=0.05).write(self.log_path, 4000)
+
+        self.clock = FakeClock()
+        self.backend = FakeBackend(quota_per_minute=20, error_rate=0.05, seed=1, clock=self.clock.time)
+        self.client = FakeClient(self.backend)
+        self.patches = {
+            'STATE_DIRECTORY': os.path.join(self.directory, 'state'),
+            'UPLOAD_MODE': 'append',
+            'CHUNK_MAX_ROWS': 50,
+            'SHEETS_REQUESTS_PER_MINUTE': 40,
+            'SHEETS_MAX_RETRIES': 10,
+            'RequestScheduler': partial(RequestScheduler, clock=self.clock.time, sleep=self.clock.sleep),
+        }
+        self.saved = {name: getattr(sheets_uploader, name) for name in self.patches}
+        for name, value in self.patches.items():
+            setattr(sheets_uploader, name, value)
+        self.saved_get_client = sheets_uploader.SheetsUploader._get_client
+        sheets_uploader.SheetsUploader._get_client = lambda uploader: self.client
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(sheets_uploader, name, value)
+        sheets_uploader.SheetsUploader._get_client = self.saved_get_client
+        shutil.rmtree(self.directory)
+
+    def test_rows_written_once(self):
+        rows = list(LogParser(self.log_path, lazy=True).iter_rows())
+        uploader = sheets_uploader.SheetsUploader()
+        # Порция, на которой values.append получил 5xx, не повторяется планировщиком -
+        # ее повторяет следующий запуск (здесь - следующий вызов)
+        failed_uploads = 0
+        while not uploader.upload_data([SHEET_HEADERS] + rows):
+            failed_uploads += 1
+            self.assertLess(failed_uploads, 20)
+        uploader.close()
+
+        data = next(iter(self.client.spreadsheets.values())).sheet1.data
+        self.assertEqual(len(data), len(rows) + 1)
+        for number, (row, expected_row) in enumerate(zip(data, [SHEET_HEADERS] + rows), 1):
+            self.assertEqual(row, expected_row, f'строка {number}')
+
+        stats = uploader.api.get_stats()
+        self.assertGreater(self.backend.throttled, 0)
+        self.assertGreater(failed_uploads, 0)
+        self.assertEqual(stats['throttled'], self.backend.throttled)
+        self.assertEqual(stats['requests'], self.backend.requests)
+        # Каждый 5xx либо повторен (идемпотентный запрос), либо прервал загрузку (values.append)
+        self.assertEqual(self.backend.failed, stats['retries'] - stats['throttled'] + failed_uploads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Схема с другим количеством слотов запросов: фильтры, статистика и агрегаты
+считаются по слотам схемы парсера, а не по REQUEST_SLOTS
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.log_generator import LogGenerator
+from parser import LogParser
+from rollup import RollupStore
+from schema import REQUEST_SLOTS, LogSchema, is_request_slot
+
+
+class SchemaSlotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'log.txt')
+        LogGenerator(seed=5, malformed_ratio=0.05).write(self.log_path, 2000)
+        self.schemas = [LogSchema(slots) for slots in (REQUEST_SLOTS - 2, REQUEST_SLOTS + 2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _parsers(self, schema):
+        """Построчный разбор, индексы по загруженным записям и колоночное представление"""
+        return [LogParser(self.log_path, lazy=True, schema=schema),
+                LogParser(self.log_path, schema=schema),
+                LogParser(self.log_path, use_columnar=True, schema=schema)]
+
+    def test_filters_and_statistics(self):
+        for schema in self.schemas:
+            lazy, indexed, columnar = self._parsers(schema)
+            self.assertIsNotNone(columnar.columnar)
+            expected_stats = lazy.get_statistics()
+            self.assertEqual(len(expected_stats['avg_duration']), schema.request_slots)
+            for parser in (indexed, columnar):
+                stats = parser.get_statistics()
+                self.assertEqual(stats['status_codes'], expected_stats['status_codes'], schema.request_slots)
+                self.assertEqual(stats['avg_duration'].keys(), expected_stats['avg_duration'].keys())
+                for key, value in expected_stats['avg_duration'].items():
+                    self.assertAlmostEqual(stats['avg_duration'][key], value)
+                self.assertEqual(parser.filter_by_status([500]), lazy.filter_by_status([500]))
+                self.assertEqual(parser.filter_by_duration(min_duration=20000),
+                                 lazy.filter_by_duration(min_duration=20000))
+
+    def test_rollup_slots(self):
+        for schema in self.schemas:
+            rows = list(LogParser(self.log_path, lazy=True, schema=schema).iter_rows())
+            expected = sum(
+                is_request_slot(row[status_column], row[duration_column])
+                for row in rows
+                for status_column, _, duration_column in schema.request_columns
+            )
+            store = RollupStore(os.path.join(self.directory, f'rollup{schema.request_slots}.sqlite3'),
+                                schema=schema)
+            try:
+                store.add_rows(rows)
+                requests = store.connection.execute('SELECT SUM(requests), MAX(slot) FROM rollup').fetchone()
+            finally:
+                store.close()
+            self.assertEqual(requests[0], expected)
+            self.assertLessEqual(requests[1], schema.request_slots)
+
+
+if __name__ == '__main__':
+    unittest.main()
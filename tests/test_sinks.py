@@ -0,0 +1,122 @@
+"""
+Локальные получатели при повторной записи: после ротации файл читается с начала, а порция,
+которую не принял другой получатель, приходит еще раз - уже сохраненные строки
+не должны записываться и учитываться второй раз
+"""
+import os
+import csv
+import sys
+import gzip
+import sqlite3
+import shutil
+import tempfile
+import unittest
+
+import sheets_uploader
+from benchmarks.log_generator import LogGenerator
+from parser import LogParser, SHEET_HEADERS
+from sinks import FanoutSink, Sink, create_local_sink
+from sketches import SketchStore
+
+
+class SinkRotationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logs_dir = os.path.join(self.directory, 'logs')
+        os.makedirs(self.logs_dir)
+        self.log_path = os.path.join(self.logs_dir, 'a.txt')
+        LogGenerator(seed=11, malformed_ratio=0.1).write(self.log_path, 1500)
+
+        self.state_dir = os.path.join(self.directory, 'state')
+        self.saved_state_dir = sheets_uploader.STATE_DIRECTORY
+        sheets_uploader.STATE_DIRECTORY = self.state_dir
+        self.saved_argv = sys.argv
+
+    def tearDown(self):
+        sheets_uploader.STATE_DIRECTORY = self.saved_state_dir
+        sys.argv = self.saved_argv
+        shutil.rmtree(self.directory)
+
+    def _run(self, *sinks):
+        sys.argv = ['sheets_uploader.py', self.logs_dir, '--queue-size', '0']
+        for sink in sinks:
+            sys.argv += ['--sink', sink]
+        sheets_uploader.main()
+
+    def _rotate(self):
+        # Ротация со сжатием: у файла новое имя и inode, контрольной точки для него нет
+        with open(self.log_path, 'rb') as source, gzip.open(self.log_path + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(self.log_path)
+
+    def _sketch_total(self, path):
+        store = SketchStore(path)
+        try:
+            return sum(histogram.total for histogram in store.query().values())
+        finally:
+            store.close()
+
+    def _unique_rows(self):
+        """Строки лога без повторов по Start DateTime и End DateTime, как их пишут получатели"""
+        parser = LogParser(self.log_path, lazy=True)
+        start, end = parser.schema.column('Start DateTime'), parser.schema.column('End DateTime')
+        return list({(row[start], row[end]): row for row in reversed(list(parser.iter_rows()))}.values())[::-1]
+
+    def _local_sink_specs(self):
+        return [f'jsonl:{os.path.join(self.directory, "out.jsonl")}',
+                f'csv:{os.path.join(self.directory, "out.csv")}',
+                f'sqlite:{os.path.join(self.directory, "out.sqlite3")}']
+
+    def _local_rows(self):
+        with open(os.path.join(self.directory, 'out.jsonl'), encoding='utf-8') as file:
+            jsonl_rows = sum(1 for _ in file)
+        with open(os.path.join(self.directory, 'out.csv'), encoding='utf-8', newline='') as file:
+            csv_rows = sum(1 for _ in csv.reader(file)) - 1
+        connection = sqlite3.connect(os.path.join(self.directory, 'out.sqlite3'))
+        try:
+            sqlite_rows = connection.execute('SELECT COUNT(*) FROM logs').fetchone()[0]
+        finally:
+            connection.close()
+        return jsonl_rows, csv_rows, sqlite_rows
+
+    def test_local_sinks_not_duplicated_after_rotation(self):
+        sinks = self._local_sink_specs()
+        expected = len(self._unique_rows())
+        self._run(*sinks)
+        self.assertEqual(self._local_rows(), (expected,) * 3)
+
+        self._rotate()
+        self._run(*sinks)
+        self.assertEqual(self._local_rows(), (expected,) * 3)
+
+    def test_local_sinks_skip_retried_batch(self):
+        class FailingSink(Sink):
+            name = 'failing'
+            fail = True
+
+            def write(self, data):
+                return not self.fail
+
+        failing = FailingSink()
+        sink = FanoutSink([create_local_sink(spec) for spec in self._local_sink_specs()] + [failing])
+        data = [SHEET_HEADERS] + self._unique_rows()
+        self.assertFalse(sink.write(data))
+        failing.fail = False
+        self.assertTrue(sink.write(data))
+        sink.close()
+        self.assertEqual(self._local_rows(), (len(data) - 1,) * 3)
+
+    def test_sketch_not_counted_twice_after_rotation(self):
+        path = os.path.join(self.state_dir, 'latency.sqlite3')
+        self._run(f'sketch:{path}')
+        total = self._sketch_total(path)
+        self.assertGreater(total, 0)
+
+        self._rotate()
+        self._run(f'sketch:{path}')
+        self.assertEqual(self._sketch_total(path), total)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Дымовой тест загрузки: SheetsUploader пишет в локальную замену Google Sheets
+(benchmarks/fake_sheets.py), и содержимое листа сверяется с разобранным логом по ячейкам
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import sheets_uploader
+from benchmarks.fake_sheets import FakeBackend, FakeClient
+from benchmarks.log_generator import LogGenerator
+from parser import LogParser, SHEET_HEADERS
+
+
+class UploaderSmokeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'log.txt')
+        LogGenerator(seed=7, malformed_ratio=0.1).write(self.log_path, 4000)
+
+        self.client = FakeClient(FakeBackend())
+        self.patches = {
+            'STATE_DIRECTORY': os.path.join(self.directory, 'state'),
+            'UPLOAD_MODE': sheets_uploader.UPLOAD_MODE,
+            'CHUNK_MAX_ROWS': 100,
+            'SHEETS_REQUESTS_PER_MINUTE': 100000,
+        }
+        self.saved = {name: getattr(sheets_uploader, name) for name in self.patches}
+        for name, value in self.patches.items():
+            setattr(sheets_uploader, name, value)
+        self.saved_get_client = sheets_uploader.SheetsUploader._get_client
+        sheets_uploader.SheetsUploader._get_client = lambda uploader: self.client
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(sheets_uploader, name, value)
+        sheets_uploader.SheetsUploader._get_client = self.saved_get_client
+        shutil.rmtree(self.directory)
+
+    def _sheet(self):
+        return next(iter(self.client.spreadsheets.values())).sheet1
+
+    def _upload_and_check(self):
+        # Загружается то же, что в основном пути (потоковое преобразование строк лога),
+        # а сверяется с разбором через словари записей
+        rows = list(LogParser(self.log_path, lazy=True).iter_rows())
+        expected = [SHEET_HEADERS] + [list(row) for row in LogParser(self.log_path).iter_rows()]
+        self.assertGreater(len(expected), 500)
+
+        uploader = sheets_uploader.SheetsUploader()
+        self.assertTrue(uploader.upload_data([SHEET_HEADERS] + rows))
+        self._check_sheet(expected)
+
+        # Повторная загрузка тех же строк отбрасывается как дубликаты
+        self.assertTrue(uploader.upload_data([SHEET_HEADERS] + rows))
+        self._check_sheet(expected)
+        uploader.close()
+
+    def _check_sheet(self, expected):
+        data = self._sheet().data
+        self.assertEqual(len(data), len(expected))
+        for number, (row, expected_row) in enumerate(zip(data, expected), 1):
+            self.assertEqual(len(row), len(SHEET_HEADERS), f'строка {number}')
+            self.assertEqual(row, expected_row, f'строка {number}')
+
+    def test_append_mode(self):
+        sheets_uploader.UPLOAD_MODE = 'append'
+        self._upload_and_check()
+
+    def test_cursor_mode(self):
+        sheets_uploader.UPLOAD_MODE = 'cursor'
+        self._upload_and_check()
+
+    def test_compact_errors(self):
+        sheets_uploader.UPLOAD_MODE = 'append'
+        parser = LogParser(self.log_path, lazy=True)
+        rows = list(parser.iter_rows())
+        expected = [SHEET_HEADERS] + rows
+
+        uploader = sheets_uploader.SheetsUploader(compact_errors=True)
+        self.assertTrue(uploader.upload_data([SHEET_HEADERS] + rows))
+        uploader.close()
+
+        # В словаре только тексты ошибок запросов, Session ID коротких записей остаются на листе
+        errors = next(iter(self.client.spreadsheets.values())).worksheet_by_title(sheets_uploader.ERRORS_WORKSHEET)
+        dictionary = dict(errors.data[1:])
+        self.assertEqual(dictionary, parser.error_dictionary())
+        self.assertLess(len(dictionary), 100)
+        data = self._sheet().data
+        self.assertEqual(len(data), len(expected))
+        for number, (row, expected_row) in enumerate(zip(data[1:], expected[1:]), 2):
+            self.assertEqual([dictionary.get(value, value) for value in row], expected_row, f'строка {number}')
+
+
+if __name__ == '__main__':
+    unittest.main()
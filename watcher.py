@@ -0,0 +1,79 @@
+import os
+import time
+import logging
+from typing import Dict, Tuple
+
+try:
+    import inotify_simple
+except ImportError:  # inotify_simple - необязательная зависимость, без нее директория опрашивается
+    inotify_simple = None
+
+
+class DirectoryWatcher:
+    """
+    Ожидание изменений в директории с логами
+    В Linux с пакетом inotify_simple используется inotify, иначе директория периодически
+    опрашивается и сравниваются размеры и время изменения файлов
+    """
+
+    def __init__(self, path: str, poll_interval: float = 5.0):
+        """
+        :param path: директория с логами
+        :param poll_interval: период опроса, если inotify недоступен
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.snapshot = {}
+
+        if inotify_simple is not None:
+            try:
+                flags = inotify_simple.flags
+                self.inotify = inotify_simple.INotify()
+                self.inotify.add_watch(path, flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE |
+                                       flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE)
+                logging.info(f"Отслеживание изменений в {path} через inotify")
+            except OSError as e:
+                logging.warning(f"inotify недоступен ({e}), директория будет опрашиваться")
+                self.inotify = None
+        if self.inotify is None:
+            self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, int, float]]:
+        snapshot = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime)
+        except OSError as e:
+            logging.error(f"Ошибка при чтении директории {self.path}: {e}")
+        return snapshot
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Ждет изменений в директории не дольше timeout секунд
+        :return: True, если что-то изменилось
+        """
+        if self.inotify is not None:
+            events = self.inotify.read(timeout=max(int(timeout * 1000), 0))
+            return bool(events)
+
+        # Снимок сравнивается с предыдущим, поэтому изменения между вызовами тоже не теряются,
+        # а директория читается один раз за период опроса
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(min(self.poll_interval, deadline - time.monotonic()), 0))
+            snapshot = self._take_snapshot()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()